@@ -1,122 +1,298 @@
 from flask import Flask, jsonify, request
-import subprocess
-import requests
-import json
+import math
 import threading
 import time
-from prometheus_client import CollectorRegistry, Gauge, generate_latest
+import os
+from prometheus_client import CollectorRegistry, Gauge
+from scrape_engine import SCRAPE_ENGINES, node_matcher
+from prometheus_http import get_client
+from async_scrape_engine import AsyncScrapeEngine
+from scaphandre_source import scrape_scaphandre
+from pod_index import PodIndex, pod_component, run_pod_index
+from exposition import ExpositionCache, LabelledGauge
+from history import PowerHistory
+from energy import EnergyIntegrator
+import self_metrics
+from snapshot import ServingState, SnapshotReader, SnapshotWriter
 
 app = Flask(__name__)
 
+# Process role:
+# - "standalone": scrape and serve in this process (default)
+# - "scraper": scrape only, and publish every cycle to the snapshot file
+# - "server": serve only, from the snapshot file (run any number of WSGI workers: gunicorn -w 4 app:app)
+EXPORTER_ROLE = os.environ.get("EXPORTER_ROLE", "standalone")
+# Snapshot file shared by the scraper and the serving workers (/dev/shm keeps it in memory)
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "/dev/shm/power-metrics-snapshot")
+# Seconds between two writes of the history next to the snapshot (the latest values are written every cycle)
+SNAPSHOT_HISTORY_PERIOD = float(os.environ.get("SNAPSHOT_HISTORY_PERIOD", "30"))
+
+# Node-local mode (DaemonSet): only index the pods of this node and only query its Scaphandre series
+NODE_NAME = os.environ.get("NODE_NAME", "")
+# Label of the Scaphandre series in Prometheus holding the node name
+SCAPHANDRE_NODE_LABEL = os.environ.get("SCAPHANDRE_NODE_LABEL", "node")
+
 # Constants for Prometheus URL
 PROMETHEUS_URL = "http://prometheus-server.default.svc.cluster.local:80/"  # Change to your Prometheus server URL
 
-# Prometheus client registry
+# Where pod power is read from: "prometheus", or "scaphandre" to scrape the Scaphandre exporters directly
+METRICS_SOURCE = os.environ.get("METRICS_SOURCE", "prometheus")
+# Comma-separated base URLs of the Scaphandre exporters, used when METRICS_SOURCE is "scaphandre"
+SCAPHANDRE_URLS = [url for url in os.environ.get("SCAPHANDRE_URLS", "http://scaphandre.default.svc.cluster.local:8080").split(",") if url]
+
+# Scrape engine: "async" (asyncio engine with deadlines), or the blocking "grouped" (one
+# sum(...) by (container_id) query per shard) and "per-pod" (one query per pod) engines
+SCRAPE_ENGINE = os.environ.get("SCRAPE_ENGINE", "async")
+# Number of shards the grouped query is split in (1 = a single query per cycle)
+SCRAPE_SHARDS = int(os.environ.get("SCRAPE_SHARDS", "1"))
+# Seconds between two scrape cycles
+SCRAPE_PERIOD = float(os.environ.get("SCRAPE_PERIOD", "5"))
+
+# Async engine settings: queries ("grouped" or "per-pod"), requests in flight and deadlines in seconds
+# (REQUEST_TIMEOUT is also the timeout of the blocking engines and of the Scaphandre source)
+ASYNC_QUERY_MODE = os.environ.get("ASYNC_QUERY_MODE", "grouped")
+ASYNC_MAX_CONCURRENCY = int(os.environ.get("ASYNC_MAX_CONCURRENCY", "8"))
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", "2"))
+CYCLE_DEADLINE = float(os.environ.get("CYCLE_DEADLINE", "4"))
+
+# Minutes of power samples kept in memory for /api/metrics-by-pod/history
+HISTORY_MINUTES = float(os.environ.get("HISTORY_MINUTES", "15"))
+
+# File the energy counters are checkpointed to, so they survive restarts ("" to disable)
+ENERGY_CHECKPOINT_PATH = os.environ.get("ENERGY_CHECKPOINT_PATH", "/var/lib/power-metrics/energy_checkpoint.json")
+
+# Prometheus client registry, with the exporter self-instrumentation (power_exporter_ prefix)
 registry = CollectorRegistry()
+self_metrics.register(registry)
 
-# Global variable to store pod metrics and UID to pod mapping
+# Global variable to store pod metrics, and the time each pod value was last refreshed
 pod_metrics = {}
-uid_pod_map = {}
+pod_last_update = {}
+
+# Fixed-memory ring buffers with the recent power samples of each pod
+pod_history = PowerHistory(HISTORY_MINUTES * 60, SCRAPE_PERIOD)
+
+# UID to pod mapping, kept current by the Kubernetes watch API
+pod_index = PodIndex()
 
 # Define Prometheus Gauge to represent pod power consumption
 pod_power_gauge = Gauge('pod_power_consumption_mw', 'Pod Power Consumption in mW', ['pod'], registry=registry)
+pod_power_series = LabelledGauge(pod_power_gauge, 'pod')
 
-# Function to get pod information and UID based on a search term
-def get_uid_pod_map():
-    """Retrieve a dictionary mapping pod names to their truncated UIDs (last segment)."""
-    uid_pod_map = {}
-    try:
-        # Get the output of the kubectl command to find the pods with their UIDs
-        result = subprocess.run(
-            ['kubectl', 'get', 'pods', '-A', '-o', 'json'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        pods_info = json.loads(result.stdout)
-        for item in pods_info.get('items', []):
-            pod_name = item['metadata']['name']
-            uid = item['metadata']['uid']
-            truncated_uid = uid.split('-')[-1]  # Take the last part of the UID
-            uid_pod_map[truncated_uid] = pod_name  # Map truncated UID to pod name
-
-        return uid_pod_map
-
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing kubectl: {e}")
-        return {}
-
-# Fetch metrics from Prometheus for a specific truncated UID
-def fetch_metrics_for_uid(truncated_uid):
-    """Fetches metrics from Prometheus for a specific truncated UID."""
-    query = f'sum(scaph_process_power_consumption_microwatts{{container_id="{truncated_uid}"}}) / 1000000'
-    try:
-        response = requests.get(f"{PROMETHEUS_URL}/api/v1/query", params={'query': query})
-        response.raise_for_status()  # Raise an error for bad responses
-        metrics_data = response.json()
-        return metrics_data.get('data', {}).get('result', [])
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching metrics for truncated UID {truncated_uid}: {e}")
-        return []
+# Age of each pod value: 0 when refreshed by the last cycle, growing while the pod is stale
+pod_staleness_gauge = Gauge('pod_power_staleness_seconds', 'Seconds since the pod power value was last refreshed', ['pod'], registry=registry)
+pod_staleness_series = LabelledGauge(pod_staleness_gauge, 'pod')
+
+# Power rolled up per RAN component and per namespace, computed once per cycle
+component_power_gauge = Gauge('component_power_consumption_mw', 'Component Power Consumption in mW', ['component'], registry=registry)
+component_power_series = LabelledGauge(component_power_gauge, 'component')
+namespace_power_gauge = Gauge('namespace_power_consumption_mw', 'Namespace Power Consumption in mW', ['namespace'], registry=registry)
+namespace_power_series = LabelledGauge(namespace_power_gauge, 'namespace')
+
+# Cumulative energy counters per pod and per component, integrated from the power samples
+energy_integrator = EnergyIntegrator(registry, checkpoint_path=ENERGY_CHECKPOINT_PATH or None, checkpoint_interval=SCRAPE_PERIOD)
+
+# /metrics payload, rendered once per scrape cycle
+exposition_cache = ExpositionCache(registry)
+
+# Snapshot shared with the serving workers: written by the scraper, read by the servers
+snapshot_writer = SnapshotWriter(SNAPSHOT_PATH, SNAPSHOT_HISTORY_PERIOD) if EXPORTER_ROLE == "scraper" else None
+snapshot_reader = None
+if EXPORTER_ROLE == "server":
+    snapshot_reader = SnapshotReader(SNAPSHOT_PATH, lambda: ServingState(
+        PodIndex(), {}, {}, PowerHistory(HISTORY_MINUTES * 60, SCRAPE_PERIOD), ExpositionCache(None)))
+
+# State the HTTP endpoints read from: this process, or the latest snapshot in the "server" role
+def serving_state():
+    if snapshot_reader is not None:
+        return snapshot_reader.current()
+    return ServingState(pod_index, pod_metrics, pod_last_update, pod_history, exposition_cache)
+
+# Update the gauges from the latest pod metrics and render the /metrics payload
+def publish_metrics(new_metrics, staleness, classification):
+    pod_power_series.update(new_metrics)  # Series of pods that disappeared are evicted
+    pod_staleness_series.update(staleness)
+
+    # Roll up the pod power per component and per namespace
+    power_by_component = {}
+    power_by_namespace = {}
+    for pod, power in new_metrics.items():
+        namespace, component = classification.get(pod, ("unknown", pod_component(pod)))
+        power_by_component[component] = power_by_component.get(component, 0.0) + power
+        power_by_namespace[namespace] = power_by_namespace.get(namespace, 0.0) + power
+    component_power_series.update(power_by_component)
+    namespace_power_series.update(power_by_namespace)
+
+    self_metrics.uid_pod_map_size.set(len(pod_index))
+    self_metrics.pod_metrics_size.set(len(new_metrics))
+    self_metrics.pod_metrics_max_age.set(max(staleness.values(), default=0))
+    self_metrics.stale_pods.set(sum(1 for age in staleness.values() if age > 0))
+    with self_metrics.render_seconds.time():
+        exposition_cache.render()
+
+# Merge the results of a scrape cycle: missed pods keep their last value and are marked stale.
+# The energy is integrated on the sample timestamps of the pods (sample_times), not on the cycle time
+def update_pod_metrics(fresh_metrics, missed_pods, sample_times=None):
+    global pod_metrics  # Declare pod_metrics as global to modify it
+    now = time.time()
+    classification = pod_index.classification()
+    new_metrics = dict(fresh_metrics)
+    for pod in missed_pods:
+        if pod in pod_metrics and pod not in new_metrics:
+            new_metrics[pod] = pod_metrics[pod]
+    for pod in fresh_metrics:
+        pod_last_update[pod] = now
+    pod_history.append(fresh_metrics, now)  # Only fresh values go in the history
+    component_of = lambda pod: classification[pod][1] if pod in classification else pod_component(pod)
+    energy_integrator.update(fresh_metrics, now, component_of, new_metrics.keys(), sample_times)
+    for pod in pod_last_update.keys() - new_metrics.keys():
+        del pod_last_update[pod]
 
-# Background thread function to scrape and update metrics every 0.5 seconds
+    pod_metrics = new_metrics  # Update global variable with the new metrics
+    publish_metrics(new_metrics, {pod: now - pod_last_update[pod] for pod in new_metrics}, classification)
+    if snapshot_writer is not None:
+        snapshot_writer.write(serving_state())
+
+# Shared pooled Prometheus client of the scrape engines: exporter timeout, a circuit breaker
+# that lets a trial query through after two scrape periods, and the self-instrumentation hook
+def prometheus_client():
+    return get_client(PROMETHEUS_URL, timeout=REQUEST_TIMEOUT, reset_timeout=2 * SCRAPE_PERIOD,
+                      metrics_hook=self_metrics.observe_source_request)
+
+# Background thread function to scrape and update metrics with a blocking engine
 def scrape_metrics():
-    global pod_metrics, uid_pod_map   # Declare pod_metrics as global to modify it
-    while True:
-        new_metrics = {}  # Temporary dictionary to hold the latest metrics
-        for truncated_uid, pod_name in uid_pod_map.items():
-            metrics = fetch_metrics_for_uid(truncated_uid)
-            if metrics:
-                # Use the latest value available for this metric
-                latest_value = float(metrics[0]['value'][1])
-                new_metrics[pod_name] = latest_value  # Save in the temporary dictionary
-        
-        pod_metrics = new_metrics  # Update global variable with the new metrics
-        
-        # Wait for 0.5 seconds before the next scrape
-        time.sleep(5)
-
-# Background thread function to update the UID to pod mapping every 5 seconds
-def update_uid_pod_map():
-    global uid_pod_map  # Declare uid_pod_map as global to modify it
+    scrape = SCRAPE_ENGINES.get(SCRAPE_ENGINE, SCRAPE_ENGINES["grouped"])
+    # Create the shared pooled client with the exporter settings before the engines use it
+    prometheus_client()
     while True:
-        uid_pod_map = get_uid_pod_map()  # Update the global uid_pod_map
-        # Wait for 5 seconds before the next update
-        time.sleep(5)
+        start = time.monotonic()
+        # Temporary dictionary holding the latest metrics, swapped in at the end of the cycle
+        sample_times = {}
+        if METRICS_SOURCE == "scaphandre":
+            new_metrics = scrape_scaphandre(SCAPHANDRE_URLS, pod_index.snapshot(), REQUEST_TIMEOUT, sample_times)
+        else:
+            new_metrics = scrape(PROMETHEUS_URL, pod_index.snapshot(), SCRAPE_SHARDS, node_matcher(NODE_NAME, SCAPHANDRE_NODE_LABEL),
+                                 timestamps=sample_times)
+        update_pod_metrics(new_metrics, set(), sample_times)
+        elapsed = time.monotonic() - start
+        self_metrics.observe_cycle(elapsed, SCRAPE_PERIOD)
+
+        # Wait for the rest of the period, so a cycle starts every SCRAPE_PERIOD seconds
+        time.sleep(max(0.0, SCRAPE_PERIOD - elapsed))
+
+# Background thread function to scrape and update metrics with the asyncio engine
+def scrape_metrics_async():
+    engine = AsyncScrapeEngine(
+        PROMETHEUS_URL.rstrip('/'),
+        query_mode=ASYNC_QUERY_MODE,
+        shards=SCRAPE_SHARDS,
+        max_concurrency=ASYNC_MAX_CONCURRENCY,
+        request_timeout=REQUEST_TIMEOUT,
+        cycle_deadline=CYCLE_DEADLINE,
+        base_matcher=node_matcher(NODE_NAME, SCAPHANDRE_NODE_LABEL),
+        client=prometheus_client(),  # Same retry policy, circuit breaker and latency stats as the blocking engines
+    )
+    engine.run(pod_index.snapshot, update_pod_metrics, SCRAPE_PERIOD)
+
+# Start the background threads, only in the processes that scrape
+def start_background_threads():
+    energy_integrator.load_checkpoint()
+    use_async_engine = SCRAPE_ENGINE == "async" and METRICS_SOURCE == "prometheus"
+    threading.Thread(target=scrape_metrics_async if use_async_engine else scrape_metrics, daemon=True).start()
+    threading.Thread(target=run_pod_index, args=(pod_index, NODE_NAME or None), daemon=True).start()
 
-# Start the background threads
-threading.Thread(target=scrape_metrics, daemon=True).start()
-threading.Thread(target=update_uid_pod_map, daemon=True).start()
+if EXPORTER_ROLE in ("standalone", "scraper"):
+    start_background_threads()
+
+# Answer 503 until the scraper has published a first snapshot
+@app.before_request
+def require_serving_state():
+    if serving_state() is None:
+        return jsonify({"error": "No metrics snapshot yet"}), 503
 
 # Get all pod metrics and expose them in Prometheus format
 @app.route('/metrics', methods=['GET'])
 def metrics():
-    # Clear the registry before populating with new data
-    #registry.clear()  # Clear previous metrics
-
-    # Populate the Gauge with values from the global pod_metrics variable
-    for pod, power in pod_metrics.items():
-        pod_power_gauge.labels(pod=pod).set(power)
+    # Serve the payload rendered at the end of the last scrape cycle
+    state = serving_state()
+    return state.exposition_cache.response(request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
 
-    return generate_latest(registry)
+# Cached metrics of a pod, in the same shape as a Prometheus instant query result
+def cached_metrics_for_pod(state, pod_name):
+    value = state.pod_metrics.get(pod_name)
+    if value is None:
+        return []
+    return [{"metric": {}, "value": [state.pod_last_update.get(pod_name, time.time()), str(value)]}]
 
-# Endpoint to get metrics by pod
+# Endpoint to get metrics by pod, answered from the latest scrape cycle
 @app.route('/api/metrics-by-pod', methods=['GET'])
 def get_metrics_by_pod():
     search_term = request.args.get('search_term')
     if not search_term:
         return jsonify({"error": "Search term is required"}), 400
 
-    # Find the truncated UID based on the provided search term (pod name)
-    truncated_uid = next((uid for uid, name in uid_pod_map.items() if search_term in name), None)
-    
+    # Find the pod based on the provided search term (pod name)
+    state = serving_state()
+    truncated_uid, pod_name = state.pod_index.find(search_term)
+
+    if not truncated_uid:
+        return jsonify({"error": "Pod not found"}), 404
+
+    return jsonify(cached_metrics_for_pod(state, pod_name))
+
+# Endpoint to get metrics for many search terms at once, answered from the latest scrape cycle
+@app.route('/api/metrics-by-pod/batch', methods=['GET', 'POST'])
+def get_metrics_by_pod_batch():
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        search_terms = body.get('search_terms', []) if isinstance(body, dict) else None
+    else:
+        search_terms = request.args.getlist('search_term')
+    if not isinstance(search_terms, list) or not all(isinstance(search_term, str) and search_term for search_term in search_terms):
+        return jsonify({"error": "search_terms must be a list of non-empty strings"}), 400
+    if not search_terms:
+        return jsonify({"error": "At least one search term is required"}), 400
+
+    state = serving_state()
+    results = {}
+    for search_term in search_terms:
+        truncated_uid, pod_name = state.pod_index.find(search_term)
+        if not truncated_uid:
+            results[search_term] = {"error": "Pod not found"}
+        else:
+            results[search_term] = {"pod": pod_name, "result": cached_metrics_for_pod(state, pod_name)}
+    return jsonify(results)
+
+# Endpoint to get the recent power history of a pod from the in-memory ring buffers
+@app.route('/api/metrics-by-pod/history', methods=['GET'])
+def get_metrics_history_by_pod():
+    search_term = request.args.get('search_term')
+    if not search_term:
+        return jsonify({"error": "Search term is required"}), 400
+    try:
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - HISTORY_MINUTES * 60))
+        step = float(request.args['step']) if request.args.get('step') else None
+    except ValueError:
+        return jsonify({"error": "start, end and step must be numbers"}), 400
+    if not all(math.isfinite(value) for value in (start, end, step or 1)):
+        return jsonify({"error": "start, end and step must be finite"}), 400
+    if step is not None and step <= 0:
+        return jsonify({"error": "step must be positive"}), 400
+
+    state = serving_state()
+    truncated_uid, pod_name = state.pod_index.find(search_term)
     if not truncated_uid:
         return jsonify({"error": "Pod not found"}), 404
 
-    metrics = fetch_metrics_for_uid(truncated_uid) 
-    return jsonify(metrics)
+    # Same shape as a Prometheus range query result
+    values = [[timestamp, str(value)] for timestamp, value in state.pod_history.query(pod_name, start, end, step)]
+    return jsonify([{"metric": {"pod": pod_name}, "values": values}] if values else [])
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)  # Change port as necessary
+    if EXPORTER_ROLE == "scraper":
+        # Only scrape and publish the snapshot, the serving workers answer HTTP requests
+        threading.Event().wait()
+    else:
+        app.run(host='0.0.0.0', port=5000)  # Change port as necessary
 
@@ -0,0 +1,168 @@
+import asyncio
+import time
+
+import aiohttp
+
+import self_metrics
+from prometheus_http import RETRY_STATUS_CODES, CircuitOpenError
+from scrape_engine import HEX_DIGITS, POWER_METRIC, build_grouped_query, join_matchers, join_uid_pod_map, shard_matchers
+
+# Asyncio scrape engine.
+#
+# Every query goes through one aiohttp session with a bounded number of requests in
+# flight, and each request has its own timeout. The whole cycle also has a deadline:
+# queries still running when it expires are cancelled, the cycle publishes what it
+# got, and the pods covered by the missing queries are reported as missed so the app
+# can keep their last value and mark it stale.
+#
+# With a PrometheusClient (the shared client of prometheus_http.get_client) the requests
+# follow its policy: retries with full-jitter backoff on connection errors, timeouts and
+# 5xx/429 answers, its circuit breaker, and its per-query latency stats.
+
+
+def shard_of(truncated_uid, shards):
+    """Index of the grouped-query shard that covers this truncated UID."""
+    if shards <= 1:
+        return 0
+    return HEX_DIGITS.index(truncated_uid[-1].lower()) % min(shards, len(HEX_DIGITS))
+
+
+class AsyncScrapeEngine:
+    """
+    Args:
+        prometheus_url (str): Base URL of the Prometheus server.
+        query_mode (str): "grouped" (one query per shard) or "per-pod" (one query per pod).
+        shards (int): Number of shards of the grouped query.
+        max_concurrency (int): Maximum number of Prometheus requests in flight.
+        request_timeout (float): Deadline of a single request, in seconds.
+        cycle_deadline (float): Deadline of a whole scrape cycle, in seconds.
+        base_matcher (str): Label matcher added to every query (e.g. node="worker-1").
+        client (PrometheusClient): Optional client whose retry policy, circuit breaker and
+            latency stats the requests go through (a single attempt per request if None).
+    """
+
+    def __init__(self, prometheus_url, query_mode="grouped", shards=1, max_concurrency=8,
+                 request_timeout=2.0, cycle_deadline=4.0, base_matcher="", client=None):
+        self.prometheus_url = prometheus_url
+        self.client = client
+        self.base_matcher = base_matcher
+        self.query_mode = query_mode
+        self.shards = shards
+        self.max_concurrency = max_concurrency
+        self.request_timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self.cycle_deadline = cycle_deadline
+        self._semaphore = None
+
+    async def _get(self, session, query):
+        async with session.get(f"{self.prometheus_url}/api/v1/query", params={'query': query},
+                               timeout=self.request_timeout) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _query(self, session, query):
+        client = self.client
+        if client is None:
+            async with self._semaphore:
+                with self_metrics.timed_request("prometheus"):
+                    metrics_data = await self._get(session, query)
+            return metrics_data.get('data', {}).get('result', [])
+
+        name = "per-pod" if self.query_mode == "per-pod" else "grouped"
+        async with self._semaphore:
+            if not client.breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {self.prometheus_url}, not sending the {name} query")
+            start = time.perf_counter()
+            try:
+                # Timed as one call by record_call, like the calls of the client itself
+                for attempt in range(client.retries + 1):
+                    try:
+                        metrics_data = await self._get(session, query)
+                        break
+                    except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+                        retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUS_CODES
+                        if not retryable or attempt == client.retries:
+                            raise
+                        await asyncio.sleep(client.backoff_delay(attempt))
+            except aiohttp.ClientResponseError as e:
+                # A 4xx answer means the query is wrong, not that the server is down
+                client.record_call(name, time.perf_counter() - start, error=True, server_down=e.status >= 500 or e.status == 429)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, asyncio.CancelledError, ValueError):
+                # Cancelled: the cycle deadline expired while the request was running
+                client.record_call(name, time.perf_counter() - start, error=True, server_down=True)
+                raise
+            client.record_call(name, time.perf_counter() - start)
+        return metrics_data.get('data', {}).get('result', [])
+
+    async def _fetch_shard(self, session, matcher):
+        values_by_container = {}
+        for entry in await self._query(session, build_grouped_query(join_matchers(matcher, self.base_matcher))):
+            container_id = entry.get('metric', {}).get('container_id')
+            if container_id is not None:
+                values_by_container[container_id] = (float(entry['value'][0]), float(entry['value'][1]))
+        return values_by_container
+
+    async def _fetch_uid(self, session, truncated_uid):
+        matcher = join_matchers(f'container_id="{truncated_uid}"', self.base_matcher)
+        query = f'sum({POWER_METRIC}{{{matcher}}}) / 1000000'
+        result = await self._query(session, query)
+        return {truncated_uid: (float(result[0]['value'][0]), float(result[0]['value'][1]))} if result else {}
+
+    def _plan(self, session, uid_pod_map):
+        """Create one task per query, each with the truncated UIDs it covers."""
+        if self.query_mode == "per-pod":
+            return {asyncio.ensure_future(self._fetch_uid(session, uid)): [uid] for uid in uid_pod_map}
+
+        covered = [[] for _ in shard_matchers(self.shards)]
+        for truncated_uid in uid_pod_map:
+            covered[shard_of(truncated_uid, self.shards)].append(truncated_uid)
+        return {
+            asyncio.ensure_future(self._fetch_shard(session, matcher)): uids
+            for matcher, uids in zip(shard_matchers(self.shards), covered)
+        }
+
+    async def scrape_cycle(self, session, uid_pod_map):
+        """
+        Run one scrape cycle within the cycle deadline.
+
+        Returns:
+            tuple: (pod name -> value in Watts, set of pod names whose query missed the deadline or failed,
+            pod name -> timestamp of its sample)
+        """
+        tasks = self._plan(session, uid_pod_map)
+        if not tasks:
+            return {}, set(), {}
+        done, pending = await asyncio.wait(tasks, timeout=self.cycle_deadline)
+        for task in pending:
+            task.cancel()
+
+        new_metrics = {}
+        missed = set()
+        timestamps = {}
+        for task, uids in tasks.items():
+            if task in done and task.exception() is None:
+                new_metrics.update(join_uid_pod_map(task.result(), {uid: uid_pod_map[uid] for uid in uids}, timestamps))
+            else:
+                if task in done:
+                    print(f"Error fetching metrics for {len(uids)} pods: {task.exception()!r}")
+                missed.update(uid_pod_map[uid] for uid in uids)
+
+        if pending:
+            print(f"Scrape cycle deadline of {self.cycle_deadline}s expired, {len(missed)} pods are stale")
+        return new_metrics, missed, timestamps
+
+    async def run_forever(self, get_uid_pod_map, on_cycle, period):
+        """Scrape every `period` seconds and hand the results of each cycle to on_cycle(new_metrics, missed, timestamps)."""
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            while True:
+                start = time.monotonic()
+                on_cycle(*await self.scrape_cycle(session, get_uid_pod_map()))
+                elapsed = time.monotonic() - start
+                self_metrics.observe_cycle(elapsed, period)
+                await asyncio.sleep(max(0.0, period - elapsed))
+
+    def run(self, get_uid_pod_map, on_cycle, period):
+        """Blocking entry point for a background thread."""
+        asyncio.run(self.run_forever(get_uid_pod_map, on_cycle, period))
@@ -0,0 +1,113 @@
+"""
+Benchmark the streaming Scaphandre parser on large exposition payloads.
+
+A local fixture server stands in for the Scaphandre exporter and serves a synthetic
+/metrics payload with, for every process, the power metric we keep and the other
+per-process metrics Scaphandre exports (which the parser has to skip). The streaming
+parser is compared with a full parse of the same payload by prometheus_client.
+
+Usage:
+    python3 benchmarks/benchmark_scaphandre_parser.py [--processes 1000 10000 50000]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client.parser import text_string_to_metric_families
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scaphandre_parser import parse_power_lines
+from scaphandre_source import fetch_scaphandre_power
+
+# Per-process metrics exported by Scaphandre next to the power one
+OTHER_PROCESS_METRICS = [
+    "scaph_process_cpu_usage_percentage",
+    "scaph_process_memory_bytes",
+    "scaph_process_memory_virtual_bytes",
+    "scaph_process_disk_write_bytes",
+    "scaph_process_disk_read_bytes",
+]
+
+
+def make_payload(num_processes, containers=200):
+    """Build a Scaphandre-like exposition with num_processes processes spread over `containers` containers."""
+    lines = [
+        "# HELP scaph_host_power_microwatts Power measurement on the whole host, in microwatts",
+        "# TYPE scaph_host_power_microwatts gauge",
+        "scaph_host_power_microwatts 52000000",
+    ]
+    for metric in ["scaph_process_power_consumption_microwatts"] + OTHER_PROCESS_METRICS:
+        lines.append(f"# HELP {metric} {metric}")
+        lines.append(f"# TYPE {metric} gauge")
+        for pid in range(num_processes):
+            labels = (f'pid="{pid}",exe="iperf",cmdline="iperf -s -i 1 --reportstyle C \\"{pid}\\"",'
+                      f'container_scheduler="docker",container_id="{pid % containers:012x}"')
+            lines.append(f"{metric}{{{labels}}} {1000 + pid}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def make_fixture_server(payload, status=200):
+    """Start a local server answering /metrics with `payload`, standing in for Scaphandre (also used by the tests)."""
+
+    class ScaphandreHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ScaphandreHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def best_of(repeat, function):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def full_parse(payload):
+    return [s for family in text_string_to_metric_families(payload.decode()) for s in family.samples
+            if s.name in ("scaph_process_power_consumption_microwatts", "scaph_host_power_microwatts")]
+
+
+def run_benchmark(process_counts, repeat):
+    print(f"{'processes':>10} {'payload (MB)':>13} {'full parse (ms)':>16} {'streaming (ms)':>15} {'HTTP fetch (ms)':>16}")
+    for num_processes in process_counts:
+        payload = make_payload(num_processes)
+        full_time, full_samples = best_of(repeat, lambda: full_parse(payload))
+        stream_time, samples = best_of(repeat, lambda: list(parse_power_lines(payload.splitlines())))
+        assert len(samples) == len(full_samples)
+
+        server = make_fixture_server(payload)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        fetch_time, (power_by_container, host_power) = best_of(repeat, lambda: fetch_scaphandre_power([url]))
+        assert host_power[url] == 52.0 and len(power_by_container) == min(200, num_processes)
+        server.shutdown()
+        server.server_close()
+
+        print(f"{num_processes:>10} {len(payload) / 1e6:>13.1f} {full_time * 1000:>16.1f} "
+              f"{stream_time * 1000:>15.1f} {fetch_time * 1000:>16.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming Scaphandre parser")
+    parser.add_argument("--processes", type=int, nargs='+', default=[1000, 10000, 50000], help="Number of processes in the payload")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measure, the best one is reported")
+    args = parser.parse_args()
+
+    run_benchmark(args.processes, args.repeat)
@@ -0,0 +1,105 @@
+"""
+Compare the "per-pod" and "grouped" scrape engines against a local fake Prometheus.
+
+The fake server answers /api/v1/query with one series per known container and adds a
+fixed delay to every request to stand in for the network round trip to Prometheus.
+
+Usage:
+    python3 benchmarks/benchmark_scrape_engines.py [--latency-ms 2] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scrape_engine import SCRAPE_ENGINES
+
+POD_COUNTS = [10, 100, 1000]
+
+
+def make_uid_pod_map(num_pods):
+    """Build a fake UID -> pod map with truncated UIDs like the ones from kubectl."""
+    return {str(uuid.uuid4()).split('-')[-1]: f"pod-{i}" for i in range(num_pods)}
+
+
+def make_handler(container_ids, latency):
+    body_cache = {}
+
+    class FakePrometheusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            query = parse_qs(urlparse(self.path).query).get('query', [''])[0]
+            match = re.search(r'container_id="([^"]+)"', query)
+            if match:
+                ids = [match.group(1)] if match.group(1) in container_ids else []
+                body = self.render(ids, grouped=False)
+            else:
+                # Grouped query: answer with every container, honouring the shard regex
+                shard = re.search(r'container_id=~"\.\*\[([^\]]+)\]"', query)
+                key = shard.group(1) if shard else ""
+                if key not in body_cache:
+                    ids = [c for c in container_ids if not shard or c[-1] in key]
+                    body_cache[key] = self.render(ids, grouped=True)
+                body = body_cache[key]
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def render(self, ids, grouped):
+            now = time.time()
+            result = [
+                {"metric": {"container_id": c} if grouped else {}, "value": [now, "0.125"]}
+                for c in ids
+            ]
+            return json.dumps({"status": "success", "data": {"resultType": "vector", "result": result}}).encode()
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakePrometheusHandler
+
+
+def run_benchmark(latency_ms, repeat, shards):
+    print(f"Simulated Prometheus latency: {latency_ms} ms per request, best of {repeat} cycles")
+    print(f"{'pods':>6} {'engine':>10} {'requests':>9} {'cycle (ms)':>11} {'pods found':>11}")
+    for num_pods in POD_COUNTS:
+        uid_pod_map = make_uid_pod_map(num_pods)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(set(uid_pod_map), latency_ms / 1000))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        prometheus_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        for engine in ("per-pod", "grouped"):
+            scrape = SCRAPE_ENGINES[engine]
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = scrape(prometheus_url, uid_pod_map, shards)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            requests_per_cycle = num_pods if engine == "per-pod" else max(shards, 1)
+            print(f"{num_pods:>6} {engine:>10} {requests_per_cycle:>9} {best * 1000:>11.1f} {len(result):>11}")
+
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the exporter scrape engines")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Simulated latency of each Prometheus request")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of cycles per engine, the best one is reported")
+    parser.add_argument("--shards", type=int, default=1, help="Number of shards for the grouped engine")
+    args = parser.parse_args()
+
+    run_benchmark(args.latency_ms, args.repeat, args.shards)
@@ -0,0 +1,145 @@
+"""
+Load benchmark of the serving modes of the exporter.
+
+A synthetic metrics snapshot with --pods pods is written to a temporary file, then
+the exporter is started in the "server" role on top of it, once with the Flask
+development server and once per gunicorn worker count. Client processes send
+requests in a loop on keep-alive connections and the benchmark reports requests
+per second and latency percentiles for /metrics and /api/metrics-by-pod.
+
+Usage:
+    python3 benchmarks/benchmark_serving.py [--pods 1000] [--workers 1 4] [--clients 8] [--duration 5]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(APP_DIR)
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from exposition import ExpositionCache, LabelledGauge
+from history import PowerHistory
+from pod_index import PodIndex
+from snapshot import ServingState, SnapshotWriter
+
+ENDPOINTS = {
+    "/metrics": "/metrics",
+    "/api/metrics-by-pod": "/api/metrics-by-pod?search_term=oai-cu-{i}",
+}
+
+
+def write_snapshot(path, num_pods, history_samples=180):
+    """Write a snapshot like the scraper would after a cycle with num_pods pods."""
+    pod_names = [f"oai-cu-{i}-7d9f8c" for i in range(num_pods)]
+    pod_index = PodIndex()
+    pod_index.replace([{'metadata': {'uid': f"{i:012x}", 'name': name, 'namespace': 'ran'}}
+                       for i, name in enumerate(pod_names)], "1")
+
+    now = time.time()
+    pod_metrics = {name: 0.1 + i / 1000 for i, name in enumerate(pod_names)}
+    history = PowerHistory(history_samples * 5, 5)
+    for step in range(history_samples):
+        history.append(pod_metrics, now - (history_samples - step) * 5)
+
+    registry = CollectorRegistry()
+    LabelledGauge(Gauge('pod_power_consumption_mw', 'Pod Power Consumption in mW', ['pod'], registry=registry), 'pod').update(pod_metrics)
+    exposition_cache = ExpositionCache(registry)
+    exposition_cache.render()
+
+    state = ServingState(pod_index, pod_metrics, {name: now for name in pod_names}, history, exposition_cache)
+    SnapshotWriter(path).write(state)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, workers, port, snapshot_path):
+    env = dict(os.environ, EXPORTER_ROLE="server", SNAPSHOT_PATH=snapshot_path)
+    if mode == "flask":
+        command = [sys.executable, "-c", f"import app; app.app.run(host='127.0.0.1', port={port})"]
+    else:
+        command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"]
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/metrics")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def client(args):
+    """Send requests for `duration` seconds and return the latency of each of them."""
+    port, path, duration, num_pods, seed = args
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    latencies = []
+    i = seed
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        connection.request("GET", path.format(i=i % num_pods), headers={"Accept-Encoding": "gzip"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        i += 7
+    connection.close()
+    return latencies
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run_benchmark(num_pods, worker_counts, clients, duration):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, "snapshot")
+        write_snapshot(snapshot_path, num_pods)
+        print(f"{num_pods} pods, snapshot of {os.path.getsize(snapshot_path) / 1e6:.1f} MB "
+              f"and history of {os.path.getsize(snapshot_path + '.history') / 1e6:.1f} MB, "
+              f"{clients} client processes, {duration}s per run")
+        print(f"{'server':>14} {'endpoint':>20} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+
+        modes = [("flask", 1)] + [("gunicorn", w) for w in worker_counts]
+        for mode, workers in modes:
+            port = free_port()
+            process = start_server(mode, workers, port, snapshot_path)
+            try:
+                for name, path in ENDPOINTS.items():
+                    with multiprocessing.Pool(clients) as pool:
+                        results = pool.map(client, [(port, path, duration, num_pods, seed) for seed in range(clients)])
+                    latencies = sorted(latency for result in results for latency in result)
+                    label = "flask dev" if mode == "flask" else f"gunicorn -w {workers}"
+                    print(f"{label:>14} {name:>20} {len(latencies) / duration:>9.0f} "
+                          f"{percentile(latencies, 0.5) * 1000:>9.2f} {percentile(latencies, 0.99) * 1000:>9.2f}")
+            finally:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load benchmark of the exporter serving modes")
+    parser.add_argument("--pods", type=int, default=1000, help="Number of pods in the snapshot")
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 4], help="gunicorn worker counts to test")
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent client processes")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of load per server and endpoint")
+    args = parser.parse_args()
+
+    run_benchmark(args.pods, args.workers, args.clients, args.duration)
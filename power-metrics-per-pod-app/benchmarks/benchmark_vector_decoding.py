@@ -0,0 +1,107 @@
+"""
+Micro-benchmark of the decoding of Prometheus instant-query responses.
+
+A response with --series series is recorded to a file (or an existing recorded response is
+given with --response), then decoded repeatedly:
+- "json + dicts": json.loads and a walk of result['data']['result'] with a float() per
+  entry, like the fetch_* functions did
+- "orjson + dicts": the same walk on top of orjson, if it is installed
+- "decode_vector (<backend>)": prometheus_decode.decode_vector, straight into columns with
+  the JSON library picked at import time (msgspec, orjson or json)
+
+Usage:
+    python3 benchmarks/benchmark_vector_decoding.py [--series 10000] [--repeat 20] [--response recorded.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import prometheus_decode
+from prometheus_decode import decode_vector
+
+
+def make_response(num_series):
+    """A response like the raw scaph_process_power_consumption_microwatts vector of a busy cluster."""
+    now = time.time()
+    result = []
+    for i in range(num_series):
+        result.append({
+            "metric": {
+                "__name__": "scaph_process_power_consumption_microwatts",
+                "cmdline": f"/usr/bin/process-{i} --config /etc/process-{i}.conf",
+                "container_id": f"{i // 8:012x}",
+                "container_scheduler": "docker",
+                "exe": f"process-{i}",
+                "instance": "10.0.0.12:8080",
+                "job": "scaphandre",
+                "node": f"worker-{i % 4}",
+                "pid": str(10000 + i),
+            },
+            "value": [now, str(1000 + i * 7 % 50000)],
+        })
+    return json.dumps({"status": "success", "data": {"resultType": "vector", "result": result}}).encode()
+
+
+def walk_dicts(response, label):
+    """The per-entry walk of the fetch_* functions."""
+    rows = []
+    for entry in response['data']['result']:
+        label_value = entry['metric'].get(label)
+        if label_value is None:
+            continue
+        rows.append((label_value, float(entry['value'][0]), float(entry['value'][1])))
+    return rows
+
+
+def time_decoder(decode, body, repeat):
+    """Best time of `repeat` decodes of body, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(body)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(body, repeat, label):
+    decoders = {"json + dicts": lambda b: walk_dicts(json.loads(b), label)}
+    if prometheus_decode.orjson is not None:
+        decoders["orjson + dicts"] = lambda b: walk_dicts(prometheus_decode.orjson.loads(b), label)
+    decoders[f"decode_vector ({prometheus_decode.BACKEND})"] = lambda b: decode_vector(b, label)
+
+    series = len(decode_vector(body, label).labels)
+    print(f"{series} series, {len(body) / 1e6:.1f} MB response, best of {repeat}")
+    print(f"{'decoder':>26} {'time (ms)':>10} {'us/series':>10} {'speedup':>8}")
+    baseline = None
+    for name, decode in decoders.items():
+        elapsed = time_decoder(decode, body, repeat)
+        baseline = baseline or elapsed
+        print(f"{name:>26} {elapsed * 1000:>10.2f} {elapsed / max(series, 1) * 1e6:>10.2f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the Prometheus vector decoding")
+    parser.add_argument("--series", type=int, default=10000, help="Number of series of the recorded response")
+    parser.add_argument("--repeat", type=int, default=20, help="Decodes per decoder")
+    parser.add_argument("--response", help="Recorded /api/v1/query response to decode instead of a synthetic one")
+    parser.add_argument("--label", default="container_id", help="Label identifying each series")
+    args = parser.parse_args()
+
+    if args.response:
+        with open(args.response, "rb") as f:
+            body = f.read()
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "response.json")
+            with open(path, "wb") as f:
+                f.write(make_response(args.series))
+            with open(path, "rb") as f:
+                body = f.read()
+
+    run_benchmark(body, args.repeat, args.label)
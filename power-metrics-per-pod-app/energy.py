@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+
+from prometheus_client import Counter
+
+# Exporter-side energy counters.
+#
+# Power samples are integrated with the trapezoidal rule over the time between two
+# samples of the same pod, taken from the sample timestamps (the Prometheus evaluation
+# time) rather than from the scrape cycle, so scrape jitter and cycle latency do not
+# end up in the totals. The result is exported as monotonic Joules counters
+# per pod and per component. Energy over any window is then `increase(...[window])`.
+# The totals are checkpointed to a JSON file and restored at startup, so a restart of
+# the exporter does not look like a counter reset.
+
+
+class EnergyIntegrator:
+    """
+    Args:
+        registry (CollectorRegistry): Registry the counters are registered in.
+        checkpoint_path (str): JSON file the totals are saved to and restored from (None to disable).
+        checkpoint_interval (float): Minimum seconds between two checkpoints.
+        max_gap (float): Two samples further apart than this are not integrated together.
+        restore_grace (float): Seconds a pod restored from the checkpoint is kept while it is not scraped.
+    """
+
+    def __init__(self, registry, checkpoint_path=None, checkpoint_interval=5, max_gap=60, restore_grace=60):
+        self.pod_counter = Counter('pod_energy_joules', 'Pod Energy Consumption in Joules', ['pod', 'component'], registry=registry)
+        self.component_counter = Counter('component_energy_joules', 'Component Energy Consumption in Joules', ['component'], registry=registry)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.max_gap = max_gap
+        self.restore_grace = restore_grace
+        self._lock = threading.Lock()
+        self._last_sample = {}  # pod -> (timestamp, power in Watts)
+        self._pod_totals = {}  # pod -> [component, Joules]
+        self._component_totals = {}  # component -> Joules
+        self._last_checkpoint = 0.0
+        self._restored = set()  # Pods restored from the checkpoint and not scraped yet
+        self._restored_at = time.time()
+
+    def update(self, samples, timestamp, component_of, live_pods, sample_times=None):
+        """
+        Integrate one sample per pod, then evict the counters of pods that are not in live_pods.
+
+        Args:
+            samples (dict): pod -> power in Watts.
+            timestamp (float): Time of the cycle, also the time of the samples missing from sample_times.
+            component_of (callable): pod name -> component.
+            live_pods (iterable): Pods that are still exported.
+            sample_times (dict): Optional pod -> timestamp of its sample. A sample with the timestamp
+                of the previous one (same Prometheus sample) adds nothing.
+        """
+        sample_times = sample_times or {}
+        with self._lock:
+            for pod, power in samples.items():
+                sampled_at = sample_times.get(pod, timestamp)
+                last = self._last_sample.get(pod)
+                if last is not None and sampled_at <= last[0]:
+                    continue
+                self._last_sample[pod] = (sampled_at, power)
+                if last is None or sampled_at - last[0] > self.max_gap:
+                    continue
+                joules = (last[1] + power) / 2 * (sampled_at - last[0])
+                self._add(pod, component_of(pod), joules)
+
+            live_pods = set(live_pods)
+            self._restored -= live_pods
+            if self._restored and timestamp - self._restored_at > self.restore_grace:
+                self._restored.clear()
+            for pod in self._last_sample.keys() - live_pods:
+                del self._last_sample[pod]
+            # Pods restored from the checkpoint get a grace period to show up in a scrape
+            for pod in self._pod_totals.keys() - live_pods - self._restored:
+                component, _ = self._pod_totals.pop(pod)
+                self.pod_counter.remove(pod, component)
+
+        if self.checkpoint_path and timestamp - self._last_checkpoint >= self.checkpoint_interval:
+            self.save_checkpoint()
+            self._last_checkpoint = timestamp
+
+    def _add(self, pod, component, joules):
+        if joules < 0:
+            return
+        if pod not in self._pod_totals:
+            self._pod_totals[pod] = [component, 0.0]
+        self._pod_totals[pod][1] += joules
+        self._component_totals[component] = self._component_totals.get(component, 0.0) + joules
+        self.pod_counter.labels(pod=pod, component=component).inc(joules)
+        self.component_counter.labels(component=component).inc(joules)
+
+    def save_checkpoint(self):
+        """Atomically write the current totals to the checkpoint file."""
+        with self._lock:
+            checkpoint = {
+                "timestamp": time.time(),
+                "pods": {pod: {"component": c, "joules": j} for pod, (c, j) in self._pod_totals.items()},
+                "components": dict(self._component_totals),
+            }
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(checkpoint, f)
+            os.replace(tmp_path, self.checkpoint_path)
+        except OSError as e:
+            print(f"Error saving energy checkpoint to {self.checkpoint_path}: {e}")
+
+    def load_checkpoint(self):
+        """Restore the totals saved by a previous run, if any."""
+        if not self.checkpoint_path:
+            return
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading energy checkpoint from {self.checkpoint_path}: {e}")
+            return
+
+        with self._lock:
+            for pod, total in checkpoint.get("pods", {}).items():
+                self._pod_totals[pod] = [total["component"], total["joules"]]
+                self.pod_counter.labels(pod=pod, component=total["component"]).inc(total["joules"])
+                self._restored.add(pod)
+            self._restored_at = time.time()
+            for component, joules in checkpoint.get("components", {}).items():
+                self._component_totals[component] = joules
+                self.component_counter.labels(component=component).inc(joules)
+        print(f"Energy counters restored from {self.checkpoint_path}")
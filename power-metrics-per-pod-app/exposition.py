@@ -0,0 +1,78 @@
+import gzip
+import hashlib
+import threading
+
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+# Pre-rendered /metrics exposition.
+#
+# The payload is rendered once at the end of every scrape cycle and kept as bytes
+# (plain and gzip) together with its ETag, so serving /metrics does no work that
+# depends on the number of pods.
+
+
+class LabelledGauge:
+    """
+    A single-label gauge whose label set follows the latest values: label values
+    that are missing from an update are removed, so series of deleted pods go away.
+    """
+
+    def __init__(self, gauge, label):
+        self.gauge = gauge
+        self.label = label
+        self._exported = set()
+
+    def update(self, values):
+        """Set the gauge from a label value -> value dict and evict the label values not in it."""
+        for label_value in self._exported - values.keys():
+            self.gauge.remove(label_value)
+        for label_value, value in values.items():
+            self.gauge.labels(**{self.label: label_value}).set(value)
+        self._exported = set(values)
+
+
+class ExpositionCache:
+    """Latest rendered exposition of a registry, served as cached bytes."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._payload = None  # (body, gzip body, etag)
+
+    def render(self):
+        """Render the registry once and swap the cached payload."""
+        body = generate_latest(self.registry)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        payload = (body, gzip.compress(body, compresslevel=6), etag)
+        with self._lock:
+            self._payload = payload
+
+    def export(self):
+        """Return the cached payload, rendering it first if needed."""
+        if self._payload is None:
+            self.render()
+        return self._payload
+
+    def load(self, payload):
+        """Serve a payload rendered elsewhere (e.g. by the scraper process)."""
+        with self._lock:
+            self._payload = tuple(payload)
+
+    def response(self, if_none_match=None, accept_encoding=""):
+        """
+        Build the /metrics response from the cached payload.
+
+        Returns:
+            tuple: (body, status code, headers)
+        """
+        if self._payload is None:
+            self.render()
+        body, gzip_body, etag = self._payload
+
+        headers = {"Content-Type": CONTENT_TYPE_LATEST, "ETag": etag, "Vary": "Accept-Encoding"}
+        if if_none_match == etag:
+            return b"", 304, headers
+        if "gzip" in (accept_encoding or ""):
+            headers["Content-Encoding"] = "gzip"
+            return gzip_body, 200, headers
+        return body, 200, headers
@@ -0,0 +1,130 @@
+import bisect
+import threading
+from array import array
+
+# Fixed-memory history of pod power samples.
+#
+# Each pod gets a ring buffer of `capacity` samples stored in two array('d') buffers
+# (timestamps and values), 16 bytes per sample, so memory depends only on the number
+# of pods and the length of the window.
+
+
+class RingBuffer:
+    """Last `capacity` (timestamp, value) samples of one series, oldest overwritten first."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.size = 0
+        self.head = 0  # Index where the next sample is written
+
+    def append(self, timestamp, value):
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def load(self, timestamps, values):
+        """Fill the buffer with ordered samples (oldest first), keeping the last `capacity` ones."""
+        timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+        self.timestamps[:len(timestamps)] = timestamps
+        self.values[:len(values)] = values
+        self.size = len(timestamps)
+        self.head = self.size % self.capacity
+
+    def last_timestamp(self):
+        return self.timestamps[self.head - 1] if self.size else None
+
+    def ordered(self):
+        """Return the samples as (timestamps, values) arrays, oldest first."""
+        if self.size < self.capacity:
+            return self.timestamps[:self.size], self.values[:self.size]
+        return (self.timestamps[self.head:] + self.timestamps[:self.head],
+                self.values[self.head:] + self.values[:self.head])
+
+    def range(self, start, end):
+        """Return the (timestamps, values) arrays of the samples with start <= timestamp <= end."""
+        timestamps, values = self.ordered()
+        lo = bisect.bisect_left(timestamps, start)
+        hi = bisect.bisect_right(timestamps, end)
+        return timestamps[lo:hi], values[lo:hi]
+
+
+def downsample(timestamps, values, step):
+    """Average the samples in buckets of `step` seconds, each stamped with the start of its bucket."""
+    points = []
+    bucket, total, count = None, 0.0, 0
+    for timestamp, value in zip(timestamps, values):
+        current = timestamp - timestamp % step
+        if current != bucket:
+            if count:
+                points.append((bucket, total / count))
+            bucket, total, count = current, 0.0, 0
+        total += value
+        count += 1
+    if count:
+        points.append((bucket, total / count))
+    return points
+
+
+class PowerHistory:
+    """
+    Ring buffers of the last `window` seconds of power samples, one per pod.
+
+    Args:
+        window (float): Seconds of history to keep.
+        period (float): Seconds between two samples, used to size the buffers.
+    """
+
+    def __init__(self, window, period):
+        self.window = window
+        self.capacity = max(1, int(window / period) + 1)
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def append(self, samples, timestamp):
+        """Append one sample per pod, and drop pods without a sample in the whole window."""
+        with self._lock:
+            for pod, value in samples.items():
+                buffer = self._buffers.get(pod)
+                if buffer is None:
+                    buffer = self._buffers[pod] = RingBuffer(self.capacity)
+                buffer.append(timestamp, value)
+            for pod in [pod for pod, buffer in self._buffers.items() if buffer.last_timestamp() < timestamp - self.window]:
+                del self._buffers[pod]
+
+    def export(self):
+        """Return pod -> (timestamps bytes, values bytes) with the ordered samples of every pod."""
+        with self._lock:
+            exported = {}
+            for pod, buffer in self._buffers.items():
+                timestamps, values = buffer.ordered()
+                exported[pod] = (timestamps.tobytes(), values.tobytes())
+            return exported
+
+    def load(self, exported):
+        """Replace the buffers with the output of export()."""
+        buffers = {}
+        for pod, (timestamps, values) in exported.items():
+            buffer = RingBuffer(self.capacity)
+            buffer.load(array('d', timestamps), array('d', values))
+            buffers[pod] = buffer
+        with self._lock:
+            self._buffers = buffers
+
+    def query(self, pod, start, end, step=None):
+        """
+        Samples of a pod between start and end, optionally averaged in buckets of `step` seconds.
+
+        Returns:
+            list: (timestamp, value) tuples, oldest first.
+        """
+        with self._lock:
+            buffer = self._buffers.get(pod)
+            if buffer is None:
+                return []
+            timestamps, values = buffer.range(start, end)
+        if step:
+            return downsample(timestamps, values, step)
+        return list(zip(timestamps, values))
@@ -0,0 +1,232 @@
+import json
+import re
+import subprocess
+import threading
+import time
+from urllib.parse import quote
+
+import self_metrics
+
+# UID -> pod index kept current by the Kubernetes watch API.
+#
+# The index does one LIST of all pods, then streams ADDED/MODIFIED/DELETED events
+# through `kubectl get --raw` (so it reuses the kubeconfig and credentials kubectl
+# already has) and applies each of them in O(1). After a disconnect the watch resumes
+# from the last resourceVersion seen; if that version is too old (410 Gone) the index
+# falls back to a fresh LIST.
+#
+# With a node name (node-local DaemonSet mode) the LIST and the watch use the
+# spec.nodeName field selector, so only the pods of that node are ever transferred.
+
+PODS_PATH = "/api/v1/pods"
+
+# The API server closes the watch after this many seconds, we then resume it
+WATCH_TIMEOUT_SECONDS = 300
+
+# Wait before re-listing/re-watching after an error
+RETRY_DELAY_SECONDS = 5
+
+# Size of the n-grams used to index pod names for substring lookups
+NGRAM_SIZE = 3
+
+# RAN/core components pods are classified in, from the prefix of their name (oai-cu, oai-cu2, ...)
+COMPONENTS = ("oai-cu", "oai-du", "oai-nr-ue", "oai-upf")
+COMPONENT_PATTERN = re.compile(r"^(" + "|".join(re.escape(c) for c in COMPONENTS) + r")\d*-")
+
+
+def pod_component(pod_name):
+    """RAN/core component of a pod from its name, "other" for pods outside the components we track."""
+    match = COMPONENT_PATTERN.match(pod_name)
+    return match.group(1) if match else "other"
+
+
+def truncate_uid(uid):
+    """Take the last part of the UID, which is what Scaphandre exposes as container_id."""
+    return uid.split('-')[-1]
+
+
+class ResourceVersionExpired(Exception):
+    """The watch resourceVersion is too old and a new LIST is required."""
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    """Set of the n-grams of a string."""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class PodIndex:
+    """
+    Thread-safe truncated UID -> pod index.
+
+    Readers get a consistent copy with snapshot(); the watch thread updates the
+    index in place one event at a time. Each pod is classified by namespace and
+    RAN component when it is indexed. Pod names are also kept in an n-gram
+    inverted index so substring lookups only look at the few pods sharing all
+    the n-grams of the search term.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pods = {}  # truncated UID -> (pod name, namespace, component)
+        self._postings = {}  # n-gram -> set of truncated UIDs whose pod name contains it
+        self.resource_version = None
+
+    def snapshot(self):
+        """Return a copy of the truncated UID -> pod name map."""
+        with self._lock:
+            return {uid: pod[0] for uid, pod in self._pods.items()}
+
+    def classification(self):
+        """Return a pod name -> (namespace, component) map."""
+        with self._lock:
+            return {pod[0]: (pod[1], pod[2]) for pod in self._pods.values()}
+
+    def export(self):
+        """Return the indexed pods as LIST-like items, which replace() can load back."""
+        with self._lock:
+            return [{'metadata': {'uid': uid, 'name': pod[0], 'namespace': pod[1]}} for uid, pod in self._pods.items()]
+
+    def __len__(self):
+        return len(self._pods)
+
+    def _add(self, truncated_uid, metadata):
+        if truncated_uid in self._pods:
+            self._remove(truncated_uid)
+        name = metadata['name']
+        self._pods[truncated_uid] = (name, metadata.get('namespace', ''), pod_component(name))
+        for gram in ngrams(name):
+            self._postings.setdefault(gram, set()).add(truncated_uid)
+
+    def _remove(self, truncated_uid):
+        pod = self._pods.pop(truncated_uid, None)
+        if pod is None:
+            return
+        for gram in ngrams(pod[0]):
+            uids = self._postings.get(gram)
+            if uids is not None:
+                uids.discard(truncated_uid)
+                if not uids:
+                    del self._postings[gram]
+
+    def replace(self, pods, resource_version):
+        """Replace the whole index with the items of a LIST response."""
+        with self._lock:
+            self._pods = {}
+            self._postings = {}
+            for item in pods:
+                metadata = item['metadata']
+                self._add(truncate_uid(metadata['uid']), metadata)
+            self.resource_version = resource_version
+        self_metrics.pod_index_last_event_timestamp.set(time.time())
+
+    def apply_event(self, event):
+        """Apply one watch event to the index."""
+        event_type = event.get('type')
+        obj = event.get('object', {})
+
+        if event_type == 'ERROR':
+            if obj.get('code') == 410:
+                raise ResourceVersionExpired(obj.get('message', ''))
+            raise RuntimeError(f"Watch error: {obj}")
+
+        self_metrics.pod_watch_events.labels(type=event_type).inc()
+        self_metrics.pod_index_last_event_timestamp.set(time.time())
+        metadata = obj.get('metadata', {})
+        with self._lock:
+            if event_type == 'ADDED':
+                self._add(truncate_uid(metadata['uid']), metadata)
+            elif event_type == 'MODIFIED':
+                # The name of a pod never changes, only (re)index pods we do not know yet
+                if truncate_uid(metadata['uid']) not in self._pods:
+                    self._add(truncate_uid(metadata['uid']), metadata)
+            elif event_type == 'DELETED':
+                self._remove(truncate_uid(metadata['uid']))
+            # BOOKMARK events only move the resourceVersion forward
+            if metadata.get('resourceVersion'):
+                self.resource_version = metadata['resourceVersion']
+
+    def find(self, search_term):
+        """
+        Find the pod whose name contains search_term.
+
+        When several pods match, the first one in (namespace, name) order is returned,
+        which is the order `kubectl get pods -A` lists them in.
+
+        Returns:
+            tuple: (truncated UID, pod name), or (None, None) if no pod matches.
+        """
+        with self._lock:
+            grams = ngrams(search_term)
+            if grams:
+                postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set.intersection(*postings) if postings[0] else set()
+            else:
+                # Search terms shorter than an n-gram can not use the index
+                candidates = self._pods.keys()
+
+            best = None
+            for truncated_uid in candidates:
+                name, namespace, _ = self._pods[truncated_uid]
+                if search_term in name and (best is None or (namespace, name) < best[0]):
+                    best = ((namespace, name), truncated_uid)
+        if best is None:
+            return None, None
+        return best[1], best[0][1]
+
+
+def kubectl_raw(path, stream=False):
+    """Run `kubectl get --raw`. With stream=True the running process is returned."""
+    command = ['kubectl', 'get', '--raw', path]
+    if stream:
+        return subprocess.Popen(command, stdout=subprocess.PIPE, text=True, bufsize=1)
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def pods_path(node_name=None, **params):
+    """Pods API path with query parameters, restricted to one node if node_name is set."""
+    if node_name:
+        params['fieldSelector'] = f"spec.nodeName={node_name}"
+    if not params:
+        return PODS_PATH
+    return PODS_PATH + "?" + "&".join(f"{key}={quote(str(value), safe='')}" for key, value in params.items())
+
+
+def list_pods(index, node_name=None):
+    """Initial LIST: fill the index and remember the resourceVersion to watch from."""
+    with self_metrics.kubectl_seconds.labels(operation='list').time():
+        pod_list = kubectl_raw(pods_path(node_name))
+    index.replace(pod_list.get('items', []), pod_list['metadata']['resourceVersion'])
+
+
+def watch_pods(index, node_name=None):
+    """Stream watch events from the index resourceVersion until the server closes the watch."""
+    path = pods_path(node_name, watch=1, allowWatchBookmarks="true",
+                     timeoutSeconds=WATCH_TIMEOUT_SECONDS, resourceVersion=index.resource_version)
+    process = kubectl_raw(path, stream=True)
+    try:
+        for line in process.stdout:
+            if line.strip():
+                index.apply_event(json.loads(line))
+    finally:
+        process.kill()
+        returncode = process.wait()
+    if returncode > 0:
+        raise RuntimeError(f"kubectl watch exited with code {returncode}")
+
+
+def run_pod_index(index, node_name=None):
+    """LIST once, then keep the index current with the watch API. Runs forever."""
+    needs_list = True
+    while True:
+        try:
+            if needs_list:
+                list_pods(index, node_name)
+                needs_list = False
+            watch_pods(index, node_name)
+        except ResourceVersionExpired as e:
+            print(f"Pod watch expired, listing pods again: {e}")
+            needs_list = True
+        except (subprocess.CalledProcessError, OSError, RuntimeError, ValueError, KeyError) as e:
+            print(f"Error watching pods: {e}")
+            time.sleep(RETRY_DELAY_SECONDS)
@@ -0,0 +1,98 @@
+import json
+from array import array
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+# Decoding of Prometheus instant-query (vector) responses into columns.
+#
+# The JSON library is picked at import time: msgspec decodes the response straight into
+# typed structs that only keep the wanted label (no intermediate dicts), orjson parses
+# faster than the standard library,
+# and json is the fallback when neither is installed. decode_vector() returns one column
+# of label values and two array('d') columns of timestamps and values, so callers do no
+# per-entry dict lookups.
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+Vector = namedtuple("Vector", ["labels", "timestamps", "values"])
+
+if msgspec is not None:
+    _vector_decoders = {}
+
+    def _vector_decoder(label):
+        """
+        msgspec decoder of a vector response that only keeps `label` from the metric labels:
+        the other labels are skipped by the parser instead of being built into dicts.
+        """
+        decoder = _vector_decoders.get(label)
+        if decoder is None:
+            metric = msgspec.defstruct("Metric", [(label, Optional[str], None)])
+            series = msgspec.defstruct("Series", [("metric", metric), ("value", Tuple[float, str])])
+            data = msgspec.defstruct("VectorData", [("resultType", str), ("result", List[series])])
+            response = msgspec.defstruct("VectorResponse", [("status", str), ("data", Optional[data], None), ("error", str, "")])
+            decoder = _vector_decoders[label] = msgspec.json.Decoder(response)
+        return decoder
+
+    loads = msgspec.json.decode
+    BACKEND = "msgspec"
+elif orjson is not None:
+    loads = orjson.loads
+    BACKEND = "orjson"
+else:
+    loads = json.loads
+    BACKEND = "json"
+
+
+def _check(status, result_type, error):
+    if status != "success":
+        raise ValueError(f"Prometheus query failed: {error or status}")
+    if result_type != "vector":
+        raise ValueError(f"Expected a vector result, got {result_type}")
+
+
+def decode_vector(body, label):
+    """
+    Decode an instant-query response into columns.
+
+    Args:
+        body (bytes): Raw response body.
+        label (str): Label whose value identifies each series (e.g. "container_id").
+            Series without it are skipped.
+
+    Returns:
+        Vector: (list of label values, array('d') of timestamps, array('d') of values)
+
+    Raises:
+        ValueError: If the body is not a successful vector response.
+    """
+    labels, timestamps, values = [], array('d'), array('d')
+    if msgspec is not None:
+        response = _vector_decoder(label).decode(body)  # msgspec errors are ValueErrors
+        _check(response.status, response.data.resultType if response.data else None, response.error)
+        for series in response.data.result:
+            label_value = getattr(series.metric, label)
+            if label_value is not None:
+                labels.append(label_value)
+                timestamps.append(series.value[0])
+                values.append(float(series.value[1]))
+        return Vector(labels, timestamps, values)
+
+    response = loads(body)
+    data = response.get('data') or {}
+    _check(response.get('status'), data.get('resultType'), response.get('error'))
+    for series in data['result']:
+        label_value = series['metric'].get(label)
+        if label_value is not None:
+            timestamp, value = series['value']
+            labels.append(label_value)
+            timestamps.append(timestamp)
+            values.append(float(value))
+    return Vector(labels, timestamps, values)
@@ -0,0 +1,279 @@
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from prometheus_decode import decode_vector, loads
+
+# Pooled HTTP client for the Prometheus API, shared by the exporter scrape engines and
+# the experiment collectors in power-metrics-per-pod-realtime.
+#
+# The module only depends on requests and prometheus_decode.py, not on the exporter: the
+# collectors import it through a symlink. The exporter hands its self-instrumentation to
+# the client as a metrics hook (self_metrics.observe_source_request).
+#
+# One requests.Session per Prometheus server keeps connections alive between polls
+# and asks for gzip responses. Every request has a (connect, read) timeout; connection
+# errors, timeouts and 5xx/429 answers are retried with full-jitter exponential
+# backoff, while 4xx answers (bad query) fail at once. After `failure_threshold`
+# failed calls in a row the circuit opens and calls fail immediately with
+# CircuitOpenError until `reset_timeout` seconds have passed; then one trial call
+# decides whether it closes again.
+#
+# The breaker defaults suit the exporter; a 1 s collector passes a reset_timeout of a
+# couple of scrape intervals, so a short outage does not blank the rest of a run.
+#
+# Latency of every call (retries included) is kept per query name, see latency_stats().
+# Bodies are decoded with the fastest JSON library installed (prometheus_decode.py), and
+# query_vector() decodes instant queries straight into columns.
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Latencies kept per query name for the percentiles of latency_stats()
+LATENCY_WINDOW = 1024
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+class RetryableStatusError(requests.exceptions.HTTPError):
+    """A 5xx/429 answer that is worth retrying."""
+
+
+class CircuitBreaker:
+    """
+    Args:
+        failure_threshold (int): Failed calls in a row that open the circuit.
+        reset_timeout (float): Seconds the circuit stays open before a trial call is let through.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Whether a call may be sent now. While half-open only one trial call is allowed."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class LatencyStats:
+    """Call count, errors and latencies of one query name."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, duration, error=False):
+        self.count += 1
+        self.errors += error
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.recent.append(duration)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        def percentile(p):
+            return recent[min(len(recent) - 1, int(len(recent) * p))] if recent else 0.0
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_seconds': self.total / self.count if self.count else 0.0,
+            'p50_seconds': percentile(0.5),
+            'p95_seconds': percentile(0.95),
+            'p99_seconds': percentile(0.99),
+            'max_seconds': self.max,
+        }
+
+
+class PrometheusClient:
+    """
+    Args:
+        base_url (str): Base URL of the Prometheus server.
+        timeout (float or tuple): Request timeout in seconds, or a (connect, read) tuple.
+        retries (int): Retries after the first attempt of a call.
+        backoff (float): Base delay of the exponential backoff, in seconds.
+        max_backoff (float): Upper bound of a single backoff delay, in seconds.
+        failure_threshold (int): Failed calls in a row that open the circuit breaker.
+        reset_timeout (float): Seconds the circuit stays open before a trial call.
+        pool_size (int): Connections kept alive to the server.
+        source (str): Name of the server passed to the metrics hook.
+        metrics_hook (callable): Optional hook(source, duration, error, circuit_open) called after
+            every call, e.g. to record it in the metrics of the caller.
+    """
+
+    def __init__(self, base_url, timeout=(3.05, 10.0), retries=2, backoff=0.1, max_backoff=2.0,
+                 failure_threshold=5, reset_timeout=30.0, pool_size=10, source="prometheus", metrics_hook=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.source = source
+        self.metrics_hook = metrics_hook
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip"
+
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def _send(self, path, params, decode):
+        response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+        if response.status_code in RETRY_STATUS_CODES:
+            raise RetryableStatusError(f"{response.status_code} from {response.url}", response=response)
+        response.raise_for_status()
+        return decode(response.content)
+
+    def get_json(self, path, params=None, name=None, decode=loads):
+        """
+        GET an API path with retries and the circuit breaker, and return the decoded JSON.
+
+        Args:
+            path (str): API path, e.g. "/api/v1/query".
+            params (dict): Query string parameters.
+            name (str): Key of the latency stats (defaults to the path).
+            decode (callable): Decoder of the raw body (defaults to a plain JSON decode).
+
+        Raises:
+            requests.exceptions.RequestException: If the call failed (CircuitOpenError if the circuit is open).
+            ValueError: If the body cannot be decoded.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {self.base_url}, not sending {path}")
+
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    result = self._send(path, params, decode)
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        RetryableStatusError):
+                    if attempt == self.retries:
+                        raise
+                    time.sleep(self.backoff_delay(attempt))
+        except requests.exceptions.HTTPError as e:
+            # A 4xx answer means the query is wrong, not that the server is down
+            server_down = isinstance(e, RetryableStatusError) or e.response is None or e.response.status_code >= 500
+            self._finish(name or path, start, error=True, server_down=server_down)
+            raise
+        except (requests.exceptions.RequestException, ValueError):
+            self._finish(name or path, start, error=True, server_down=True)
+            raise
+        self._finish(name or path, start)
+        return result
+
+    def backoff_delay(self, attempt):
+        """Full-jitter delay before retry number `attempt` (0 for the first retry), in seconds."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _finish(self, name, start, error=False, server_down=False):
+        self.record_call(name, time.perf_counter() - start, error, server_down)
+
+    def record_call(self, name, duration, error=False, server_down=False):
+        """
+        Record the latency of a call and its outcome in the circuit breaker and the metrics hook.
+        Used by get_json(), and by callers that send the requests themselves with the retry policy
+        of this client (the asyncio scrape engine).
+        """
+        self._observe(name, duration, error)
+        if server_down:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if self.metrics_hook is not None:
+            self.metrics_hook(self.source, duration, error, self.breaker.is_open)
+
+    def query(self, query, name=None, eval_time=None):
+        """Instant query. Returns the whole decoded response ({'status': ..., 'data': ...})."""
+        params = {'query': query}
+        if eval_time is not None:
+            params['time'] = eval_time
+        return self.get_json("/api/v1/query", params, name=name or query)
+
+    def query_vector(self, query, label, name=None, eval_time=None):
+        """
+        Instant query decoded into columns, see prometheus_decode.decode_vector().
+
+        Returns:
+            Vector: (list of `label` values, array('d') of timestamps, array('d') of values)
+        """
+        params = {'query': query}
+        if eval_time is not None:
+            params['time'] = eval_time
+        return self.get_json("/api/v1/query", params, name=name or query, decode=lambda body: decode_vector(body, label))
+
+    def query_range(self, query, start, end, step, name=None):
+        """Range query between two Unix times, one point every `step` seconds. Returns the whole decoded response."""
+        params = {'query': query, 'start': start, 'end': end, 'step': step}
+        return self.get_json("/api/v1/query_range", params, name=name or query)
+
+    def _observe(self, name, duration, error=False):
+        with self._stats_lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = LatencyStats()
+            stats.observe(duration, error)
+
+    def latency_stats(self):
+        """
+        Returns:
+            dict: query name -> {count, errors, mean/p50/p95/p99/max latency in seconds}.
+        """
+        with self._stats_lock:
+            return {name: stats.summary() for name, stats in self._stats.items()}
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, **kwargs):
+    """
+    Shared client of a Prometheus server, so every caller reuses the same connection pool.
+    The keyword arguments of PrometheusClient only apply when the client is first created.
+    """
+    key = base_url.rstrip("/")
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = PrometheusClient(base_url, **kwargs)
+        return client
@@ -0,0 +1,77 @@
+import re
+
+import requests
+
+# Streaming parser of the Scaphandre exposition.
+#
+# The exposition is streamed line by line and only the two power metrics we use are
+# decoded; every other line is skipped after a prefix check on raw bytes. The module only
+# depends on requests, not on the exporter: the collectors of power-metrics-per-pod-realtime
+# import it through a symlink. scaphandre_source.py builds the exporter source on it.
+
+PROCESS_POWER_METRIC = "scaph_process_power_consumption_microwatts"
+HOST_POWER_METRIC = "scaph_host_power_microwatts"
+
+WANTED_PREFIXES = (PROCESS_POWER_METRIC.encode(), HOST_POWER_METRIC.encode())
+
+LABEL_PATTERN = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+ESCAPES = {'\\\\': '\\', '\\"': '"', '\\n': '\n'}
+ESCAPE_PATTERN = re.compile(r'\\[\\"n]')
+
+
+def parse_labels(text):
+    """Parse the inside of a {...} label set into a dict, unescaping values when needed."""
+    labels = {}
+    for name, value in LABEL_PATTERN.findall(text):
+        if '\\' in value:
+            value = ESCAPE_PATTERN.sub(lambda m: ESCAPES[m.group(0)], value)
+        labels[name] = value
+    return labels
+
+
+def parse_line(line):
+    """
+    Parse one sample line of the Prometheus text format.
+
+    Returns:
+        tuple: (metric name, labels dict, value), or None if the line is not a valid sample.
+    """
+    brace = line.find('{')
+    if brace >= 0:
+        close = line.rfind('}')
+        if close < brace:
+            return None
+        name = line[:brace]
+        labels = parse_labels(line[brace + 1:close])
+        rest = line[close + 1:].split()
+    else:
+        parts = line.split()
+        if len(parts) < 2:
+            return None
+        name, labels, rest = parts[0], {}, parts[1:]
+    if not rest:
+        return None
+    try:
+        return name, labels, float(rest[0])
+    except ValueError:
+        return None
+
+
+def parse_power_lines(lines, prefixes=WANTED_PREFIXES):
+    """
+    Streaming parser: yield (metric name, labels, value) for the sample lines that start
+    with one of `prefixes`. Lines are bytes, as produced by Response.iter_lines().
+    """
+    for raw_line in lines:
+        if not raw_line.startswith(prefixes):
+            continue  # Comments, other metrics: skipped without decoding
+        sample = parse_line(raw_line.decode('utf-8', errors='replace'))
+        if sample is not None:
+            yield sample
+
+
+def fetch_scaphandre_samples(scaphandre_url, timeout=5, prefixes=WANTED_PREFIXES):
+    """Stream the Scaphandre /metrics endpoint and return the wanted samples as a list."""
+    with requests.get(f"{scaphandre_url.rstrip('/')}/metrics", stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        return list(parse_power_lines(response.iter_lines(chunk_size=64 * 1024), prefixes))
@@ -0,0 +1,60 @@
+import time
+
+import requests
+
+from scaphandre_parser import HOST_POWER_METRIC, PROCESS_POWER_METRIC, fetch_scaphandre_samples
+from scrape_engine import join_uid_pod_map
+from self_metrics import timed_request
+
+# Direct Scaphandre source of the exporter.
+#
+# Instead of reading Scaphandre data back from Prometheus (one extra scrape interval
+# of latency and extra load on the server), scrape the Scaphandre exporter endpoint
+# directly, with the streaming parser of scaphandre_parser.py.
+
+
+def fetch_scaphandre_power(scaphandre_urls, timeout=5, sample_times=None):
+    """
+    Scrape one or more Scaphandre exporters directly.
+
+    Args:
+        scaphandre_urls (list): Base URLs of the Scaphandre exporters (one per node).
+        timeout (float): Timeout of each request, in seconds.
+        sample_times (dict): Optional dict filled with container_id -> Unix time the exporter of
+            the container answered (Scaphandre does not timestamp its samples).
+
+    Returns:
+        tuple: (container_id -> process power in Watts, Scaphandre URL -> host power in Watts).
+            Exporters that can not be scraped are skipped.
+    """
+    power_by_container = {}
+    host_power = {}
+    for scaphandre_url in scaphandre_urls:
+        try:
+            with timed_request("scaphandre"):
+                samples = fetch_scaphandre_samples(scaphandre_url, timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Error scraping Scaphandre at {scaphandre_url}: {e}")
+            continue
+        scraped_at = time.time()
+        for name, labels, value in samples:
+            if name == PROCESS_POWER_METRIC:
+                container_id = labels.get('container_id')
+                if container_id:
+                    power_by_container[container_id] = power_by_container.get(container_id, 0.0) + value / 1000000
+                    if sample_times is not None:
+                        sample_times[container_id] = scraped_at
+            elif name == HOST_POWER_METRIC:
+                host_power[scaphandre_url] = value / 1000000
+    return power_by_container, host_power
+
+
+def scrape_scaphandre(scaphandre_urls, uid_pod_map, timeout=5, timestamps=None):
+    """
+    Scrape engine reading Scaphandre directly, joined to the UID map like the grouped engine
+    (timestamps: see scrape_engine.join_uid_pod_map).
+    """
+    sample_times = {}
+    power_by_container, _ = fetch_scaphandre_power(scaphandre_urls, timeout, sample_times)
+    return join_uid_pod_map({container_id: (sample_times[container_id], power)
+                             for container_id, power in power_by_container.items()}, uid_pod_map, timestamps)
@@ -0,0 +1,121 @@
+import requests
+
+from prometheus_http import get_client
+
+# Scrape engines used by app.py to turn the UID -> pod map into per-pod power values.
+#
+# - "per-pod": the original engine, one Prometheus round trip per pod in the map.
+# - "grouped": one `sum(...) by (container_id)` query (optionally split in a few
+#   shards) whose result is joined to the UID map locally, so the number of HTTP
+#   requests per cycle does not depend on the number of pods.
+#
+# Both go through the shared pooled client of prometheus_http.py (keep-alive,
+# timeouts, retries and circuit breaker).
+#
+# Every query can be restricted with a base label matcher, e.g. node="worker-1" when
+# the exporter runs as a node-local DaemonSet.
+
+POWER_METRIC = "scaph_process_power_consumption_microwatts"
+
+# Hex digits of the truncated UID, used to split the grouped query in shards
+HEX_DIGITS = "0123456789abcdef"
+
+
+def join_matchers(*matchers):
+    """Join PromQL label matchers, skipping the empty ones."""
+    return ",".join(m for m in matchers if m)
+
+
+def node_matcher(node_name, node_label="node"):
+    """Label matcher restricting the Scaphandre series to one node (empty if node_name is not set)."""
+    return f'{node_label}="{node_name}"' if node_name else ""
+
+
+def fetch_metrics_for_uid(prometheus_url, truncated_uid, base_matcher=""):
+    """Fetches metrics from Prometheus for a specific truncated UID."""
+    matcher = join_matchers(f'container_id="{truncated_uid}"', base_matcher)
+    query = f'sum({POWER_METRIC}{{{matcher}}}) / 1000000'
+    try:
+        metrics_data = get_client(prometheus_url).query(query, name="per-pod")
+        return metrics_data.get('data', {}).get('result', [])
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching metrics for truncated UID {truncated_uid}: {e}")
+        return []
+
+
+def shard_matchers(shards):
+    """
+    Split the container_id space in `shards` regex matchers on the last hex digit
+    of the truncated UID. With a single shard no matcher is needed at all.
+    """
+    if shards <= 1:
+        return [""]
+    shards = min(shards, len(HEX_DIGITS))
+    groups = [HEX_DIGITS[i::shards] for i in range(shards)]
+    return [f'container_id=~".*[{group}{group.upper()}]"' for group in groups]
+
+
+def build_grouped_query(matcher=""):
+    """Build the grouped power query, in Watts, for one shard."""
+    return f'sum({POWER_METRIC}{{{matcher}}}) by (container_id) / 1000000'
+
+
+def fetch_grouped_metrics(prometheus_url, shards=1, base_matcher=""):
+    """
+    Fetches the power of every container in one grouped query per shard.
+
+    Returns:
+        dict: container_id -> (timestamp, value in Watts). Shards that fail are skipped.
+    """
+    values_by_container = {}
+    for matcher in shard_matchers(shards):
+        query = build_grouped_query(join_matchers(matcher, base_matcher))
+        try:
+            vector = get_client(prometheus_url).query_vector(query, 'container_id', name="grouped")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error fetching grouped metrics ({matcher or 'all containers'}): {e}")
+            continue
+        values_by_container.update(zip(vector.labels, zip(vector.timestamps, vector.values)))
+    return values_by_container
+
+
+def join_uid_pod_map(values_by_container, uid_pod_map, timestamps=None):
+    """
+    Join the grouped result to the UID -> pod map. Pods without a series are left out.
+
+    If `timestamps` is given, it is filled with pod -> timestamp of its sample, so the
+    energy is integrated over the time between samples rather than between cycles.
+    """
+    new_metrics = {}
+    for truncated_uid, pod_name in uid_pod_map.items():
+        sample = values_by_container.get(truncated_uid)
+        if sample is not None:
+            new_metrics[pod_name] = sample[1]
+            if timestamps is not None:
+                timestamps[pod_name] = sample[0]
+    return new_metrics
+
+
+def scrape_per_pod(prometheus_url, uid_pod_map, base_matcher="", timestamps=None):
+    """Original engine: one query per pod in the UID map (timestamps: see join_uid_pod_map)."""
+    new_metrics = {}
+    for truncated_uid, pod_name in uid_pod_map.items():
+        metrics = fetch_metrics_for_uid(prometheus_url, truncated_uid, base_matcher)
+        if metrics:
+            # Use the latest value available for this metric
+            new_metrics[pod_name] = float(metrics[0]['value'][1])
+            if timestamps is not None:
+                timestamps[pod_name] = float(metrics[0]['value'][0])
+    return new_metrics
+
+
+def scrape_grouped(prometheus_url, uid_pod_map, shards=1, base_matcher="", timestamps=None):
+    """Grouped engine: one query per shard, joined to the UID map locally (timestamps: see join_uid_pod_map)."""
+    return join_uid_pod_map(fetch_grouped_metrics(prometheus_url, shards, base_matcher), uid_pod_map, timestamps)
+
+
+SCRAPE_ENGINES = {
+    "per-pod": lambda prometheus_url, uid_pod_map, shards, base_matcher="", timestamps=None:
+        scrape_per_pod(prometheus_url, uid_pod_map, base_matcher, timestamps),
+    "grouped": scrape_grouped,
+}
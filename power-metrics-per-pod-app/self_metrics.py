@@ -0,0 +1,92 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Self-instrumentation of the exporter, under the power_exporter_ prefix.
+#
+# The metrics are created without a registry so the scrape engines and the pod index
+# can record into them when used on their own (e.g. from the benchmarks); app.py
+# registers them in its CollectorRegistry with register().
+#
+# Since /metrics is rendered at the end of each cycle, a stuck scrape loop shows up as
+# an old power_exporter_last_cycle_timestamp_seconds, e.g.:
+#   time() - power_exporter_last_cycle_timestamp_seconds > 3 * <scrape period>
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+CYCLE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 5, 10, 30)
+
+scrape_cycle_seconds = Histogram(
+    'power_exporter_scrape_cycle_seconds', 'Duration of a scrape cycle', buckets=CYCLE_BUCKETS, registry=None)
+scrape_cycle_overruns = Counter(
+    'power_exporter_scrape_cycle_overruns', 'Scrape cycles that took longer than the scrape period', registry=None)
+last_cycle_timestamp = Gauge(
+    'power_exporter_last_cycle_timestamp_seconds', 'Unix time of the end of the last scrape cycle', registry=None)
+render_seconds = Histogram(
+    'power_exporter_render_seconds', 'Duration of the rendering of the /metrics payload', buckets=REQUEST_BUCKETS, registry=None)
+
+request_seconds = Histogram(
+    'power_exporter_source_request_seconds', 'Duration of the requests to the metrics source',
+    ['source'], buckets=REQUEST_BUCKETS, registry=None)
+request_errors = Counter(
+    'power_exporter_source_request_errors', 'Failed requests to the metrics source', ['source'], registry=None)
+source_circuit_open = Gauge(
+    'power_exporter_source_circuit_open', '1 while the circuit breaker of the metrics source is open', ['source'], registry=None)
+
+kubectl_seconds = Histogram(
+    'power_exporter_kubectl_seconds', 'Duration of the kubectl calls of the pod index',
+    ['operation'], buckets=CYCLE_BUCKETS, registry=None)
+pod_watch_events = Counter(
+    'power_exporter_pod_watch_events', 'Pod watch events applied to the pod index', ['type'], registry=None)
+pod_index_last_event_timestamp = Gauge(
+    'power_exporter_pod_index_last_event_timestamp_seconds', 'Unix time of the last LIST or watch event applied to the pod index', registry=None)
+
+uid_pod_map_size = Gauge(
+    'power_exporter_uid_pod_map_size', 'Number of pods in the UID -> pod index', registry=None)
+pod_metrics_size = Gauge(
+    'power_exporter_pod_metrics_size', 'Number of pods with a power value', registry=None)
+pod_metrics_max_age = Gauge(
+    'power_exporter_pod_metrics_max_age_seconds', 'Age of the oldest pod power value', registry=None)
+stale_pods = Gauge(
+    'power_exporter_stale_pods', 'Pods whose power value was not refreshed by the last cycle', registry=None)
+
+ALL_METRICS = [
+    scrape_cycle_seconds, scrape_cycle_overruns, last_cycle_timestamp, render_seconds,
+    request_seconds, request_errors, source_circuit_open, kubectl_seconds, pod_watch_events, pod_index_last_event_timestamp,
+    uid_pod_map_size, pod_metrics_size, pod_metrics_max_age, stale_pods,
+]
+
+
+def register(registry):
+    """Register the self-instrumentation metrics in the app registry."""
+    for metric in ALL_METRICS:
+        registry.register(metric)
+
+
+@contextmanager
+def timed_request(source):
+    """Time a request to the metrics source and count it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        request_errors.labels(source=source).inc()
+        raise
+    finally:
+        request_seconds.labels(source=source).observe(time.perf_counter() - start)
+
+
+def observe_source_request(source, duration, error=False, circuit_open=False):
+    """Metrics hook of the Prometheus client (prometheus_http.PrometheusClient): one call, retries included."""
+    request_seconds.labels(source=source).observe(duration)
+    if error:
+        request_errors.labels(source=source).inc()
+    source_circuit_open.labels(source=source).set(circuit_open)
+
+
+def observe_cycle(duration, period):
+    """Record the duration of a scrape cycle, and an overrun if it took longer than its period."""
+    scrape_cycle_seconds.observe(duration)
+    if duration > period:
+        scrape_cycle_overruns.inc()
+    last_cycle_timestamp.set(time.time())
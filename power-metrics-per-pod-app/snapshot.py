@@ -0,0 +1,138 @@
+import os
+import pickle
+import threading
+import time
+
+# Metrics snapshot shared between one scraper process and many serving workers.
+#
+# The scraper writes the state the HTTP endpoints need in two files, by default on
+# /dev/shm so they never leave memory:
+# - the snapshot itself (pod index, latest values and the rendered /metrics payload),
+#   written every cycle;
+# - the history file next to it ("<path>.history", the PowerHistory ring buffers),
+#   written every `history_interval` seconds. The history is most of the bytes (about
+#   2.9 KB per pod with the default 15 minutes at a 5 s period, 2.9 MB at 1000 pods
+#   against about 0.2 MB for the rest), so writing it every cycle would make every
+#   worker decode it again every cycle.
+# Each write goes to a temporary file that is renamed over the target, so readers always
+# see a complete file. Workers decode a file again only when it has been replaced, and
+# keep their pod index when the resource version has not changed.
+
+HISTORY_SUFFIX = ".history"
+
+
+class ServingState:
+    """What the HTTP endpoints read: pod index, latest values, history and /metrics payload."""
+
+    def __init__(self, pod_index, pod_metrics, pod_last_update, pod_history, exposition_cache):
+        self.pod_index = pod_index
+        self.pod_metrics = pod_metrics
+        self.pod_last_update = pod_last_update
+        self.pod_history = pod_history
+        self.exposition_cache = exposition_cache
+
+
+def _file_id(path):
+    """Identity of the current version of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _replace_file(path, obj):
+    """Pickle obj to a temporary file and rename it over path."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing metrics snapshot to {path}: {e}")
+
+
+class SnapshotWriter:
+    """
+    Args:
+        path (str): Snapshot file; the history is written to path + ".history".
+        history_interval (float): Minimum seconds between two writes of the history.
+    """
+
+    def __init__(self, path, history_interval=0):
+        self.path = path
+        self.history_path = path + HISTORY_SUFFIX
+        self.history_interval = history_interval
+        self._history_written_at = None
+
+    def write(self, state):
+        """Atomically replace the snapshot with the given ServingState, and the history when it is due."""
+        now = time.monotonic()
+        if self._history_written_at is None or now - self._history_written_at >= self.history_interval:
+            _replace_file(self.history_path, state.pod_history.export())
+            self._history_written_at = now
+        _replace_file(self.path, {
+            "pods": state.pod_index.export(),
+            "resource_version": state.pod_index.resource_version,
+            "pod_metrics": dict(state.pod_metrics),
+            "pod_last_update": dict(state.pod_last_update),
+            "exposition": state.exposition_cache.export(),
+        })
+
+
+class SnapshotReader:
+    """
+    Args:
+        path (str): Snapshot file written by a SnapshotWriter.
+        new_state (callable): Returns an empty ServingState that the snapshot is loaded into.
+    """
+
+    def __init__(self, path, new_state):
+        self.path = path
+        self.history_path = path + HISTORY_SUFFIX
+        self.new_state = new_state
+        self._lock = threading.Lock()
+        self._file_ids = (None, None)
+        self._state = None
+
+    def current(self):
+        """Return the ServingState of the latest snapshot, or None if there is no snapshot yet."""
+        file_ids = (_file_id(self.path), _file_id(self.history_path))
+        if file_ids[0] is None:
+            return None
+        if file_ids != self._file_ids:
+            with self._lock:
+                if file_ids != self._file_ids:
+                    self._state = self._load(file_ids)
+                    self._file_ids = file_ids
+        return self._state
+
+    def _load(self, file_ids):
+        previous = self._state
+        state = self.new_state()
+        if file_ids[0] != self._file_ids[0]:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if previous is not None and previous.pod_index.resource_version == data["resource_version"]:
+                state.pod_index = previous.pod_index
+            else:
+                state.pod_index.replace(data["pods"], data["resource_version"])
+            state.pod_metrics.update(data["pod_metrics"])
+            state.pod_last_update.update(data["pod_last_update"])
+            state.exposition_cache.load(data["exposition"])
+        else:
+            state.pod_index = previous.pod_index
+            state.pod_metrics = previous.pod_metrics
+            state.pod_last_update = previous.pod_last_update
+            state.exposition_cache = previous.exposition_cache
+
+        if file_ids[1] is not None and file_ids[1] != self._file_ids[1]:
+            try:
+                with open(self.history_path, "rb") as f:
+                    state.pod_history.load(pickle.load(f))
+            except FileNotFoundError:
+                pass
+        elif previous is not None:
+            state.pod_history = previous.pod_history
+        return state
@@ -0,0 +1,37 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# The exporter modules and the benchmarks are flat scripts, not a package
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(APP_DIR)
+sys.path.append(os.path.join(APP_DIR, "benchmarks"))
+
+from benchmark_scaphandre_parser import make_fixture_server
+
+
+@pytest.fixture
+def scaphandre_server():
+    """Start local Scaphandre stand-ins: scaphandre_server(payload, status=200) returns the base URL."""
+    servers = []
+
+    def start(payload, status=200):
+        server = make_fixture_server(payload, status)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def refused_url():
+    """URL of a local port nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
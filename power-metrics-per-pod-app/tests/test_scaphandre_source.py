@@ -0,0 +1,82 @@
+from scaphandre_parser import HOST_POWER_METRIC, PROCESS_POWER_METRIC, parse_line, parse_power_lines
+from scaphandre_source import fetch_scaphandre_power, scrape_scaphandre
+
+PAYLOAD = b"""# HELP scaph_host_power_microwatts Power measurement on the whole host, in microwatts
+# TYPE scaph_host_power_microwatts gauge
+scaph_host_power_microwatts 52000000
+# HELP scaph_self_version Version number of scaphandre represented as a float.
+# TYPE scaph_self_version gauge
+scaph_self_version 0.5
+process_cpu_seconds_total 12.5
+# HELP scaph_process_power_consumption_microwatts Power consumption due to the process, measured on at the topology level, in microwatts
+# TYPE scaph_process_power_consumption_microwatts gauge
+scaph_process_power_consumption_microwatts{pid="1",exe="iperf",cmdline="iperf -s \\"quoted\\" C:\\\\tmp\\nnext",container_scheduler="docker",container_id="aaaaaaaaaaaa"} 1500000
+scaph_process_power_consumption_microwatts{pid="2",exe="iperf",cmdline="iperf -c 12.1.1.100",container_scheduler="docker",container_id="aaaaaaaaaaaa"} 500000
+scaph_process_power_consumption_microwatts{pid="3",exe="nr-softmodem",cmdline="nr-softmodem",container_scheduler="docker",container_id="bbbbbbbbbbbb"} 3000000
+scaph_process_power_consumption_microwatts{pid="4",exe="kthreadd",cmdline=""} 100
+scaph_process_cpu_usage_percentage{pid="1",exe="iperf",container_id="aaaaaaaaaaaa"} 12.0
+"""
+
+
+def test_parse_power_lines_keeps_only_the_power_metrics():
+    samples = list(parse_power_lines(PAYLOAD.splitlines()))
+
+    assert [name for name, _, _ in samples] == [HOST_POWER_METRIC] + [PROCESS_POWER_METRIC] * 4
+    assert samples[0] == (HOST_POWER_METRIC, {}, 52000000.0)
+    assert samples[3][1]['container_id'] == "bbbbbbbbbbbb"
+    assert samples[3][2] == 3000000.0
+
+
+def test_parse_power_lines_unescapes_label_values():
+    _, labels, value = list(parse_power_lines(PAYLOAD.splitlines()))[1]
+
+    assert labels['cmdline'] == 'iperf -s "quoted" C:\\tmp\nnext'
+    assert labels['container_id'] == "aaaaaaaaaaaa"
+    assert value == 1500000.0
+
+
+def test_parse_power_lines_skips_other_lines():
+    lines = [
+        b"# HELP scaph_process_power_consumption_microwatts help text",
+        b"scaph_process_cpu_usage_percentage{pid=\"1\"} 3",
+        b"node_cpu_seconds_total{cpu=\"0\"} 10",
+        b"",
+        b"scaph_host_power_microwatts",                   # No value
+        b"scaph_host_power_microwatts not-a-number",
+        b"scaph_process_power_consumption_microwatts{pid=\"1\" 5",  # Unclosed label set
+    ]
+
+    assert list(parse_power_lines(lines)) == []
+    assert parse_line("scaph_host_power_microwatts") is None
+
+
+def test_fetch_scaphandre_power(scaphandre_server):
+    url = scaphandre_server(PAYLOAD)
+
+    power_by_container, host_power = fetch_scaphandre_power([url])
+
+    assert host_power == {url: 52.0}
+    assert power_by_container == {"aaaaaaaaaaaa": 2.0, "bbbbbbbbbbbb": 3.0}
+
+
+def test_fetch_scaphandre_power_skips_failing_exporters(scaphandre_server, refused_url):
+    url = scaphandre_server(PAYLOAD)
+    failing_url = scaphandre_server(b"internal error", status=500)
+
+    power_by_container, host_power = fetch_scaphandre_power([failing_url, refused_url, url], timeout=2)
+
+    assert host_power == {url: 52.0}
+    assert power_by_container == {"aaaaaaaaaaaa": 2.0, "bbbbbbbbbbbb": 3.0}
+
+
+def test_scrape_scaphandre_joins_the_uid_map(scaphandre_server):
+    url = scaphandre_server(PAYLOAD)
+    uid_pod_map = {"aaaaaaaaaaaa": "oai-upf-0", "bbbbbbbbbbbb": "oai-gnb-0", "cccccccccccc": "idle-pod"}
+
+    assert scrape_scaphandre([url], uid_pod_map) == {"oai-upf-0": 2.0, "oai-gnb-0": 3.0}
+
+
+def test_scrape_scaphandre_with_the_exporter_down(scaphandre_server, refused_url):
+    failing_url = scaphandre_server(b"", status=500)
+
+    assert scrape_scaphandre([failing_url, refused_url], {"aaaaaaaaaaaa": "oai-upf-0"}, timeout=2) == {}
@@ -0,0 +1,70 @@
+"""
+Per-call overhead benchmark of the cluster access backends.
+
+Times --calls repetitions of the calls the experiment scripts make (pod list, pod get,
+and a trivial exec like the ones of check_ping or apply_tc_rule_to_cu) with:
+- KubectlCluster: one kubectl process per call (process start, kubeconfig parsing, TLS)
+- ApiCluster: one kubernetes ApiClient for all calls (see cluster.py)
+against the cluster of the current kubeconfig context.
+
+Usage:
+    python3 benchmarks/benchmark_cluster_calls.py --pod oai-upf-xxx --namespace core [--calls 20] [--command true]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cluster import ApiCluster, KubectlCluster
+
+
+def time_calls(call, num_calls):
+    """Run call() num_calls times (after one warm-up call) and return the latencies in seconds."""
+    call()
+    latencies = []
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_benchmark(pod_name, namespace, num_calls, command, backends):
+    clusters = {}
+    if "kubectl" in backends:
+        clusters["kubectl"] = KubectlCluster()
+    if "api" in backends:
+        start = time.perf_counter()
+        clusters["api"] = ApiCluster()
+        print(f"ApiCluster created in {(time.perf_counter() - start) * 1000:.1f} ms (once per process)")
+
+    print(f"{num_calls} calls per operation, pod {namespace}/{pod_name}")
+    print(f"{'backend':>8} {'operation':>10} {'mean (ms)':>10} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for name, cluster in clusters.items():
+        operations = {
+            "list": lambda: cluster.list_pods(namespace),
+            "get": lambda: cluster.get_pod(pod_name, namespace),
+            "exec": lambda: cluster.exec(pod_name, namespace, command, check=True),
+        }
+        for operation, call in operations.items():
+            latencies = sorted(time_calls(call, num_calls))
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"{name:>8} {operation:>10} {statistics.mean(latencies) * 1000:>10.1f} "
+                  f"{statistics.median(latencies) * 1000:>9.1f} {p95 * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-call overhead benchmark of the cluster access backends")
+    parser.add_argument("--pod", type=str, required=True, help="Pod used for the get and exec calls")
+    parser.add_argument("--namespace", type=str, required=True, help="Namespace of the pod")
+    parser.add_argument("--calls", type=int, default=20, help="Number of calls per operation")
+    parser.add_argument("--command", type=str, nargs='+', default=["true"], help="Command run by the exec calls")
+    parser.add_argument("--backends", type=str, nargs='+', choices=["kubectl", "api"], default=["kubectl", "api"],
+                        help="Backends to benchmark")
+    args = parser.parse_args()
+
+    run_benchmark(args.pod, args.namespace, args.calls, args.command, args.backends)
@@ -0,0 +1,150 @@
+"""
+Tick jitter benchmark of the thread and process metric samplers.
+
+Runs the energy collection for --duration seconds against a fake Prometheus (in its own
+process, answering with --containers series), while --load-threads threads reproduce the
+traffic load of the single_tests scripts in the same interpreter: each one reads the
+output of a child process line by line and parses it, like an iperf session with
+--reportstyle C. The collection runs either in a StoppableThread
+(collect_metrics_with_stop_event) or in a sampler process (collect_metrics_in_process),
+and the jitter of the ticks is read from the _ticks.json report of each run. The
+startup of the sampler process is reported apart and not counted in the duration.
+
+Usage:
+    python3 benchmarks/benchmark_sampler_jitter.py [--duration 30] [--load-threads 8] [--containers 50]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from process_sampler import collect_metrics_in_process
+from stoppable_thread import StoppableThread
+from utils import collect_metrics_with_stop_event
+
+# Prints iperf-like CSV report lines as fast as the pipe takes them
+IPERF_OUTPUT = (
+    "import sys\n"
+    "line = '20240101120000,12.1.1.100,5001,12.1.1.1,40000,3,0.0-1.0,1310720,10485760,0.012,0,0,0,0\\n' * 64\n"
+    "while True:\n"
+    "    sys.stdout.write(line)\n"
+)
+
+
+def serve_prometheus(port, num_containers):
+    """Fake Prometheus answering every instant query with one sample per container."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            now = time.time()
+            result = [{'metric': {'container_id': f"{i:012x}"}, 'value': [now, "0.25"]} for i in range(num_containers)]
+            body = json.dumps({'status': 'success', 'data': {'resultType': 'vector', 'result': result}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Fake Prometheus not listening on port {port}")
+
+
+def parse_iperf_output(stop_event):
+    """Read and parse iperf-like lines until the stop event is set."""
+    process = subprocess.Popen([sys.executable, "-c", IPERF_OUTPUT], stdout=subprocess.PIPE, text=True)
+    transferred = 0
+    try:
+        for line in process.stdout:
+            fields = line.rstrip().split(',')
+            transferred += int(fields[7])
+            if stop_event.is_set():
+                break
+    finally:
+        process.kill()
+        process.wait()
+    return transferred
+
+
+def run_mode(sampler, prometheus_url, duration, load_threads, tmp_dir):
+    """Run one collection under load and return its tick report."""
+    save_file_path = os.path.join(tmp_dir, f"metrics_energy_{sampler}.json")
+    target = collect_metrics_in_process if sampler == "process" else collect_metrics_with_stop_event
+
+    load_stop_event = threading.Event()
+    load = [threading.Thread(target=parse_iperf_output, args=(load_stop_event,)) for _ in range(load_threads)]
+    for t in load:
+        t.start()
+
+    stop_event = threading.Event()
+    started_event = threading.Event()
+    kwargs = {'started_event': started_event} if sampler == "process" else {}
+    metrics_thread = StoppableThread(target=target, args=(save_file_path, prometheus_url, "energy", None, stop_event),
+                                     kwargs=kwargs, stop_event=stop_event)
+    start = time.monotonic()
+    metrics_thread.start()
+    if sampler == "process":
+        started_event.wait()
+    startup = time.monotonic() - start
+    time.sleep(duration)
+    stop_event.set()
+    metrics_thread.join()
+
+    load_stop_event.set()
+    for t in load:
+        t.join()
+
+    with open(os.path.splitext(save_file_path)[0] + "_ticks.json") as f:
+        return {**json.load(f), 'startup_seconds': startup}
+
+
+def run_benchmark(duration, load_threads, num_containers, port):
+    server = multiprocessing.get_context("spawn").Process(target=serve_prometheus, args=(port, num_containers), daemon=True)
+    server.start()
+    wait_for_port(port)
+    prometheus_url = f"http://127.0.0.1:{port}"
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for sampler in ["thread", "process"]:
+            reports[sampler] = run_mode(sampler, prometheus_url, duration, load_threads, tmp_dir)
+    server.terminate()
+
+    print(f"{duration} s of energy collection, {num_containers} containers, {load_threads} load threads")
+    print(f"{'sampler':>8} {'startup (s)':>12} {'ticks':>6} {'skipped':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+    for sampler, report in reports.items():
+        print(f"{sampler:>8} {report['startup_seconds']:>12.2f} {report['ticks']:>6} {report['skipped_ticks']:>8} "
+              f"{report['jitter_p50_seconds'] * 1000:>9.2f} {report['jitter_p99_seconds'] * 1000:>9.2f} "
+              f"{report['jitter_max_seconds'] * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tick jitter benchmark of the thread and process metric samplers")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of collection per sampler")
+    parser.add_argument("--load-threads", type=int, default=8, help="Number of iperf-like threads in the interpreter")
+    parser.add_argument("--containers", type=int, default=50, help="Number of series returned by the fake Prometheus")
+    parser.add_argument("--port", type=int, default=19090, help="Port of the fake Prometheus")
+    args = parser.parse_args()
+
+    run_benchmark(args.duration, args.load_threads, args.containers, args.port)
@@ -0,0 +1,94 @@
+"""
+Memory benchmark of the collected metrics layouts.
+
+Simulates an energy collection of --containers containers sampled every second for
+--hours hours, and measures with tracemalloc the memory held by:
+- the list-of-dicts layout of collect_metrics_with_stop_event ({id: [{'timestamp', 'value', 'cmdline'}]})
+- the columnar SeriesStore (array('d') buffers and interned labels)
+and the size of the SeriesStore written as .npz.
+
+Usage:
+    python3 benchmarks/benchmark_series_memory.py [--containers 300] [--hours 3]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from series_store import SeriesStore
+
+
+def make_ticks(num_containers, num_ticks):
+    """Yield the output of fetch_energy_metrics for every tick of the run."""
+    container_ids = [f"{i:012x}" for i in range(num_containers)]
+    rng = random.Random(0)
+    start = 1700000000.0
+    for tick in range(num_ticks):
+        # Prometheus evaluation times are not exactly one second apart
+        timestamp = start + tick + rng.random() / 100
+        yield {container_id: [{'timestamp': timestamp, 'value': rng.uniform(0.05, 0.5), 'cmdline': 'unknown'}]
+               for container_id in container_ids}
+
+
+def measure(build):
+    """Run build() and return (result, bytes still allocated by it, seconds)."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def build_dicts(num_containers, num_ticks):
+    metrics_over_time = {}
+    for metrics in make_ticks(num_containers, num_ticks):
+        for id, data_points in metrics.items():
+            if id not in metrics_over_time:
+                metrics_over_time[id] = []
+            metrics_over_time[id].extend(data_points)
+    return metrics_over_time
+
+
+def build_store(num_containers, num_ticks):
+    store = SeriesStore()
+    for metrics in make_ticks(num_containers, num_ticks):
+        store.append(metrics)
+    return store
+
+
+def run_benchmark(num_containers, hours):
+    num_ticks = int(hours * 3600)
+    samples = num_containers * num_ticks
+    print(f"{num_containers} containers, {hours} h at 1 Hz: {samples} samples")
+    print(f"{'layout':>14} {'memory (MB)':>12} {'bytes/sample':>13} {'build (s)':>10}")
+
+    dicts, dict_bytes, dict_seconds = measure(lambda: build_dicts(num_containers, num_ticks))
+    print(f"{'list of dicts':>14} {dict_bytes / 1e6:>12.1f} {dict_bytes / samples:>13.1f} {dict_seconds:>10.2f}")
+    del dicts
+
+    store, store_bytes, store_seconds = measure(lambda: build_store(num_containers, num_ticks))
+    print(f"{'SeriesStore':>14} {store_bytes / 1e6:>12.1f} {store_bytes / samples:>13.1f} {store_seconds:>10.2f}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "metrics_energy.npz")
+        store.save_npz(path)
+        print(f"{'.npz on disk':>14} {os.path.getsize(path) / 1e6:>12.1f} {os.path.getsize(path) / samples:>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory benchmark of the collected metrics layouts")
+    parser.add_argument("--containers", type=int, default=300, help="Number of containers")
+    parser.add_argument("--hours", type=float, default=3, help="Length of the simulated run, in hours")
+    args = parser.parse_args()
+
+    run_benchmark(args.containers, args.hours)
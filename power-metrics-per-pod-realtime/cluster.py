@@ -0,0 +1,237 @@
+import json
+import os
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+# Cluster access for the experiment scripts: pod list/get, exec and copy.
+#
+# ApiCluster loads the kubeconfig (or the in-cluster service account) once and sends
+# every call through one authenticated kubernetes ApiClient: list/get reuse its urllib3
+# connection pool, and exec opens a websocket on it (the v4/v5 channel protocol that
+# kubectl exec uses), so a call pays neither the start of a kubectl process nor the
+# parsing of the kubeconfig. Without the kubernetes package, or without a usable config,
+# get_cluster() returns a KubectlCluster with the same methods that forks kubectl per call.
+#
+# Both backends return pods as the dicts of `kubectl get -o json` and follow subprocess.run
+# for exec: stdout/stderr are captured (None), discarded (subprocess.DEVNULL) or written to
+# a text file, check=True raises CalledProcessError and the timeout raises TimeoutExpired.
+
+try:
+    from kubernetes import client as kubernetes_client
+    from kubernetes import config as kubernetes_config
+    from kubernetes.client.rest import ApiException
+    from kubernetes.stream import stream
+except ImportError:
+    kubernetes_client = None
+    ApiException = OSError
+
+# Errors of the cluster calls, for callers that report them and go on
+CLUSTER_ERRORS = (subprocess.CalledProcessError, subprocess.TimeoutExpired, ApiException, OSError, ValueError)
+
+ExecResult = namedtuple("ExecResult", ["returncode", "stdout", "stderr"])
+
+
+def _output(target, chunks):
+    """Captured output of exec, None when it went to a file or to DEVNULL."""
+    return "".join(chunks) if target is None else None
+
+
+def _writer(target, chunks):
+    if target is None:
+        return chunks.append
+    if target == subprocess.DEVNULL:
+        return lambda text: None
+    return target.write
+
+
+class KubectlCluster:
+    """Cluster access through one kubectl process per call."""
+
+    def list_pods(self, namespace=None):
+        scope = ["-n", namespace] if namespace else ["--all-namespaces"]
+        result = subprocess.run(["kubectl", "get", "pods", *scope, "-o", "json"],
+                                capture_output=True, text=True, check=True)
+        return json.loads(result.stdout).get("items", [])
+
+    def get_pod(self, name, namespace):
+        result = subprocess.run(["kubectl", "get", "pod", name, "-n", namespace, "-o", "json"],
+                                capture_output=True, text=True, check=True)
+        return json.loads(result.stdout)
+
+    def exec(self, pod_name, namespace, command, container=None, stdout=None, stderr=None, timeout=None, check=False):
+        container_args = ["-c", container] if container else []
+        result = subprocess.run(["kubectl", "exec", pod_name, "-n", namespace, *container_args, "--", *command],
+                                stdout=subprocess.PIPE if stdout is None else stdout,
+                                stderr=subprocess.PIPE if stderr is None else stderr,
+                                text=True, timeout=timeout, check=check)
+        return ExecResult(result.returncode, result.stdout, result.stderr)
+
+    def exec_lines(self, pod_name, namespace, command, container=None, stderr=subprocess.DEVNULL, timeout=None, check=False):
+        """Yield the stdout lines of a command as they are printed. Closing the generator ends the command."""
+        container_args = ["-c", container] if container else []
+        args = ["kubectl", "exec", pod_name, "-n", namespace, *container_args, "--", *command]
+        with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr, text=True) as process:
+            timer = threading.Timer(timeout, process.kill) if timeout else None
+            if timer is not None:
+                timer.start()
+            try:
+                yield from process.stdout
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                if process.poll() is None:
+                    process.kill()
+        if timer is not None and timer.finished.is_set() and process.returncode < 0:
+            raise subprocess.TimeoutExpired(args, timeout)
+        if check and process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+    def copy_from(self, pod_name, namespace, remote_path, local_dir, container=None):
+        """Copy the content of a directory of the pod into local_dir."""
+        container_args = ["-c", container] if container else []
+        subprocess.run(["kubectl", "cp", f"{pod_name}:{remote_path}", local_dir, *container_args, "-n", namespace],
+                       check=True)
+
+
+class ApiCluster:
+    """
+    Cluster access through the Kubernetes API, with one authenticated connection pool.
+
+    Args:
+        kubeconfig (str): Kubeconfig file, the default one (KUBECONFIG or ~/.kube/config) if None.
+        context (str): Kubeconfig context, the current one if None.
+        pool_size (int): Connections kept open to the API server.
+    """
+    def __init__(self, kubeconfig=None, context=None, pool_size=10):
+        configuration = kubernetes_client.Configuration()
+        if kubeconfig is None and context is None and os.environ.get("KUBERNETES_SERVICE_HOST"):
+            kubernetes_config.load_incluster_config(client_configuration=configuration)
+        else:
+            kubernetes_config.load_kube_config(config_file=kubeconfig, context=context,
+                                               client_configuration=configuration)
+        configuration.connection_pool_maxsize = pool_size
+        self.api_client = kubernetes_client.ApiClient(configuration)
+        self.core = kubernetes_client.CoreV1Api(self.api_client)
+
+    def list_pods(self, namespace=None):
+        if namespace:
+            pods = self.core.list_namespaced_pod(namespace)
+        else:
+            pods = self.core.list_pod_for_all_namespaces()
+        return self.api_client.sanitize_for_serialization(pods).get("items", [])
+
+    def get_pod(self, name, namespace):
+        return self.api_client.sanitize_for_serialization(self.core.read_namespaced_pod(name, namespace))
+
+    def _open_exec(self, pod_name, namespace, command, container):
+        kwargs = {'container': container} if container else {}
+        return stream(self.core.connect_get_namespaced_pod_exec, pod_name, namespace, command=command,
+                      stdin=False, stdout=True, stderr=True, tty=False, binary=True, _preload_content=False, **kwargs)
+
+    def _run(self, ws, on_stdout, on_stderr, timeout, args):
+        """Pump the channels of an exec websocket until the command ends, return its exit code."""
+        deadline = time.monotonic() + timeout if timeout else None
+        while ws.is_open():
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(args, timeout)
+            ws.update(timeout=1)
+            if ws.peek_stdout():
+                on_stdout(ws.read_stdout())
+            if ws.peek_stderr():
+                on_stderr(ws.read_stderr())
+        on_stdout(ws.read_stdout())
+        on_stderr(ws.read_stderr())
+        try:
+            return ws.returncode
+        except (TypeError, KeyError, IndexError, ValueError):
+            return -1  # No status from the API server, e.g. the connection dropped
+
+    def exec(self, pod_name, namespace, command, container=None, stdout=None, stderr=None, timeout=None, check=False):
+        stdout_chunks, stderr_chunks = [], []
+        write_stdout, write_stderr = _writer(stdout, stdout_chunks), _writer(stderr, stderr_chunks)
+        ws = self._open_exec(pod_name, namespace, command, container)
+        try:
+            returncode = self._run(ws, lambda data: write_stdout(data.decode(errors="replace")),
+                                   lambda data: write_stderr(data.decode(errors="replace")), timeout, command)
+        finally:
+            ws.close()
+        result = ExecResult(returncode, _output(stdout, stdout_chunks), _output(stderr, stderr_chunks))
+        if check and returncode:
+            raise subprocess.CalledProcessError(returncode, command, result.stdout, result.stderr)
+        return result
+
+    def exec_lines(self, pod_name, namespace, command, container=None, stderr=subprocess.DEVNULL, timeout=None, check=False):
+        """Yield the stdout lines of a command as they are printed. Closing the generator ends the command."""
+        write_stderr = _writer(stderr, [])
+        deadline = time.monotonic() + timeout if timeout else None
+        ws = self._open_exec(pod_name, namespace, command, container)
+        buffer = b""
+        try:
+            while ws.is_open():
+                if deadline is not None and time.monotonic() > deadline:
+                    raise subprocess.TimeoutExpired(command, timeout)
+                ws.update(timeout=1)
+                if ws.peek_stderr():
+                    write_stderr(ws.read_stderr().decode(errors="replace"))
+                if ws.peek_stdout():
+                    *lines, buffer = (buffer + ws.read_stdout()).split(b"\n")
+                    for line in lines:
+                        yield line.decode(errors="replace") + "\n"
+            buffer += ws.read_stdout()
+            for line in buffer.split(b"\n"):
+                if line:
+                    yield line.decode(errors="replace") + "\n"
+            try:
+                returncode = ws.returncode
+            except (TypeError, KeyError, IndexError, ValueError):
+                returncode = -1
+        finally:
+            ws.close()
+        if check and returncode:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def copy_from(self, pod_name, namespace, remote_path, local_dir, container=None):
+        """Copy the content of a directory of the pod into local_dir (tar must exist in the container, like for kubectl cp)."""
+        command = ["tar", "cf", "-", "-C", remote_path, "."]
+        os.makedirs(local_dir, exist_ok=True)
+        with tempfile.TemporaryFile() as archive:
+            ws = self._open_exec(pod_name, namespace, command, container)
+            errors = []
+            try:
+                returncode = self._run(ws, archive.write, errors.append, None, command)
+            finally:
+                ws.close()
+            if returncode:
+                raise subprocess.CalledProcessError(returncode, command, None, b"".join(errors).decode(errors="replace"))
+            archive.seek(0)
+            with tarfile.open(fileobj=archive) as tar:
+                root = os.path.realpath(local_dir)
+                members = [member for member in tar.getmembers()
+                           if os.path.realpath(os.path.join(root, member.name)).startswith(root)
+                           and not (member.issym() or member.islnk() or member.isdev())]
+                tar.extractall(local_dir, members=members)
+
+
+_cluster = None
+_cluster_lock = threading.Lock()
+
+
+def get_cluster():
+    """Shared cluster access of the process: the API client if possible, kubectl otherwise."""
+    global _cluster
+    with _cluster_lock:
+        if _cluster is None:
+            if kubernetes_client is None:
+                print("kubernetes package not installed, using kubectl for the cluster calls")
+                _cluster = KubectlCluster()
+            else:
+                try:
+                    _cluster = ApiCluster()
+                except Exception as e:  # kubernetes ConfigException, missing or invalid kubeconfig
+                    print(f"Cannot load the Kubernetes configuration ({e}), using kubectl for the cluster calls")
+                    _cluster = KubectlCluster()
+        return _cluster
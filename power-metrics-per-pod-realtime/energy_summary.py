@@ -0,0 +1,105 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+
+class EnergyAccumulator:
+    """
+    Running per-container energy totals, integrated while the metrics are collected.
+
+    Power samples (Watts) are integrated with the trapezoid rule on their own timestamps,
+    so missed ticks do not bias the totals like dx=1 would. The orchestrator marks the
+    phases of the experiment with mark_phase() ("baseline", "traffic", "cooldown"); every
+    phase change is a timestamp, and an interval that spans a change is split there with
+    a linearly interpolated power, so each phase gets exactly its share of the energy.
+
+    Args:
+        phase (str): Phase the collection starts in.
+    """
+    def __init__(self, phase="baseline"):
+        self._lock = threading.Lock()
+        self._phase_starts = [float("-inf")]
+        self._phase_names = [phase]
+        self._last_sample = {}  # id -> (timestamp, value)
+        self._totals = {}       # (phase, id) -> [energy in J, integrated seconds, samples, first timestamp, last timestamp]
+
+    def mark_phase(self, phase, timestamp=None):
+        """Start a new phase now, or at the given Unix time."""
+        with self._lock:
+            self._phase_starts.append(time.time() if timestamp is None else timestamp)
+            self._phase_names.append(phase)
+
+    def _phase_index(self, timestamp):
+        return bisect.bisect_right(self._phase_starts, timestamp) - 1
+
+    def _totals_of(self, phase, id):
+        totals = self._totals.get((phase, id))
+        if totals is None:
+            totals = self._totals[(phase, id)] = [0.0, 0.0, 0, None, None]
+        return totals
+
+    def add(self, metrics):
+        """Integrate metrics in the format of the fetch_*_metrics functions ({id: [entries]}, values in Watts)."""
+        with self._lock:
+            for id, data_points in metrics.items():
+                for entry in data_points:
+                    self._add_sample(id, entry['timestamp'], entry['value'])
+
+    def _add_sample(self, id, timestamp, value):
+        previous = self._last_sample.get(id)
+        if previous is not None and timestamp <= previous[0]:
+            return  # Same Prometheus sample as the last tick, or out of order
+        self._last_sample[id] = (timestamp, value)
+
+        # Only distinct timestamps are counted as samples
+        phase_index = self._phase_index(timestamp)
+        totals = self._totals_of(self._phase_names[phase_index], id)
+        totals[2] += 1
+        totals[3] = timestamp if totals[3] is None else totals[3]
+        totals[4] = timestamp
+        if previous is None:
+            return
+
+        # Split the interval at the phase changes it spans
+        previous_timestamp, previous_value = previous
+        start, start_value = previous
+        for index in range(self._phase_index(previous_timestamp), phase_index + 1):
+            end = self._phase_starts[index + 1] if index < phase_index else timestamp
+            end_value = previous_value + (value - previous_value) * (end - previous_timestamp) / (timestamp - previous_timestamp)
+            if end > start:
+                totals = self._totals_of(self._phase_names[index], id)
+                totals[0] += (start_value + end_value) / 2 * (end - start)
+                totals[1] += end - start
+            start, start_value = end, end_value
+
+    def summary(self):
+        """
+        Returns:
+            dict: {'phases': [{'phase', 'start'}], 'energy': {phase: {id: {energy_joules, integrated_seconds,
+            samples, first_timestamp, last_timestamp, mean_power_watts}}}}
+        """
+        with self._lock:
+            energy = {}
+            for (phase, id), (joules, seconds, samples, first, last) in self._totals.items():
+                energy.setdefault(phase, {})[id] = {
+                    'energy_joules': joules,
+                    'integrated_seconds': seconds,
+                    'samples': samples,
+                    'first_timestamp': first,
+                    'last_timestamp': last,
+                    'mean_power_watts': joules / seconds if seconds > 0 else None,
+                }
+            phases = [{'phase': name, 'start': start if start != float("-inf") else None}
+                      for name, start in zip(self._phase_names, self._phase_starts)]
+            return {'phases': phases, 'energy': energy}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=1)
+
+
+def energy_summary_path(save_file_path):
+    """Summary file written next to the raw data (metrics_energy.json -> metrics_energy_summary.json)."""
+    return os.path.splitext(save_file_path)[0] + "_summary.json"
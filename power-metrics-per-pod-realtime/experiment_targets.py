@@ -0,0 +1,87 @@
+import threading
+
+from cluster import CLUSTER_ERRORS, get_cluster
+
+
+def truncate_uid(uid):
+    """Last part of a pod UID, which is what Scaphandre exposes as container_id."""
+    return uid.split('-')[-1]
+
+
+def container_id_matcher(container_ids):
+    """
+    PromQL matcher selecting the given Scaphandre container IDs (truncated pod UIDs).
+    An empty set gives a matcher that selects nothing.
+    """
+    if not container_ids:
+        return 'container_id="none"'
+    return 'container_id=~"' + "|".join(sorted(container_ids)) + '"'
+
+
+class ExperimentTargets:
+    """
+    Pods an experiment collects energy for, as a container_id matcher for the energy query.
+
+    The targets are either fixed pod UIDs (e.g. the keys of load_uid_pod_map) or namespaces,
+    whose pods are listed through the shared cluster client (cluster.get_cluster). Between
+    start() and stop() a background thread lists them again every `refresh_interval` seconds
+    so pods created during the run (scaling, restarts) are picked up. Container IDs seen once
+    are kept until the end of the run, so a backfill at stop still covers deleted pods.
+
+    Args:
+        namespaces (list): Namespaces whose pods are targeted (e.g. ["core", "ran"]).
+        uids (list): Pod UIDs that are targeted.
+        refresh_interval (float): Seconds between two listings of the namespaces.
+    """
+    def __init__(self, namespaces=None, uids=None, refresh_interval=15):
+        self.namespaces = list(namespaces or [])
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._container_ids = {truncate_uid(uid) for uid in uids or []}
+        self._matcher = container_id_matcher(self._container_ids)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """List the namespaces once, then keep listing them in a background thread until stop()."""
+        if self.namespaces and self._thread is None:
+            self._stop_event.clear()
+            self.refresh()
+            self._thread = threading.Thread(target=self._refresh_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def refresh(self):
+        """List the pods of the namespaces and add their container IDs to the targets."""
+        container_ids = set()
+        for namespace in self.namespaces:
+            try:
+                pods = get_cluster().list_pods(namespace)
+            except CLUSTER_ERRORS as e:
+                print(f"Error listing the pods of namespace {namespace}: {e}")
+                continue
+            for pod in pods:
+                uid = pod.get('metadata', {}).get('uid')
+                if uid:
+                    container_ids.add(truncate_uid(uid))
+        with self._lock:
+            if not container_ids <= self._container_ids:
+                self._container_ids |= container_ids
+                self._matcher = container_id_matcher(self._container_ids)
+
+    def _refresh_forever(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            self.refresh()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def container_ids(self):
+        with self._lock:
+            return set(self._container_ids)
+
+    def matcher(self):
+        return self._matcher
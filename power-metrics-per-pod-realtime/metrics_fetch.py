@@ -0,0 +1,236 @@
+import time
+
+import requests
+
+# Standalone modules of the power-metrics-per-pod-app exporter, symlinked into this directory
+from scaphandre_parser import HOST_POWER_METRIC, PROCESS_POWER_METRIC, fetch_scaphandre_samples
+from prometheus_http import get_client
+
+# Queries and fetch helpers of the metric collectors.
+#
+# Kept apart from utils.py (matplotlib, pandas, the cluster client) so the sampler process
+# of process_sampler.py only imports what a tick needs. utils.py re-exports every name.
+
+# Queries of the collectors, in Watts for the energy ones and in % of the CPU limit for the CPU one
+HOST_ENERGY_QUERY = 'scaph_host_power_microwatts / 1000000 > 0.001'
+
+
+def energy_query(targets=None):
+    """Per-container energy query, restricted to the experiment pods when targets (ExperimentTargets) is set."""
+    matcher = f",{targets.matcher()}" if targets else ""
+    return f'sum(scaph_process_power_consumption_microwatts{{container_scheduler="docker"{matcher}}} / 1000000) by (container_id)'
+
+
+def cpu_query(pod_name, window="5s"):
+    return (
+        f'100 * (sum(rate(container_cpu_usage_seconds_total{{pod="{pod_name}"}}[{window}])) by (pod) '
+        f'/ sum(kube_pod_container_resource_limits{{pod="{pod_name}", resource="cpu"}}) by (pod))'
+    )
+
+
+# Seconds the circuit breaker of the collector client stays open before a trial query:
+# about two Prometheus scrape intervals, so an outage costs a few ticks, not the rest of the run
+BREAKER_RESET_SECONDS = 2.0
+
+
+def prometheus_client(prometheus_url):
+    """Shared pooled Prometheus client of the collectors (see prometheus_http.py), with a breaker suited to 1 s polling."""
+    return get_client(prometheus_url, reset_timeout=BREAKER_RESET_SECONDS)
+
+
+def fetch_host_energy_metrics(prometheus_url, query, eval_time=None):
+    """
+    Fetches the host power from Prometheus, grouped by node, in the format of fetch_energy_metrics.
+
+    Raises:
+        requests.exceptions.RequestException: If the query failed, so the collector records the failed tick.
+        ValueError: If the response cannot be decoded.
+    """
+    # Send the query to Prometheus, decoded into node / timestamp / value columns
+    vector = prometheus_client(prometheus_url).query_vector(query, 'node', eval_time=eval_time)
+
+    # Initialize the metrics dictionary (series without a node label are skipped)
+    metrics_by_node = {}
+    for node_name, timestamp, value in zip(*vector):
+        # Initialize the node entry if it doesn't exist
+        if node_name not in metrics_by_node:
+            metrics_by_node[node_name] = []
+        
+        # Append the metric entry, stamped with the Prometheus evaluation timestamp
+        metrics_by_node[node_name].append({
+            'timestamp': timestamp,
+            'value': value,
+        })
+
+    return metrics_by_node
+
+
+def fetch_energy_metrics(prometheus_url, query, eval_time=None):
+    """
+    Fetches metrics from Prometheus and returns a dictionary of values grouped by container ID.
+    
+    Args:
+        prometheus_url (str): Base URL of the Prometheus server.
+        query (str): Prometheus query to retrieve the desired metrics, aggregated by container_id.
+        eval_time (float): Optional Unix time to evaluate the query at (default: now).
+    
+    Returns:
+        dict: A dictionary where keys are container IDs and values are lists of metric entries.
+        cmdline is 'unknown', since the query aggregates the processes of a container.
+
+    Raises:
+        requests.exceptions.RequestException: If the query failed, so the collector records the failed tick.
+        ValueError: If the response cannot be decoded.
+    """
+    # Send the query to Prometheus, decoded into container_id / timestamp / value columns
+    vector = prometheus_client(prometheus_url).query_vector(query, 'container_id', eval_time=eval_time)
+
+    # Initialize the metrics dictionary (series without a container ID are skipped)
+    metrics_by_container = {}
+    for container_id, timestamp, value in zip(*vector):
+        # Initialize the container ID entry if it doesn't exist
+        if container_id not in metrics_by_container:
+            metrics_by_container[container_id] = []
+        
+        # Append the metric entry, stamped with the Prometheus evaluation timestamp
+        metrics_by_container[container_id].append({
+            'timestamp': timestamp,
+            'value': value,
+            'cmdline': 'unknown'
+        })
+
+    return metrics_by_container
+
+
+def fetch_energy_metrics_direct(scaphandre_url, timeout=5, container_ids=None):
+    """
+    Scrapes the Scaphandre exporter directly and returns the process power grouped by container ID,
+    in the same format as fetch_energy_metrics.
+
+    Args:
+        scaphandre_url (str): Base URL of the Scaphandre exporter (e.g. http://<node-ip>:8080).
+        timeout (float): Request timeout in seconds.
+        container_ids (set): Optional container IDs to keep (e.g. ExperimentTargets.container_ids()).
+
+    Returns:
+        dict: A dictionary where keys are container IDs and values are lists of metric entries.
+
+    Raises:
+        requests.exceptions.RequestException: If the scrape failed.
+    """
+    samples = fetch_scaphandre_samples(scaphandre_url, timeout, prefixes=(PROCESS_POWER_METRIC.encode(),))
+
+    timestamp = time.time()
+    metrics_by_container = {}
+    for name, labels, value in samples:
+        container_id = labels.get('container_id')
+        if name != PROCESS_POWER_METRIC or not container_id or labels.get('container_scheduler') != 'docker':
+            continue  # Skip entries with no valid container ID
+        if container_ids is not None and container_id not in container_ids:
+            continue  # Skip containers outside the experiment
+        if container_id not in metrics_by_container:
+            # cmdline is 'unknown' like with the Prometheus query, where sum by (container_id) drops it
+            metrics_by_container[container_id] = [{'timestamp': timestamp, 'value': 0.0, 'cmdline': 'unknown'}]
+        # Same as the Prometheus query: sum over the processes of the container, in Watts
+        metrics_by_container[container_id][0]['value'] += value / 1000000
+    return metrics_by_container
+
+
+def fetch_host_energy_metrics_direct(scaphandre_url, node_name, timeout=5):
+    """Scrapes the host power from the Scaphandre exporter of one node, in the format of fetch_host_energy_metrics (raises like it)."""
+    samples = fetch_scaphandre_samples(scaphandre_url, timeout, prefixes=(HOST_POWER_METRIC.encode(),))
+
+    for name, labels, value in samples:
+        if name == HOST_POWER_METRIC:
+            return {node_name: [{'timestamp': time.time(), 'value': value / 1000000}]}
+    return {}
+
+
+# Prometheus refuses range queries of more than 11000 points per series
+MAX_RANGE_POINTS = 10000
+
+
+def fetch_range_metrics(prometheus_url, query, start, end, step, key_label, default_key=None, errors=None):
+    """
+    Pulls a whole time window with chunked query_range calls, in the format of the fetch_*_metrics functions.
+
+    Args:
+        prometheus_url (str): Base URL of the Prometheus server.
+        query (str): Prometheus query to evaluate over the window.
+        start (float): Unix time of the start of the window.
+        end (float): Unix time of the end of the window.
+        step (float): Seconds between two points, normally the Prometheus scrape interval.
+        key_label (str): Series label the result is grouped by (e.g. 'container_id').
+        default_key (str): Key used for series without key_label (e.g. the pod name of the CPU query).
+        errors (list): Optional list the errors of the failed chunks are appended to. A failed
+            chunk is skipped and the others are still pulled.
+
+    Returns:
+        dict: A dictionary where keys are key_label values and values are lists of metric entries,
+        stamped with the Prometheus evaluation time.
+    """
+    metrics_by_key = {}
+    chunk_seconds = step * (MAX_RANGE_POINTS - 1)
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(end, chunk_start + chunk_seconds)
+        try:
+            result = prometheus_client(prometheus_url).query_range(query, chunk_start, chunk_end, step, name=query)
+            if result['status'] != 'success' or 'data' not in result:
+                raise ValueError(f"Unexpected response structure: {result}")
+            for entry in result['data']['result']:
+                key = entry['metric'].get(key_label, default_key)
+                if key is None:
+                    continue  # Skip series with no valid key
+                data_points = metrics_by_key.setdefault(key, [])
+                for timestamp, value in entry['values']:
+                    data_point = {'timestamp': float(timestamp), 'value': float(value)}
+                    if key_label == 'container_id':
+                        # Same as fetch_energy_metrics: sum by (container_id) drops cmdline
+                        data_point['cmdline'] = 'unknown'
+                    data_points.append(data_point)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching metrics from Prometheus between {chunk_start} and {chunk_end}: {e}")
+            if errors is not None:
+                errors.append(e)
+        except (ValueError, KeyError) as e:
+            print(f"Error parsing Prometheus response: {e}")
+            if errors is not None:
+                errors.append(e)
+        chunk_start = chunk_end + step
+    return metrics_by_key
+
+
+def fetch_cpu_metrics(prometheus_url, query, pod_name, eval_time=None):
+    """
+    Fetches the CPU usage of a pod from Prometheus, in % of its CPU limit, keyed by the pod name.
+
+    Raises:
+        requests.exceptions.RequestException: If the query failed, so the collector records the failed tick.
+        ValueError: If the response cannot be decoded or is not a success.
+    """
+    # Send the query to Prometheus through the shared pooled client (JSON already parsed)
+    result = prometheus_client(prometheus_url).query(query, eval_time=eval_time)
+
+    if result['status'] != 'success' or 'data' not in result:
+        raise ValueError(f"Unexpected response structure: {result}")
+
+    # Initialize the metrics dictionary
+    metrics_by_pod = {}
+    
+    for entry in result['data']['result']:
+        
+        value = float(entry['value'][1])  # Metric value (e.g., power consumption)
+        timestamp = float(entry['value'][0])  # Prometheus evaluation timestamp
+        
+        # Initialize the container ID entry if it doesn't exist
+        if pod_name not in metrics_by_pod:
+            metrics_by_pod[pod_name] = []
+        
+        # Append the metric entry
+        metrics_by_pod[pod_name].append({
+            'timestamp': timestamp,
+            'value': value,
+        })
+
+    return metrics_by_pod
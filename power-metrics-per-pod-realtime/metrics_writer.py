@@ -0,0 +1,102 @@
+import json
+import os
+import time
+
+import pandas as pd
+
+
+class MetricsWriter:
+    """
+    Append-only NDJSON writer for the metric collectors.
+
+    Every tick is written as one JSON line, so memory does not grow with the length of the
+    run. Lines are flushed to the OS after every tick and fsync'ed every `fsync_interval`
+    seconds, so a crash loses at most the last few seconds. load_metrics() rebuilds the
+    usual {id: [entries]} dict from lines written with the output of the fetch_*_metrics
+    functions, and load_aligned_metrics() reads the rows of collect_all_metrics_with_stop_event.
+
+    Args:
+        path (str): NDJSON file to write, truncated when the writer is created.
+        fsync_interval (float): Seconds between two fsync calls.
+    """
+    def __init__(self, path, fsync_interval=5.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._file = open(path, "w")
+        self._last_fsync = time.monotonic()
+
+    def write(self, metrics):
+        """Append the metrics of one tick."""
+        if not metrics:
+            return
+        self._file.write(json.dumps(metrics, separators=(',', ':')) + "\n")
+        self._file.flush()
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def ndjson_path(save_file_path):
+    """NDJSON file streamed during the collection of save_file_path (metrics_energy.json -> metrics_energy.ndjson)."""
+    return os.path.splitext(save_file_path)[0] + ".ndjson"
+
+
+def load_metrics(path):
+    """
+    Load collected metrics in the {id: [entries]} format, from a JSON file or from the
+    NDJSON file of a MetricsWriter. A line cut by a crash at the end of the file is skipped.
+    """
+    with open(path, "r") as f:
+        if not path.endswith(".ndjson"):
+            return json.load(f)
+
+        metrics_over_time = {}
+        for line in f:
+            try:
+                metrics = json.loads(line)
+            except ValueError:
+                print(f"Skipping incomplete line in {path}")
+                continue
+            for id, data_points in metrics.items():
+                if id not in metrics_over_time:
+                    metrics_over_time[id] = []
+                metrics_over_time[id].extend(data_points)
+        return metrics_over_time
+
+
+def load_aligned_metrics(path):
+    """
+    Load the NDJSON file of collect_all_metrics_with_stop_event as a DataFrame indexed by the
+    tick timestamp, with one "<mode>/<id>" column per series (NaN where a query failed).
+    """
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                tick = json.loads(line)
+            except ValueError:
+                print(f"Skipping incomplete line in {path}")
+                continue
+            row = {'timestamp': tick.pop('timestamp')}
+            for mode, values in tick.items():
+                for id, value in values.items():
+                    row[f"{mode}/{id}"] = value
+            rows.append(row)
+    if not rows:
+        return pd.DataFrame(columns=['timestamp']).set_index('timestamp')
+    df = pd.DataFrame(rows).set_index('timestamp')
+    return df[sorted(df.columns)]
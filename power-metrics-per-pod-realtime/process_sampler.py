@@ -0,0 +1,240 @@
+import json
+import multiprocessing
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from tick_scheduler import TickScheduler, save_tick_report
+from metrics_fetch import (HOST_ENERGY_QUERY, cpu_query, energy_query, fetch_cpu_metrics, fetch_energy_metrics,
+                           fetch_host_energy_metrics, prometheus_client)
+from energy_summary import EnergyAccumulator, energy_summary_path
+from sampling_quality import SamplingQuality, quality_path
+
+# Out-of-process metric sampler.
+#
+# collect_metrics_in_process() is a drop-in target for the StoppableThread of
+# collect_metrics_with_stop_event: the thread only starts a sampler process and waits for
+# the stop event, so the ticks of the sampler do not compete for the GIL with the iperf
+# threads of the experiment. The sampler writes its samples and the jitter of its ticks
+# to ring buffers in shared memory, which the parent reads once at stop. The tick records
+# also carry the request latency, so the parent can write the sampling quality report.
+#
+# The query is kept in a shared character array that the parent rewrites while the run goes
+# on, so the sampler follows the targets refreshed in the parent (ExperimentTargets) like the
+# thread collectors, which rebuild the energy query on every tick.
+#
+# The process is started with "spawn", since forking a process that runs other threads
+# (iperf, kubectl) can copy locks held by those threads. The spawned interpreter imports
+# this module, so it only depends on light modules (metrics_fetch, not utils).
+
+SAMPLE_DTYPE = np.dtype([('timestamp', 'f8'), ('value', 'f8'), ('id', 'S64')])
+TICK_DTYPE = np.dtype([('scheduled', 'f8'), ('jitter', 'f8'), ('latency', 'f8'), ('samples', 'i4'), ('error', '?')])
+
+# Bytes of the shared query: the energy matcher of a few thousand pods (13 bytes per container ID)
+QUERY_BUFFER_SIZE = 64 * 1024
+
+
+def set_shared_query(shared_query, query):
+    """Publish a new query to the sampler process. Returns False if it does not fit (the sampler keeps the previous one)."""
+    encoded = query.encode()
+    if len(encoded) >= len(shared_query):
+        print(f"Query of {len(encoded)} bytes does not fit in the shared query buffer, keeping the previous one")
+        return False
+    with shared_query.get_lock():
+        shared_query.value = encoded
+    return True
+
+
+def get_shared_query(shared_query):
+    with shared_query.get_lock():
+        return shared_query.value.decode()
+
+
+class SharedRingBuffer:
+    """
+    Fixed-size ring buffer of numpy records in shared memory, for one writer process.
+
+    The first 8 bytes hold the number of records ever appended; once the buffer is full
+    the oldest records are overwritten.
+
+    Args:
+        dtype (numpy.dtype): Record type.
+        capacity (int): Number of records kept.
+        name (str): Name of an existing buffer to attach to (None creates a new one).
+    """
+    def __init__(self, dtype, capacity, name=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.shm = SharedMemory(name=name, create=name is None, size=8 + capacity * self.dtype.itemsize)
+        self._count = np.ndarray((1,), dtype=np.uint64, buffer=self.shm.buf)
+        self._records = np.ndarray((capacity,), dtype=self.dtype, buffer=self.shm.buf, offset=8)
+        if name is None:
+            self._count[0] = 0
+
+    def __reduce__(self):
+        # A spawned process attaches to the same shared memory by name
+        return (SharedRingBuffer, (self.dtype, self.capacity, self.shm.name))
+
+    def append(self, record):
+        count = int(self._count[0])
+        self._records[count % self.capacity] = record
+        self._count[0] = count + 1
+
+    def read(self):
+        """
+        Returns:
+            tuple: (records in append order as a numpy array, number of records overwritten)
+        """
+        count = int(self._count[0])
+        if count <= self.capacity:
+            return self._records[:count].copy(), 0
+        head = count % self.capacity
+        return np.concatenate((self._records[head:], self._records[:head])), count - self.capacity
+
+    def close(self, unlink=False):
+        del self._count, self._records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def run_sampler(samples, ticks, prometheus_url, mode, shared_query, pod_name_cpu_metrics, stop_event, ready_event, period):
+    """
+    Sampler process: fetch on every tick, with the current query of the parent, and append the
+    samples and the tick jitter to the ring buffers.
+    """
+    if mode == "cpu":
+        fetch = lambda query: fetch_cpu_metrics(prometheus_url, query, pod_name_cpu_metrics)
+    elif mode == "host_energy":
+        fetch = lambda query: fetch_host_energy_metrics(prometheus_url, query)
+    else:
+        fetch = lambda query: fetch_energy_metrics(prometheus_url, query)
+    query = get_shared_query(shared_query)
+
+    scheduler = TickScheduler(period, stop_event=stop_event)
+    ready_event.set()
+    try:
+        while scheduler.wait():
+            request_start = time.monotonic()
+            try:
+                query = get_shared_query(shared_query)
+                metrics = fetch(query)
+            except Exception as e:
+                ticks.append((scheduler.scheduled[-1], scheduler.jitter[-1], time.monotonic() - request_start, 0, True))
+                print(f"Error collecting metrics: {e}")
+                continue
+            ticks.append((scheduler.scheduled[-1], scheduler.jitter[-1], time.monotonic() - request_start,
+                          sum(map(len, metrics.values())), False))
+            for id, data_points in metrics.items():
+                for entry in data_points:
+                    samples.append((entry['timestamp'], entry['value'], id.encode()[:64]))
+    finally:
+        samples.close()
+        ticks.close()
+        stats = prometheus_client(prometheus_url).latency_stats().get(query)
+        if stats:
+            print(f"Prometheus query latency ({mode}, sampler process): {stats['count']} queries, {stats['errors']} errors, "
+                  f"p50 {stats['p50_seconds'] * 1000:.1f} ms, p95 {stats['p95_seconds'] * 1000:.1f} ms, "
+                  f"max {stats['max_seconds'] * 1000:.1f} ms")
+
+
+def collect_metrics_in_process(save_file_path, prometheus_url, mode, pod_name_cpu_metrics, stop_event, period=1,
+                               capacity=100000, targets=None, energy=None, started_event=None):
+    """
+    Collect metrics in a separate sampler process until a stop event is triggered, and save them in
+    the format of collect_metrics_with_stop_event (plus the tick, energy and sampling quality reports).
+
+    Args:
+        save_file_path (str): Path to save the collected metrics.
+        prometheus_url (str): Prometheus server URL.
+        mode (str): Mode of metrics collection ('cpu', 'energy', or 'host_energy').
+        pod_name_cpu_metrics (str): Pod name for CPU metrics.
+        stop_event (threading.Event): Event to signal stopping the collection.
+        period (float): Seconds between two ticks.
+        capacity (int): Samples kept in shared memory (80 bytes each); older ones are overwritten.
+            One tick record (29 bytes) is kept per 10 samples. The default (8 MB) fits in the
+            64 MB /dev/shm of a default Docker container: about 25 minutes of 60 containers at 1 s.
+        targets (ExperimentTargets): Optional experiment pods of the 'energy' mode. The query is
+            rebuilt from them every period and handed to the sampler process (see set_shared_query).
+        energy (EnergyAccumulator): Running energy totals of the 'energy' and 'host_energy' modes, fed
+            with the samples at stop. A single-phase one is used if not given.
+        started_event (threading.Event): Optional event set once the sampler process is ticking.
+            Starting the interpreter of the sampler takes a second or more (longer under load),
+            so callers should wait for it before the baseline starts.
+    """
+    queries = {"cpu": lambda: cpu_query(pod_name_cpu_metrics), "energy": lambda: energy_query(targets),
+               "host_energy": lambda: HOST_ENERGY_QUERY}
+    if mode not in queries:
+        print(f"Invalid mode: {mode}")
+        return
+    if energy is None and mode in {"energy", "host_energy"}:
+        energy = EnergyAccumulator()
+
+    context = multiprocessing.get_context("spawn")
+    samples = SharedRingBuffer(SAMPLE_DTYPE, capacity)
+    ticks = SharedRingBuffer(TICK_DTYPE, 1 + int(capacity / 10))
+    sampler_stop_event = context.Event()
+    sampler_ready_event = context.Event()
+    shared_query = context.Array('c', QUERY_BUFFER_SIZE)
+    query = queries[mode]()
+    set_shared_query(shared_query, query)
+    sampler = context.Process(
+        target=run_sampler,
+        args=(samples, ticks, prometheus_url, mode, shared_query, pod_name_cpu_metrics, sampler_stop_event,
+              sampler_ready_event, period),
+        daemon=True,
+    )
+    sampler.start()
+    start_time = time.time()
+    try:
+        while not sampler_ready_event.wait(0.1) and sampler.is_alive() and not stop_event.is_set():
+            pass
+        start_time = time.time()  # First tick of the sampler
+        if started_event is not None:
+            started_event.set()
+        # Follow the targets: the sampler reads the query again on every tick
+        while not stop_event.wait(period):
+            current_query = queries[mode]()
+            if current_query != query and set_shared_query(shared_query, current_query):
+                query = current_query
+    finally:
+        stop_time = time.time()
+        sampler_stop_event.set()
+        sampler.join()
+
+        records, overwritten = samples.read()
+        tick_records, _ = ticks.read()
+        samples.close(unlink=True)
+        ticks.close(unlink=True)
+        if overwritten:
+            print(f"The sampler ring buffer was full, the first {overwritten} samples were overwritten")
+
+        metrics_over_time = {}
+        for timestamp, value, id in records.tolist():
+            entry = {'timestamp': timestamp, 'value': value}
+            if mode == "energy":
+                entry['cmdline'] = 'unknown'  # Same as fetch_energy_metrics
+            metrics_over_time.setdefault(id.decode(), []).append(entry)
+        with open(save_file_path, "w") as f:
+            json.dump(metrics_over_time, f)
+        print(f"Metrics saved to {save_file_path}")
+
+        scheduler = TickScheduler(period)
+        scheduler.scheduled = tick_records['scheduled'].tolist()
+        scheduler.jitter = tick_records['jitter'].tolist()
+        if scheduler.scheduled:
+            scheduler.skipped = round(scheduler.scheduled[-1] / period) + 1 - len(scheduler.scheduled)
+        save_tick_report(scheduler, save_file_path)
+
+        quality = SamplingQuality(period, start_time=start_time)
+        quality.stop(stop_time)
+        for scheduled, _, latency, num_samples, error in tick_records.tolist():
+            quality.observe_request(latency, num_samples, error, offset=scheduled)
+        quality.observe(metrics_over_time)
+        quality.save(quality_path(save_file_path), scheduler)
+
+        if energy is not None:
+            energy.add(metrics_over_time)
+            energy.save(energy_summary_path(save_file_path))
+            print(f"Energy summary saved to {energy_summary_path(save_file_path)}")
@@ -0,0 +1 @@
+../power-metrics-per-pod-app/prometheus_decode.py
\ No newline at end of file
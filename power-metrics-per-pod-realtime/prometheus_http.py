@@ -0,0 +1 @@
+../power-metrics-per-pod-app/prometheus_http.py
\ No newline at end of file
@@ -0,0 +1,214 @@
+import json
+import os
+import statistics
+import threading
+import time
+
+# Flags of a quality report, from best to worst
+QUALITY_FLAGS = ("ok", "degraded", "reject")
+
+
+class SamplingQuality:
+    """
+    Sampling quality of a collection, per series and per experiment.
+
+    The collectors report every request with observe_request() (latency, number of samples,
+    error) and every sample with observe(). For each series the timestamps are checked
+    against the polling period:
+    - a gap is an interval longer than 1.5 periods, and its missed samples are the ticks it spans.
+      A series is measured from its first to its last sample, so a pod created or deleted during
+      the run (or matched after a refresh of the targets) is not counted as missed. Only the
+      series present in the first (last) sample of the whole collection also count the ticks
+      between the start (stop) and that sample, so a collection whose first or last requests
+      failed is not reported as complete. How much of the run each series covers is reported
+      apart, as its coverage;
+    - a duplicate is a sample with the timestamp of the previous one (same Prometheus sample);
+    - a stale value is a sample with a new timestamp but the value of the previous one, i.e.
+      the exporter was not scraped again since. Stale values are not wrong data, but many of
+      them mean the polling is faster than the data changes: the effective period (span over
+      value changes) is reported as the polling rate the data actually supports.
+
+    The report ends with a flag for the analysis: "reject" when more than max_missed_fraction
+    of the expected samples or max_error_fraction of the requests are missing, "degraded" when
+    anything was missed, "ok" otherwise, and a weight (fraction of expected samples received)
+    to re-weight the runs that are kept.
+
+    Args:
+        period (float): Polling period of the collection, in seconds.
+        start_time (float): Unix time the collection started (default: now).
+        max_missed_fraction (float): Missed sample fraction above which the run is rejected.
+        max_error_fraction (float): Failed request fraction above which the run is rejected.
+    """
+    def __init__(self, period=1.0, start_time=None, max_missed_fraction=0.05, max_error_fraction=0.05):
+        self.period = period
+        self.start_time = time.time() if start_time is None else start_time
+        self.stop_time = None
+        self.max_missed_fraction = max_missed_fraction
+        self.max_error_fraction = max_error_fraction
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._requests = []  # [seconds since start, latency in seconds, samples, error]
+        self._series = {}    # id -> [samples, duplicates, stale, value changes, gaps, missed, max gap, first, last, last value]
+
+    def stop(self, timestamp=None):
+        """Record the Unix time the collection stopped (default: now). The report uses the time of the report otherwise."""
+        with self._lock:
+            self.stop_time = time.time() if timestamp is None else timestamp
+
+    def observe_request(self, latency, samples=0, error=False, offset=None):
+        """Record one request of the collector (offset: seconds since the start of the collection)."""
+        with self._lock:
+            offset = time.monotonic() - self._start if offset is None else offset
+            self._requests.append([offset, latency, samples, bool(error)])
+
+    def observe(self, metrics):
+        """Record samples in the format of the fetch_*_metrics functions ({id: [entries]})."""
+        with self._lock:
+            for id, data_points in metrics.items():
+                for entry in data_points:
+                    self._observe_sample(id, entry['timestamp'], entry['value'])
+
+    def _observe_sample(self, id, timestamp, value):
+        series = self._series.get(id)
+        if series is None:
+            self._series[id] = [1, 0, 0, 0, 0, 0, 0.0, timestamp, timestamp, value]
+            return
+        series[0] += 1
+        interval = timestamp - series[8]
+        if interval <= 0:
+            series[1] += 1  # Same Prometheus sample as the last tick, or out of order
+            return
+        if value == series[9]:
+            series[2] += 1
+        else:
+            series[3] += 1
+        if interval > 1.5 * self.period:
+            series[4] += 1
+            series[5] += round(interval / self.period) - 1
+        series[6] = max(series[6], interval)
+        series[8] = timestamp
+        series[9] = value
+
+    def report(self, ticks=None):
+        """
+        Args:
+            ticks (TickScheduler): Optional scheduler of the collection, whose jitter summary is included.
+
+        Returns:
+            dict: Experiment totals, 'flag' and 'weight', request latencies, and the quality of every
+            series under 'series'.
+        """
+        with self._lock:
+            start_time = self.start_time
+            stop_time = time.time() if self.stop_time is None else self.stop_time
+            # Ticks of the whole collection before its first and after its last sample (failed requests)
+            collection_first = min((series[7] for series in self._series.values()), default=start_time)
+            collection_last = max((series[8] for series in self._series.values()), default=stop_time)
+            leading = max(0, round((collection_first - start_time) / self.period))
+            trailing = stop_time - collection_last  # Like a gap up to the tick that would have followed the stop
+            trailing = round(trailing / self.period) - 1 if trailing > 1.5 * self.period else 0
+            run_seconds = stop_time - start_time
+            series_report = {}
+            for id, (samples, duplicates, stale, changes, gaps, missed, max_gap, first, last, _) in self._series.items():
+                received = samples - duplicates
+                span = last - first
+                if leading and first - collection_first < self.period / 2:
+                    gaps, missed, max_gap = gaps + 1, missed + leading, max(max_gap, first - start_time)
+                if trailing and collection_last - last < self.period / 2:
+                    gaps, missed, max_gap = gaps + 1, missed + trailing, max(max_gap, stop_time - last)
+                series_report[id] = {
+                    'samples': samples,
+                    'expected_samples': received + missed,
+                    'missed_samples': missed,
+                    'gaps': gaps,
+                    'max_gap_seconds': max_gap,
+                    'duplicates': duplicates,
+                    'stale_values': stale,
+                    'effective_period_seconds': span / changes if changes else None,
+                    'first_timestamp': first,
+                    'last_timestamp': last,
+                    # Share of the run between the first and the last sample (pods created or deleted during the run)
+                    'coverage': min(1.0, (span + self.period) / run_seconds) if run_seconds > 0 else 1.0,
+                }
+            requests = list(self._requests)
+
+        expected = sum(series['expected_samples'] for series in series_report.values())
+        missed = sum(series['missed_samples'] for series in series_report.values())
+        received = expected - missed
+        stale = sum(series['stale_values'] for series in series_report.values())
+        errors = sum(1 for request in requests if request[3])
+        latencies = sorted(request[1] for request in requests if request[1] is not None)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else None
+        effective_periods = [series['effective_period_seconds'] for series in series_report.values()
+                             if series['effective_period_seconds'] is not None]
+
+        missed_fraction = missed / expected if expected else 0.0
+        error_fraction = errors / len(requests) if requests else 0.0
+        if not series_report or missed_fraction > self.max_missed_fraction or error_fraction > self.max_error_fraction:
+            flag = "reject"
+        elif missed or errors or (ticks is not None and ticks.skipped):
+            flag = "degraded"
+        else:
+            flag = "ok"
+
+        report = {
+            'flag': flag,
+            'weight': 1.0 - missed_fraction if series_report else 0.0,
+            'period': self.period,
+            'start_time': start_time,
+            'stop_time': stop_time,
+            'series_count': len(series_report),
+            'expected_samples': expected,
+            'missed_samples': missed,
+            'missed_fraction': missed_fraction,
+            'stale_fraction': stale / received if received else 0.0,
+            'duplicates': sum(series['duplicates'] for series in series_report.values()),
+            'full_coverage_series': sum(1 for series in series_report.values() if series['coverage'] >= 1.0 - 1.5 * self.period / run_seconds),
+            'effective_period_seconds': statistics.median(effective_periods) if effective_periods else None,
+            'requests': len(requests),
+            'request_errors': errors,
+            'empty_responses': sum(1 for request in requests if not request[3] and not request[2]),
+            'latency_p50_seconds': percentile(0.5),
+            'latency_p95_seconds': percentile(0.95),
+            'latency_max_seconds': latencies[-1] if latencies else None,
+        }
+        if ticks is not None:
+            report['ticks'] = ticks.summary()
+        report['request_log'] = requests  # [seconds since start, latency, samples, error], to line up with the traffic
+        report['series'] = series_report
+        return report
+
+    def save(self, path, ticks=None):
+        report = self.report(ticks)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Sampling quality: {report['flag']} (weight {report['weight']:.3f}, {report['missed_samples']} missed samples, "
+              f"{report['request_errors']} failed requests, stale fraction {report['stale_fraction']:.2f}). "
+              f"Report saved to {path}")
+        return report
+
+
+def quality_path(save_file_path):
+    """Quality report written next to the raw data (metrics_energy.json -> metrics_energy_quality.json)."""
+    return os.path.splitext(save_file_path)[0] + "_quality.json"
+
+
+def load_quality(save_file_path, accept=("ok", "degraded")):
+    """
+    Flag and weight of a collection for the analysis.
+
+    Args:
+        save_file_path (str): Metrics file of the collection (its quality report is read).
+        accept (tuple): Flags of the runs to keep.
+
+    Returns:
+        tuple: (flag, weight), the weight being 0 for a run whose flag is not accepted. Runs
+        collected before the quality reports existed get ("unknown", 1.0).
+    """
+    try:
+        with open(quality_path(save_file_path), "r") as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        return "unknown", 1.0
+    return report['flag'], report['weight'] if report['flag'] in accept else 0.0
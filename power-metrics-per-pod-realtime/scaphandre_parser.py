@@ -0,0 +1 @@
+../power-metrics-per-pod-app/scaphandre_parser.py
\ No newline at end of file
@@ -0,0 +1,149 @@
+import json
+import sys
+from array import array
+
+import numpy as np
+import pandas as pd
+
+
+class Series:
+    """Samples of one id: timestamps and values in array('d'), and one label code per sample (array('I'))."""
+    __slots__ = ("timestamps", "values", "label_codes")
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.values = array('d')
+        self.label_codes = array('I')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+class SeriesStore:
+    """
+    Columnar container of collected metrics, 20 bytes per sample instead of one dict per sample.
+
+    It holds the same data as the {id: [{'timestamp', 'value', 'cmdline'}]} dicts of the
+    collectors: timestamps and values are kept in array('d') buffers per id, and the cmdline
+    string is interned once in a label table and referenced by its index. Samples without a
+    cmdline (host energy, CPU) use the code of the empty label. The collectors keep their
+    samples in a store during the run and write their JSON output with save_json().
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.label_table = [""]
+        self._label_codes = {"": 0}
+
+    def _label_code(self, label):
+        code = self._label_codes.get(label)
+        if code is None:
+            code = self._label_codes[label] = len(self.label_table)
+            self.label_table.append(sys.intern(label))
+        return code
+
+    def append(self, metrics):
+        """Append metrics in the format of the fetch_*_metrics functions ({id: [entries]})."""
+        for id, data_points in metrics.items():
+            series = self.series.get(id)
+            if series is None:
+                series = self.series[sys.intern(id)] = Series()
+            for entry in data_points:
+                series.timestamps.append(entry['timestamp'])
+                series.values.append(entry['value'])
+                series.label_codes.append(self._label_code(entry.get('cmdline', "")))
+
+    def __len__(self):
+        return sum(len(series) for series in self.series.values())
+
+    def to_dict(self):
+        """Rebuild the {id: [entries]} dict used by plot_metrics and the notebooks."""
+        metrics_over_time = {}
+        for id, series in self.series.items():
+            data_points = []
+            for timestamp, value, code in zip(series.timestamps, series.values, series.label_codes):
+                entry = {'timestamp': timestamp, 'value': value}
+                if code:
+                    entry['cmdline'] = self.label_table[code]
+                data_points.append(entry)
+            metrics_over_time[id] = data_points
+        return metrics_over_time
+
+    def save_json(self, path):
+        """
+        Write the store in the {id: [entries]} JSON format of the collectors (the content of
+        json.dump(self.to_dict(), f)), one sample at a time from the columns.
+        """
+        labels = [json.dumps(label) for label in self.label_table]
+        with open(path, "w") as f:
+            f.write("{")
+            for i, (id, series) in enumerate(self.series.items()):
+                f.write(f"{', ' if i else ''}{json.dumps(id)}: [")
+                for j, (timestamp, value, code) in enumerate(zip(series.timestamps, series.values, series.label_codes)):
+                    cmdline = f', "cmdline": {labels[code]}' if code else ""
+                    f.write(f'{", " if j else ""}{{"timestamp": {json.dumps(timestamp)}, "value": {json.dumps(value)}{cmdline}}}')
+                f.write("]")
+            f.write("}")
+
+    def to_dataframe(self):
+        """Long-format DataFrame with id, timestamp, value and cmdline columns (id and cmdline categorical)."""
+        ids = list(self.series)
+        lengths = [len(self.series[id]) for id in ids]
+        codes = np.concatenate([np.frombuffer(self.series[id].label_codes, dtype=np.uint32) for id in ids]) if ids else np.array([], dtype=np.uint32)
+        return pd.DataFrame({
+            'id': pd.Categorical.from_codes(np.repeat(np.arange(len(ids)), lengths), categories=ids),
+            'timestamp': np.concatenate([np.frombuffer(self.series[id].timestamps) for id in ids]) if ids else np.array([]),
+            'value': np.concatenate([np.frombuffer(self.series[id].values) for id in ids]) if ids else np.array([]),
+            'cmdline': pd.Categorical.from_codes(codes, categories=self.label_table),
+        })
+
+    def save_npz(self, path):
+        """Write the store to a compressed .npz file (one flat array per column plus per-id offsets)."""
+        ids = list(self.series)
+        offsets = np.cumsum([0] + [len(self.series[id]) for id in ids])
+        def column(name, dtype):
+            parts = [np.frombuffer(getattr(self.series[id], name), dtype=dtype) for id in ids]
+            return np.concatenate(parts) if parts else np.array([], dtype=dtype)
+        np.savez_compressed(
+            path,
+            ids=np.array(ids, dtype=str),
+            offsets=offsets,
+            timestamps=column('timestamps', np.float64),
+            values=column('values', np.float64),
+            label_codes=column('label_codes', np.uint32),
+            label_table=np.array(self.label_table, dtype=str),
+        )
+
+    def save_parquet(self, path):
+        """Write the store as a Parquet file (needs pyarrow or fastparquet)."""
+        self.to_dataframe().to_parquet(path, index=False)
+
+    @classmethod
+    def load_npz(cls, path):
+        store = cls()
+        with np.load(path) as data:
+            store.label_table = [str(label) for label in data['label_table']]
+            store._label_codes = {label: code for code, label in enumerate(store.label_table)}
+            offsets = data['offsets']
+            for i, id in enumerate(data['ids']):
+                series = store.series[str(id)] = Series()
+                start, end = offsets[i], offsets[i + 1]
+                series.timestamps.frombytes(data['timestamps'][start:end].tobytes())
+                series.values.frombytes(data['values'][start:end].tobytes())
+                series.label_codes.frombytes(data['label_codes'][start:end].astype(np.uint32).tobytes())
+        return store
+
+    @classmethod
+    def from_file(cls, path):
+        """Build a store from a collector output: a JSON file, or an NDJSON file read one line at a time."""
+        store = cls()
+        with open(path, "r") as f:
+            if not path.endswith(".ndjson"):
+                store.append(json.load(f))
+                return store
+            for line in f:
+                try:
+                    store.append(json.loads(line))
+                except ValueError:
+                    print(f"Skipping incomplete line in {path}")
+        return store
@@ -6,11 +6,15 @@ import time
 # Add the parent directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from utils import (collect_metrics_with_stop_event, load_uid_pod_map, plot_metrics, 
+from utils import (collect_all_metrics_with_stop_event, mode_path, load_uid_pod_map, plot_metrics, 
                    run_iperf_tcp_number_packets, get_pod_info, get_all_pod_names, 
-                   create_uid_pod_mapping, check_ping, download_tcpdump)
+                   create_uid_pod_mapping, check_ping, download_tcpdump, run_in_pod)
+from cluster import get_cluster
 import logging
 from threading import Event
+from energy_summary import EnergyAccumulator
+from experiment_targets import ExperimentTargets
+from traffic_engine import TrafficMonitor
 
 logging.basicConfig(level=logging.INFO)
 
@@ -107,22 +111,16 @@ def deploy_bp3_with_second_du_and_ue(cpu_mi=None, memory_mi='2Gi', tcpdump=False
 # Install iperf on the oai-upf pod
 def install_iperf_on_upf():
     print("Installing iperf on oai-upf...")
-    result = subprocess.run(
-        ["kubectl", "get", "pods", "-n", CORE_NAMESPACE],
-        capture_output=True,
-        text=True,
-        check=True
-    )
-    for line in result.stdout.splitlines():
-        if "oai-upf" in line:
-            upf_pod = line.split()[0]
+    for pod in get_cluster().list_pods(CORE_NAMESPACE):
+        if "oai-upf" in pod["metadata"]["name"]:
+            upf_pod = pod["metadata"]["name"]
             break
     else:
         raise Exception("oai-upf pod not found.")
 
-    run_command(["kubectl", "exec", upf_pod, "-n", CORE_NAMESPACE, "--", "apt", "update"])
-    run_command(["kubectl", "exec", upf_pod, "-n", CORE_NAMESPACE, "--", "apt", "install", "-y", "iputils-ping"])
-    run_command(["kubectl", "exec", upf_pod, "-n", CORE_NAMESPACE, "--", "apt", "install", "-y", "iperf"])
+    run_in_pod(upf_pod, CORE_NAMESPACE, ["apt", "update"])
+    run_in_pod(upf_pod, CORE_NAMESPACE, ["apt", "install", "-y", "iputils-ping"])
+    run_in_pod(upf_pod, CORE_NAMESPACE, ["apt", "install", "-y", "iperf"])
 
 def uninstall_all_releases(namespace):
     try:
@@ -147,8 +145,7 @@ def apply_tc_rule_to_cu(max_rate=None):
         cu_pod, _ = get_pod_info("oai-cu")
         
         # Apply the tc command
-        run_command([
-            "kubectl", "exec", cu_pod, "-n", RAN_NAMESPACE, "--", 
+        run_in_pod(cu_pod, RAN_NAMESPACE, [
             "tc", "qdisc", "add", "dev", "eth0", "root", "tbf", 
             "rate", f"{max_rate}mbit", "burst", "50kbit", "latency", "100ms"
         ])
@@ -210,17 +207,24 @@ def run_experiments_with_multiple_ues(index):
             experiment_dir = f"experiment_packet_energy_3UE_1CU_iperf-n_{index}/{total_mb}_{packet_length}"
             os.makedirs(experiment_dir, exist_ok=True)
 
+            # Pods of the experiment, listed again while it runs: the energy query only covers them
+            targets = ExperimentTargets(namespaces=[CORE_NAMESPACE, RAN_NAMESPACE]).start()
+
             try:
-                SAVE_FILE_PATH_DATA_ENERGY = os.path.join(experiment_dir, "metrics_energy.json")
+                SAVE_FILE_PATH_DATA = os.path.join(experiment_dir, "metrics.csv")  # Energy and host energy, aligned on one clock
+                SAVE_FILE_PATH_DATA_ENERGY = mode_path(SAVE_FILE_PATH_DATA, "energy")  # metrics_energy.json
                 SAVE_FILE_PATH_PLOT_ENERGY = os.path.join(experiment_dir, "metrics_energy.png")
                 UID_POD_MAPPING_PATH = os.path.join(experiment_dir, "uid_pod_mapping.csv")
                 POD_DATA = os.path.join(experiment_dir, "all_pod_metrics.json")
 
                 # Start metrics collection
                 stop_event = Event()
+                energy = EnergyAccumulator(phase="baseline")  # Running energy totals, per phase
+                traffic = TrafficMonitor()  # Live iperf throughput, per flow, added to the collected rows
                 metrics_energy_thread = StoppableThread(
-                    target=collect_metrics_with_stop_event,
-                    args=(SAVE_FILE_PATH_DATA_ENERGY, PROMETHEUS_URL, "energy", None, stop_event),
+                    target=collect_all_metrics_with_stop_event,
+                    args=(SAVE_FILE_PATH_DATA, PROMETHEUS_URL, stop_event),
+                    kwargs={'modes': ("energy", "host_energy"), 'energy': energy, 'targets': targets, 'traffic': traffic},
                     stop_event=stop_event
                 )
 
@@ -228,27 +232,33 @@ def run_experiments_with_multiple_ues(index):
                 iperf_thread_ue1 = threading.Thread(
                     target=run_iperf_tcp_number_packets,
                     args=(oai_nr_ue1_pod, RAN_NAMESPACE, "server", experiment_dir, "12.1.1.100", ue1_mb, packet_length),
+                    kwargs={'monitor': traffic},
                 )
                 iperf_thread_ue2 = threading.Thread(
                     target=run_iperf_tcp_number_packets,
                     args=(oai_nr_ue2_pod, RAN_NAMESPACE, "server", experiment_dir, "12.1.1.101", ue2_mb, packet_length),
+                    kwargs={'monitor': traffic},
                 )
                 iperf_thread_ue3 = threading.Thread(
                     target=run_iperf_tcp_number_packets,
                     args=(oai_nr_ue3_pod, RAN_NAMESPACE, "server", experiment_dir, "12.1.1.102", ue3_mb, packet_length),
+                    kwargs={'monitor': traffic},
                 )
 
                 iperf_thread_upf = threading.Thread(
                     target=run_iperf_tcp_number_packets,
                     args=(oai_upf_pod, CORE_NAMESPACE, "client", experiment_dir, "12.1.1.100", ue1_mb, packet_length),
+                    kwargs={'monitor': traffic},
                 )
                 iperf_thread_upf_ue2 = threading.Thread(
                     target=run_iperf_tcp_number_packets,
                     args=(oai_upf_pod, CORE_NAMESPACE, "client", experiment_dir, "12.1.1.101", ue2_mb, packet_length),
+                    kwargs={'monitor': traffic},
                 )
                 iperf_thread_upf_ue3 = threading.Thread(
                     target=run_iperf_tcp_number_packets,
                     args=(oai_upf_pod, CORE_NAMESPACE, "client", experiment_dir, "12.1.1.102", ue3_mb, packet_length),
+                    kwargs={'monitor': traffic},
                 )
 
                 print("Start baseline collection")
@@ -259,6 +269,7 @@ def run_experiments_with_multiple_ues(index):
                 iperf_thread_ue2.start()
                 iperf_thread_ue3.start()
                 time.sleep(5)
+                energy.mark_phase("traffic")  # The clients start sending now
                 iperf_thread_upf.start()
                 iperf_thread_upf_ue2.start()
                 iperf_thread_upf_ue3.start()
@@ -271,14 +282,18 @@ def run_experiments_with_multiple_ues(index):
                 iperf_thread_upf_ue3.join()
                 iperf_thread_upf.join()
                 
+                energy.mark_phase("cooldown")  # All transfers are done
                 print("Sleep to get last 10 seconds metrics")
                 time.sleep(15)
                 stop_event.set()
                 metrics_energy_thread.join()
+                targets.stop()
+                traffic.save(os.path.join(experiment_dir, "traffic_summary.json"))
 
             except Exception as e:
                 print(f"Experiment failed: {e}")
                 stop_event.set()  # Ensure all threads are signaled to stop
+                targets.stop()
 
             # Map pod metrics and plot results
             get_all_pod_names(POD_DATA)
@@ -2,11 +2,15 @@ import os
 import sys
 import argparse
 import time
-from utils import collect_metrics_with_stop_event, run_iperf_tcp_number_packets
+from utils import collect_all_metrics_with_stop_event, mode_path, run_iperf_tcp_number_packets
+from process_sampler import collect_metrics_in_process
+from energy_summary import EnergyAccumulator
+from experiment_targets import ExperimentTargets
+from traffic_engine import TrafficMonitor
 from stoppable_thread import StoppableThread
 from threading import Event, Thread
 
-def run(data_volume_list, num_cus, ue_pod_names, upf_pod_names, prometheus_url, core_namespace, ran_namespace, packet_length, duration_baseline):
+def run(data_volume_list, num_cus, ue_pod_names, upf_pod_names, prometheus_url, core_namespace, ran_namespace, packet_length, duration_baseline, sampler="thread"):
     
     per_ue_data = [vol // num_cus for vol in data_volume_list]
     
@@ -15,7 +19,16 @@ def run(data_volume_list, num_cus, ue_pod_names, upf_pod_names, prometheus_url,
         os.makedirs(experiment_dir, exist_ok=True)
 
         stop_event = Event()
-        metrics_thread = StoppableThread(target=collect_metrics_with_stop_event, args=(os.path.join(experiment_dir, "metrics.json"), prometheus_url, "energy", None, stop_event), stop_event=stop_event)
+        energy = EnergyAccumulator(phase="baseline")  # Running energy totals, per phase
+        traffic = TrafficMonitor()  # Live iperf throughput, per flow
+        targets = ExperimentTargets(namespaces=[core_namespace, ran_namespace]).start()  # Energy of the experiment pods only
+        sampler_started_event = Event()
+        metrics_path = os.path.join(experiment_dir, "metrics.csv")  # Energy and host energy, aligned on one clock
+        if sampler == "process":
+            # Sampler in its own process, away from the GIL of the iperf threads (energy only, in metrics_energy.json)
+            metrics_thread = StoppableThread(target=collect_metrics_in_process, args=(mode_path(metrics_path, "energy"), prometheus_url, "energy", None, stop_event), kwargs={'energy': energy, 'targets': targets, 'started_event': sampler_started_event}, stop_event=stop_event)
+        else:
+            metrics_thread = StoppableThread(target=collect_all_metrics_with_stop_event, args=(metrics_path, prometheus_url, stop_event), kwargs={'modes': ("energy", "host_energy"), 'energy': energy, 'targets': targets, 'traffic': traffic}, stop_event=stop_event)
 
         # Start iperf servers first
         server_threads = []
@@ -24,11 +37,13 @@ def run(data_volume_list, num_cus, ue_pod_names, upf_pod_names, prometheus_url,
         upf_pod_name=upf_pod_names[0][0] # although you could pass a list of upfs in the main args, we consider only one upf in our experiments
         for i,ue_pod_name in enumerate(ue_pod_names):
             ue_pod_name=ue_pod_name[0]
-            server_threads.append(Thread(target=run_iperf_tcp_number_packets, args=(ue_pod_name, ran_namespace, "server", experiment_dir, f"12.1.1.10{i}", data, packet_length)))
-            client_threads.append(Thread(target=run_iperf_tcp_number_packets, args=(upf_pod_name, core_namespace, "client", experiment_dir, f"12.1.1.10{i}", data, packet_length)))
+            server_threads.append(Thread(target=run_iperf_tcp_number_packets, args=(ue_pod_name, ran_namespace, "server", experiment_dir, f"12.1.1.10{i}", data, packet_length), kwargs={'monitor': traffic}))
+            client_threads.append(Thread(target=run_iperf_tcp_number_packets, args=(upf_pod_name, core_namespace, "client", experiment_dir, f"12.1.1.10{i}", data, packet_length), kwargs={'monitor': traffic}))
 
         # Start the metrics collection thread
         metrics_thread.start()
+        if sampler == "process":
+            sampler_started_event.wait()  # The sampler interpreter takes a few seconds to start
 
         # Start server threads first
         for t in server_threads:
@@ -37,6 +52,7 @@ def run(data_volume_list, num_cus, ue_pod_names, upf_pod_names, prometheus_url,
         time.sleep(duration_baseline)  # Ensure servers are ready before starting clients
 
         # Start client threads
+        energy.mark_phase("traffic")
         for t in client_threads:
             t.start()
 
@@ -47,9 +63,12 @@ def run(data_volume_list, num_cus, ue_pod_names, upf_pod_names, prometheus_url,
         for t in client_threads:
             t.join()
 
+        energy.mark_phase("cooldown")  # All transfers are done
         time.sleep(15)
         stop_event.set()
         metrics_thread.join()
+        targets.stop()
+        traffic.save(os.path.join(experiment_dir, "traffic_summary.json"))
 
 # Define a custom argument type for a list of strings
 def list_of_strings(arg):
@@ -67,6 +86,7 @@ if __name__ == "__main__":
     parser.add_argument("--ran-namespace", type=str, help="RAN namespace")
     parser.add_argument("--packet-length", type=int, help="Packet length for iperf")
     parser.add_argument("--duration-baseline", type=int, help="Duration for the baseline in seconds")
+    parser.add_argument("--sampler", type=str, choices=["thread", "process"], default="thread", help="Run the metrics sampler in a thread or in its own process")
 
     args = parser.parse_args()
     if not args.data_volumes or not args.num_cus or not args.ue_pod_names or not args.upf_pod_names:
@@ -89,7 +109,8 @@ if __name__ == "__main__":
         args.core_namespace, 
         args.ran_namespace, 
         args.packet_length, 
-        args.duration_baseline
+        args.duration_baseline,
+        args.sampler
     )
 
     print("All experiments are done.")
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+from threading import Event
+
+
+class TickScheduler:
+    """
+    Drift-free periodic ticks for the metric collectors.
+
+    Tick n is scheduled at start + n * period on the monotonic clock, so the time spent
+    fetching does not push the following ticks back. Ticks that are already late by a whole
+    period are skipped instead of being run back to back. For every tick the lateness
+    (actual - scheduled time) is recorded as jitter.
+
+    Args:
+        period (float): Seconds between two ticks.
+        stop_event (threading.Event): Optional event that ends the ticks.
+        duration (float): Optional number of seconds after which the ticks end.
+    """
+    def __init__(self, period=1.0, stop_event=None, duration=None):
+        self.period = period
+        self.stop_event = stop_event or Event()
+        self.duration = duration
+        self.start = None
+        self.tick = 0
+        self.skipped = 0
+        self.scheduled = []  # Scheduled time of each tick, in seconds since the first tick
+        self.jitter = []     # Lateness of each tick, in seconds
+
+    def wait(self):
+        """Wait for the next tick. Returns False when the stop event is set or the duration is over."""
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        else:
+            self.tick += 1
+            late_ticks = int((now - self.start) / self.period) - self.tick
+            if late_ticks > 0:
+                self.skipped += late_ticks
+                self.tick += late_ticks
+        deadline = self.start + self.tick * self.period
+        if self.duration is not None and deadline - self.start >= self.duration:
+            return False
+        if self.stop_event.wait(max(0.0, deadline - now)):
+            return False
+        self.scheduled.append(deadline - self.start)
+        self.jitter.append(time.monotonic() - deadline)
+        return True
+
+    def summary(self):
+        jitter = sorted(self.jitter)
+        def percentile(p):
+            return jitter[min(len(jitter) - 1, int(len(jitter) * p))] if jitter else 0.0
+        return {
+            'period': self.period,
+            'ticks': len(self.jitter),
+            'skipped_ticks': self.skipped,
+            'jitter_p50_seconds': percentile(0.5),
+            'jitter_p99_seconds': percentile(0.99),
+            'jitter_max_seconds': jitter[-1] if jitter else 0.0,
+        }
+
+    def save(self, path):
+        """Save the summary and the scheduled time and jitter of every tick to a JSON file."""
+        with open(path, "w") as f:
+            json.dump({**self.summary(), 'scheduled': self.scheduled, 'jitter': self.jitter}, f)
+
+
+def save_tick_report(ticks, save_file_path):
+    """Save the tick jitter of a collection next to its metrics file (metrics_energy.json -> metrics_energy_ticks.json)."""
+    report_path = os.path.splitext(save_file_path)[0] + "_ticks.json"
+    ticks.save(report_path)
+    summary = ticks.summary()
+    print(f"{summary['ticks']} ticks, {summary['skipped_ticks']} skipped, jitter p50 {summary['jitter_p50_seconds'] * 1000:.1f} ms, "
+          f"p99 {summary['jitter_p99_seconds'] * 1000:.1f} ms. Tick report saved to {report_path}")
@@ -0,0 +1,243 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+from cluster import CLUSTER_ERRORS, get_cluster
+
+# Streaming iperf traffic engine.
+#
+# run_iperf_stream() runs iperf in a pod through get_cluster().exec_lines() and handles the
+# `--reportstyle C` output line by line as it arrives: every line is appended to the usual
+# CSV log (same header and content as before), parsed into an IperfInterval, and published
+# to an optional TrafficMonitor, from which the collectors read the live throughput of
+# every flow. A stop event ends a session early (e.g. once enough data was transferred).
+# The stderr of iperf goes to a .err file next to the CSV log, so the log stays parseable.
+
+IPERF_CSV_HEADER = "Timestamp,Source_IP,Source_Port,Destination_IP,Destination_Port,Protocol,Interval,Transfer,Bitrate,Jitter,Lost_Packets,Lost_Packets_Percent,Unknown1,Unknown2"
+
+# Seconds between two iperf reports (-i)
+REPORT_INTERVAL = 1
+
+IperfInterval = namedtuple("IperfInterval", [
+    "timestamp",        # iperf timestamp, as printed (YYYYMMDDHHMMSS)
+    "received_at",      # Unix time the line was read
+    "source_ip", "source_port", "destination_ip", "destination_port",
+    "transfer_id",      # iperf transfer ID (the "Protocol" column of the CSV header)
+    "start", "end",     # Interval, in seconds since the start of the transfer
+    "transfer_bytes", "bitrate_bps",
+    "jitter_ms", "lost_datagrams", "total_datagrams", "lost_percent", "out_of_order",  # UDP server reports only
+    "is_summary",       # Report of the whole transfer, printed at the end (set by run_iperf_stream)
+])
+
+
+def parse_report_line(line, received_at=None):
+    """
+    Parse one `--reportstyle C` line of iperf 2.
+
+    A line alone does not tell an interval from the summary of a short transfer (both start at
+    0.0), so is_summary is False here and run_iperf_stream sets it from the previous lines.
+
+    Returns:
+        IperfInterval: The parsed report, or None for lines that are not reports (warnings, errors).
+    """
+    fields = line.strip().split(',')
+    if len(fields) < 9:
+        return None
+    try:
+        start, end = (float(value) for value in fields[6].split('-'))
+        udp = [float(fields[9]), int(fields[10]), int(fields[11]), float(fields[12]), int(fields[13])] \
+            if len(fields) >= 14 else [None] * 5
+        return IperfInterval(
+            fields[0], time.time() if received_at is None else received_at,
+            fields[1], int(fields[2]), fields[3], int(fields[4]), int(fields[5]),
+            start, end, int(fields[7]), int(fields[8]), *udp, False,
+        )
+    except ValueError:
+        return None
+
+
+class TrafficMonitor:
+    """
+    Live per-flow throughput of the iperf sessions of an experiment.
+
+    Every session publishes its interval reports under its flow name; the summary report
+    printed at the end of a transfer is kept apart so the totals are not counted twice.
+    A flow whose last report is older than `max_age` seconds, or that finished, has a
+    throughput of 0.
+
+    Args:
+        max_age (float): Seconds after which the last report of a flow is considered stale.
+    """
+    def __init__(self, max_age=3 * REPORT_INTERVAL):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._flows = {}  # flow -> {'bytes', 'bitrate_bps', 'intervals', 'updated', 'finished', 'summary'}
+
+    def start(self, flow):
+        with self._lock:
+            self._flows[flow] = {'bytes': 0, 'bitrate_bps': 0, 'intervals': 0, 'updated': time.monotonic(),
+                                 'finished': False, 'summary': None}
+
+    def add(self, flow, interval):
+        with self._lock:
+            stats = self._flows[flow]
+            if interval.is_summary:
+                stats['summary'] = {'transfer_bytes': interval.transfer_bytes, 'bitrate_bps': interval.bitrate_bps,
+                                    'seconds': interval.end - interval.start}
+                return
+            stats['bytes'] += interval.transfer_bytes
+            stats['bitrate_bps'] = interval.bitrate_bps
+            stats['intervals'] += 1
+            stats['updated'] = time.monotonic()
+
+    def finish(self, flow):
+        with self._lock:
+            if flow in self._flows:
+                self._flows[flow]['finished'] = True
+
+    def throughput(self):
+        """
+        Returns:
+            dict: flow -> bits per second of its last interval (0 when stale or finished).
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {flow: stats['bitrate_bps'] if not stats['finished'] and now - stats['updated'] <= self.max_age else 0
+                    for flow, stats in self._flows.items()}
+
+    def transferred_bytes(self):
+        """
+        Returns:
+            dict: flow -> bytes reported so far.
+        """
+        with self._lock:
+            return {flow: stats['bytes'] for flow, stats in self._flows.items()}
+
+    def summary(self):
+        with self._lock:
+            return {flow: {key: value for key, value in stats.items() if key != 'updated'}
+                    for flow, stats in self._flows.items()}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=1)
+
+
+def iperf_command(mode, ip_address=None, mb=None, packet_length=None, duration=None, protocol="tcp", require_duration=False):
+    """
+    iperf 2 command of a session. With a duration the client sends at `mb` Mbit/s for that many
+    seconds (-b/-t), otherwise it sends `mb` MBytes (-n) and the server handles one client (-P 1).
+    With require_duration, a client without a duration is an error instead of a -n session.
+    """
+    udp = ['-u'] if protocol == "udp" else []
+    if mode == 'client':
+        if require_duration and not all([ip_address, mb, duration, packet_length]):
+            raise ValueError("Client mode requires ip_address, value, duration, and packet_length parameters.")
+        if not all([ip_address, mb, packet_length]) or (protocol == "udp" and not duration):
+            raise ValueError("Client mode requires ip_address, mb and packet_length parameters (and duration for UDP).")
+        volume = ['-b', f"{mb}M", '-t', str(duration)] if duration else ['-n', f"{mb}M"]
+        return ['iperf', '-c', ip_address, *udp, '-i', str(REPORT_INTERVAL), *volume,
+                '-l', str(packet_length), '--reportstyle', 'C']
+    if mode == 'server':
+        limit = ['-t', str(duration)] if duration else ['-P', '1']
+        return ['iperf', '-s', *udp, '-i', str(REPORT_INTERVAL), *limit, '--reportstyle', 'C']
+    raise ValueError("Mode must be either 'client' or 'server'.")
+
+
+def iperf_error_log_file(log_file):
+    """stderr of a session, next to its CSV log (log_iperf_client_<...>.csv -> log_iperf_client_<...>.err)."""
+    return os.path.splitext(log_file)[0] + ".err"
+
+
+def iperf_log_file(log_dir, pod_name, mode, ip_address=None, mb=None, packet_length=None, duration=None):
+    """CSV log of a session, named like the logs of the previous run_iperf* functions."""
+    mode_suffix = 'client' if mode == 'client' else 'server'
+    log_file = f"{log_dir}/log_iperf_{mode_suffix}_{pod_name}"
+    if duration is not None and ip_address and mb:
+        log_file += f"_{ip_address}_{mb}_{duration}_{packet_length}"
+    elif duration is None and ip_address and mb and packet_length:
+        log_file += f"_{ip_address}_{mb}_{packet_length}"
+    return log_file + ".csv"
+
+
+def run_iperf_stream(pod_name, namespace, mode, log_dir, ip_address=None, mb=None, packet_length=None, duration=None,
+                     protocol="tcp", monitor=None, stop_event=None, timeout=None, stderr_file=False, error_file=False,
+                     require_duration=False):
+    """
+    Run an iperf session in a pod and handle its reports as they are printed.
+
+    Args:
+        pod_name (str): Pod running iperf.
+        namespace (str): Namespace of the pod.
+        mode (str): 'client' or 'server'.
+        log_dir (str): Directory of the CSV log.
+        ip_address (str): Server address (client), also part of the flow name.
+        mb (int): Mbit/s with a duration, MBytes to send otherwise.
+        packet_length (int): Length of the buffers written by the client (-l).
+        duration (int): Seconds of traffic, None to send `mb` MBytes instead.
+        protocol (str): 'tcp' or 'udp'.
+        monitor (TrafficMonitor): Optional live throughput registry the reports are published to.
+        stop_event (threading.Event): Optional event that ends the session early.
+        timeout (float): Optional number of seconds after which iperf is stopped and the session fails.
+        stderr_file (bool): Write the stderr of iperf to a .err file next to the CSV log (discarded
+            otherwise), see iperf_error_log_file.
+        error_file (bool): Also write errors to log_iperf_<mode>_<pod>_ERROR.txt.
+        require_duration (bool): Fail a client session without a duration (see iperf_command).
+
+    Returns:
+        list: The IperfInterval reports of the session.
+    """
+    log_file = iperf_log_file(log_dir, pod_name, mode, ip_address, mb, packet_length, duration)
+    flow = f"{pod_name}_{mode}_{ip_address}" if ip_address else f"{pod_name}_{mode}"
+    intervals = []
+    transfer_ids = set()  # Transfers with a report already, whose next report from 0.0 is the summary
+
+    # Write the header to the log file
+    with open(log_file, 'w') as f:
+        f.write(IPERF_CSV_HEADER + '\n')
+
+    try:
+        command = iperf_command(mode, ip_address, mb, packet_length, duration, protocol, require_duration)
+        print(f"Running command in {namespace}/{pod_name}:", command)
+        if monitor is not None:
+            monitor.start(flow)
+
+        with open(log_file, 'a') as f, \
+                open(iperf_error_log_file(log_file) if stderr_file else os.devnull, 'w') as err:
+            lines = get_cluster().exec_lines(pod_name, namespace, command, stderr=err if stderr_file else subprocess.DEVNULL,
+                                             timeout=timeout, check=True)
+            try:
+                for line in lines:
+                    # Same content as the redirected stdout, flushed so the log is readable live
+                    f.write(line)
+                    f.flush()
+                    interval = parse_report_line(line)
+                    if interval is not None:
+                        if interval.start == 0.0 and interval.transfer_id in transfer_ids:
+                            interval = interval._replace(is_summary=True)
+                        transfer_ids.add(interval.transfer_id)
+                        intervals.append(interval)
+                        if monitor is not None:
+                            monitor.add(flow, interval)
+                    if stop_event is not None and stop_event.is_set():
+                        print(f"Stopping iperf in {namespace}/{pod_name} early")
+                        break
+            finally:
+                lines.close()
+
+        print(f"Log file saved to: {log_file}")
+
+    except Exception as e:
+        # CLUSTER_ERRORS (iperf failed or timed out, pod not reachable), or a bad mode/parameters
+        print(f"Error executing iperf: {e}" if isinstance(e, CLUSTER_ERRORS) else f"An unexpected error occurred: {e}")
+        if error_file:
+            mode_suffix = 'client' if mode == 'client' else 'server'
+            with open(f"{log_dir}/log_iperf_{mode_suffix}_{pod_name}_ERROR.txt", 'w') as f:
+                f.write(f'\n ERROR {type(e).__name__}: \n {e}\n')
+    finally:
+        if monitor is not None:
+            monitor.finish(flow)
+    return intervals
@@ -1,19 +1,32 @@
-import requests
 import json
 import matplotlib.pyplot as plt
 import pandas as pd
 import time
-import subprocess
 import json
 import matplotlib.ticker as ticker
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from metrics_fetch import (BREAKER_RESET_SECONDS, HOST_ENERGY_QUERY, MAX_RANGE_POINTS, cpu_query, energy_query,
+                           fetch_cpu_metrics, fetch_energy_metrics, fetch_energy_metrics_direct,
+                           fetch_host_energy_metrics, fetch_host_energy_metrics_direct, fetch_range_metrics,
+                           prometheus_client)
+from tick_scheduler import TickScheduler, save_tick_report
+from metrics_writer import MetricsWriter, load_aligned_metrics, load_metrics, ndjson_path
+from series_store import SeriesStore
+from energy_summary import EnergyAccumulator, energy_summary_path
+from sampling_quality import SamplingQuality, quality_path
+from cluster import CLUSTER_ERRORS, get_cluster
+from traffic_engine import run_iperf_stream
 
 def plot_metrics(file_path_data, save_file_path_plot, uid_pod_map, interval=1):
     """Reads metrics from the JSON file, downsamples to the specified interval, and plots them."""
     # Load data from JSON file
     try:
-        with open(file_path_data, "r") as f:
-            metrics_over_time = json.load(f)
+        # JSON file, or the NDJSON file streamed during a collection that did not finish
+        metrics_over_time = load_metrics(file_path_data)
     except FileNotFoundError:
         print(f"{file_path_data} not found. Please collect metrics first.")
         return
@@ -80,11 +93,10 @@ def plot_metrics(file_path_data, save_file_path_plot, uid_pod_map, interval=1):
 
 
 def get_all_pod_names(save_path):
-    command = ['kubectl', 'get', 'pods', '--all-namespaces','-ojson']
-    # Open the result file in write mode
+    # Same content as `kubectl get pods --all-namespaces -ojson`
+    pod_list = {'apiVersion': 'v1', 'kind': 'List', 'items': get_cluster().list_pods()}
     with open(save_path, 'w') as f:
-        # Run the command, redirecting stderr to /dev/null
-        subprocess.run(command, stdout=f, stderr=subprocess.DEVNULL, check=True)
+        json.dump(pod_list, f)
 
     print(f"List of pod names saved to '{save_path}'")
 
@@ -92,183 +104,37 @@ def get_all_pod_names(save_path):
 def get_pod_info(search_term):
     """Retrieve the pod name and namespace based on the search term."""
     try:
-        # Get the output of the kubectl command to find the pod
-        result = subprocess.run(
-            ['kubectl', 'get', 'pods', '-A'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        # Parse the output to find the matching pod
-        for line in result.stdout.splitlines()[1:]:  # Skip the header
-            if search_term in line:
-                parts = line.split()
-                namespace = parts[0]
-                pod_name = parts[1]
+        # List the pods of all namespaces, in the order of `kubectl get pods -A`
+        pods = get_cluster().list_pods()
+        names = sorted((pod['metadata']['namespace'], pod['metadata']['name']) for pod in pods)
+
+        # Find the matching pod
+        for namespace, pod_name in names:
+            if search_term in f"{namespace} {pod_name}":
                 return pod_name, namespace
 
         print("Pod not found.")
         return None, None
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing kubectl: {e}")
+    except CLUSTER_ERRORS as e:
+        print(f"Error listing the pods: {e}")
         return None, None
 
-def run_iperf(pod_name, namespace, mode, log_dir,duration=None,ip_address=None, mb=None, packet_length=None):
-   
-    # Set up log file path and header
-    mode_suffix = 'client' if mode == 'client' else 'server'
-    log_file = f"{log_dir}/log_iperf_{mode_suffix}_{pod_name}"
-    if ip_address and mb:
-        log_file += f"_{ip_address}_{mb}_{duration}_{packet_length}"
-    log_file += ".csv"
-
-    header = "Timestamp,Source_IP,Source_Port,Destination_IP,Destination_Port,Protocol,Interval,Transfer,Bitrate,Jitter,Lost_Packets,Lost_Packets_Percent,Unknown1,Unknown2"
-    
-    # Write the header to the log file
-    with open(log_file, 'w') as f:
-        f.write(header + '\n')
-
-    try:
-        # Construct the iperf command
-        if mode == 'client':
-            if not all([ip_address, mb, duration, packet_length]):
-                raise ValueError("Client mode requires ip_address, value, duration, and packet_length parameters.")
-
-            iperf_command = [
-                'kubectl', 'exec', pod_name, '-n', namespace,
-                '--', 'iperf', '-c', ip_address, '-u', '-i', '1',
-                '-b', f"{mb}M", '-t', str(duration), '-l', str(packet_length), '--reportstyle', 'C'
-            ]
-        elif mode == 'server':
-            iperf_command = [
-                'kubectl', 'exec', pod_name, '-n', namespace,
-                '--', 'iperf', '-s', '-u', '-i', '1', '-t', str(duration), '--reportstyle', 'C'
-            ]
-        else:
-            raise ValueError("Mode must be either 'client' or 'server'.")
-
-        # Print the command for debugging
-        print("Running command:", iperf_command)
-
-        # Open the log file in append mode
-        with open(log_file, 'a') as f:
-            # Run the iperf command, redirecting stderr to /dev/null
-            subprocess.run(iperf_command, stdout=f, stderr=subprocess.DEVNULL, check=True)
-        
-        print(f"Log file saved to: {log_file}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing iperf: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-
-
-
-
-def run_iperf_tcp(pod_name, namespace, mode, log_dir,duration=None,ip_address=None, mb=None, packet_length=None):
-   
-    # Set up log file path and header
-    mode_suffix = 'client' if mode == 'client' else 'server'
-    log_file = f"{log_dir}/log_iperf_{mode_suffix}_{pod_name}"
-    if ip_address and mb:
-        log_file += f"_{ip_address}_{mb}_{duration}_{packet_length}"
-    log_file += ".csv"
-
-    header = "Timestamp,Source_IP,Source_Port,Destination_IP,Destination_Port,Protocol,Interval,Transfer,Bitrate,Jitter,Lost_Packets,Lost_Packets_Percent,Unknown1,Unknown2"
-    
-    # Write the header to the log file
-    with open(log_file, 'w') as f:
-        f.write(header + '\n')
-
-    try:
-        # Construct the iperf command
-        if mode == 'client':
-            if not all([ip_address, mb, duration, packet_length]):
-                raise ValueError("Client mode requires ip_address, value, duration, and packet_length parameters.")
-
-            iperf_command = [
-                'kubectl', 'exec', pod_name, '-n', namespace,
-                '--', 'iperf', '-c', ip_address, '-i', '1',
-                '-b', f"{mb}M", '-t', str(duration), '-l', str(packet_length), '--reportstyle', 'C'
-            ]
-        elif mode == 'server':
-            iperf_command = [
-                'kubectl', 'exec', pod_name, '-n', namespace,
-                '--', 'iperf', '-s', '-i', '1', '-t', str(duration), '--reportstyle', 'C'
-            ]
-        else:
-            raise ValueError("Mode must be either 'client' or 'server'.")
-
-        # Print the command for debugging
-        print("Running command:", iperf_command)
-
-        # Open the log file in append mode
-        with open(log_file, 'a') as f:
-            # Run the iperf command, redirecting stderr to /dev/null
-            subprocess.run(iperf_command, stdout=f, stderr=subprocess.DEVNULL, check=True)
-        
-        print(f"Log file saved to: {log_file}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing iperf: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-
-
-def run_iperf_tcp_number_packets(pod_name, namespace, mode, log_dir, ip_address=None, mb=None, packet_length=None):
-    # Set up log file path and header
-    mode_suffix = 'client' if mode == 'client' else 'server'
-    log_file = f"{log_dir}/log_iperf_{mode_suffix}_{pod_name}"
-    if ip_address and mb and packet_length:
-        log_file += f"_{ip_address}_{mb}_{packet_length}"
-    log_file += ".csv"
-
-    header = "Timestamp,Source_IP,Source_Port,Destination_IP,Destination_Port,Protocol,Interval,Transfer,Bitrate,Jitter,Lost_Packets,Lost_Packets_Percent,Unknown1,Unknown2"
-    
-    # Write the header to the log file
-    with open(log_file, 'w') as f:
-        f.write(header + '\n')
-
-    try:
-        # Construct the iperf command
-        if mode == 'client':
-            if not all([ip_address, mb, packet_length]):
-                raise ValueError("Client mode requires ip_address, mb, and packet_length parameters.")
-
-            iperf_command = [
-                'kubectl', 'exec', pod_name, '-n', namespace,
-                '--', 'iperf', '-c', ip_address, '-i', '1',
-                '-n', f"{mb}M", '-l', str(packet_length), '--reportstyle', 'C'
-            ]
-        elif mode == 'server':
-            iperf_command = [
-                'kubectl', 'exec', pod_name, '-n', namespace,
-                '--', 'iperf', '-s', '-i', '1','-P','1', '--reportstyle', 'C'
-            ]
-        else:
-            raise ValueError("Mode must be either 'client' or 'server'.")
+def run_iperf(pod_name, namespace, mode, log_dir,duration=None,ip_address=None, mb=None, packet_length=None, monitor=None, stop_event=None):
+    """UDP iperf session at `mb` Mbit/s for `duration` seconds, see traffic_engine.run_iperf_stream."""
+    return run_iperf_stream(pod_name, namespace, mode, log_dir, ip_address, mb, packet_length, duration=duration,
+                            protocol="udp", monitor=monitor, stop_event=stop_event)
 
-        # Print the command for debugging
-        print("Running command:", iperf_command)
 
-        # Open the log file in append mode
-        with open(log_file, 'a') as f:
-            # Run the iperf command, redirecting stderr to /dev/null
-            subprocess.run(iperf_command, stdout=f, stderr=f, check=True, timeout=800)
+def run_iperf_tcp(pod_name, namespace, mode, log_dir,duration=None,ip_address=None, mb=None, packet_length=None, monitor=None, stop_event=None):
+    """TCP iperf session at `mb` Mbit/s for `duration` seconds, see traffic_engine.run_iperf_stream."""
+    return run_iperf_stream(pod_name, namespace, mode, log_dir, ip_address, mb, packet_length, duration=duration,
+                            protocol="tcp", monitor=monitor, stop_event=stop_event, require_duration=True)
 
-        print(f"Log file saved to: {log_file}")
 
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing iperf: {e}")
-        with open(f"{log_dir}/log_iperf_{mode_suffix}_{pod_name}_ERROR.txt", 'w') as f:
-            f.write(f'\n ERROR subprocess.CalledProcessError: \n {e}\n')
-            f.close()
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        with open(f"{log_dir}/log_iperf_{mode_suffix}_{pod_name}_ERROR.txt", 'w') as f:
-            f.write(f'\n ERROR subprocess.CalledProcessError: \n {e}\n')
-            f.close()
+def run_iperf_tcp_number_packets(pod_name, namespace, mode, log_dir, ip_address=None, mb=None, packet_length=None, monitor=None, stop_event=None):
+    """TCP iperf session sending `mb` MBytes, see traffic_engine.run_iperf_stream."""
+    return run_iperf_stream(pod_name, namespace, mode, log_dir, ip_address, mb, packet_length, protocol="tcp",
+                            monitor=monitor, stop_event=stop_event, timeout=800, stderr_file=True, error_file=True)
 
 
 def create_uid_pod_mapping(save_file_path, pod_list_path):
@@ -312,218 +178,76 @@ def load_uid_pod_map(csv_file_path):
         print(f"{csv_file_path} not found.")
         return {}
     
-def fetch_host_energy_metrics(prometheus_url, query):
-    try:
-        # Send the query to Prometheus
-        response = requests.get(f"{prometheus_url}/api/v1/query", params={'query': query})
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        
-        # Parse the JSON response
-        result = response.json()
-        
-        if result['status'] != 'success' or 'data' not in result:
-            print(f"Unexpected response structure: {result}")
-            return {}
-
-        # Initialize the metrics dictionary
-        metrics_by_node = {}
-        
-        for entry in result['data']['result']:
-            # Extract node_name and metric value
-            node_name = entry['metric'].get('node', 'unknown')
-            if node_name == "unknown":
-                # print("Warning: Container ID is unknown for entry:", entry)
-                continue  # Skip entries with no valid container ID
-            
-            value = float(entry['value'][1])  # Metric value (e.g., power consumption)
-            timestamp = time.time()  # Current timestamp
-            
-            # Initialize the container ID entry if it doesn't exist
-            if node_name not in metrics_by_node:
-                metrics_by_node[node_name] = []
-            
-            # Append the metric entry
-            metrics_by_node[node_name].append({
-                'timestamp': timestamp,
-                'value': value,
-            })
-
-        return metrics_by_node
-    
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching metrics from Prometheus: {e}")
-        return {}
-    except (ValueError, KeyError) as e:
-        print(f"Error parsing Prometheus response: {e}")
-        return {}
-
-
-def fetch_energy_metrics(prometheus_url, query):
-    """
-    Fetches metrics from Prometheus and returns a dictionary of values grouped by container ID.
-    
-    Args:
-        prometheus_url (str): Base URL of the Prometheus server.
-        query (str): Prometheus query to retrieve the desired metrics.
-    
-    Returns:
-        dict: A dictionary where keys are container IDs and values are lists of metric entries.
-    """
-    try:
-        # Send the query to Prometheus
-        response = requests.get(f"{prometheus_url}/api/v1/query", params={'query': query})
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        
-        # Parse the JSON response
-        result = response.json()
-        
-        if result['status'] != 'success' or 'data' not in result:
-            print(f"Unexpected response structure: {result}")
-            return {}
-
-        # Initialize the metrics dictionary
-        metrics_by_container = {}
-        
-        for entry in result['data']['result']:
-            # Extract container_id and metric value
-            container_id = entry['metric'].get('container_id', 'unknown')
-            if container_id == "unknown":
-                # print("Warning: Container ID is unknown for entry:", entry)
-                continue  # Skip entries with no valid container ID
-            
-            value = float(entry['value'][1])  # Metric value (e.g., power consumption)
-            cmdline = entry['metric'].get('cmdline', 'unknown')  # Command line info
-            timestamp = time.time()  # Current timestamp
-            
-            # Initialize the container ID entry if it doesn't exist
-            if container_id not in metrics_by_container:
-                metrics_by_container[container_id] = []
-            
-            # Append the metric entry
-            metrics_by_container[container_id].append({
-                'timestamp': timestamp,
-                'value': value,
-                'cmdline': cmdline
-            })
-
-        return metrics_by_container
-    
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching metrics from Prometheus: {e}")
-        return {}
-    except (ValueError, KeyError) as e:
-        print(f"Error parsing Prometheus response: {e}")
-        return {}
-
-
-def fetch_cpu_metrics(prometheus_url, query, pod_name):
-    try:
-        # Send the query to Prometheus
-        response = requests.get(f"{prometheus_url}/api/v1/query", params={'query': query})
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        
-        # Parse the JSON response
-        result = response.json()
-        print("result",result)
-        
-        if result['status'] != 'success' or 'data' not in result:
-            print(f"Unexpected response structure: {result}")
-            return {}
-
-        # Initialize the metrics dictionary
-        metrics_by_pod = {}
-        
-        for entry in result['data']['result']:
-            
-            value = float(entry['value'][1])  # Metric value (e.g., power consumption)
-            timestamp = time.time()  # Current timestamp
-            
-            # Initialize the container ID entry if it doesn't exist
-            if pod_name not in metrics_by_pod:
-                metrics_by_pod[pod_name] = []
-            
-            # Append the metric entry
-            metrics_by_pod[pod_name].append({
-                'timestamp': timestamp,
-                'value': value,
-            })
-
-        return metrics_by_pod
-    
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching metrics from Prometheus: {e}")
-        return {}
-    except (ValueError, KeyError) as e:
-        print(f"Error parsing Prometheus response: {e}")
-        return {}
-
-
 def collect_metrics(duration, save_file_path, prometheus_url, mode, pod_name_cpu_metrics):
-    start_time = time.time()
-    metrics_over_time={}
+    # Samples are streamed to an NDJSON file while collecting, see metrics_writer.py, and kept in columns
+    writer = MetricsWriter(ndjson_path(save_file_path))
+    store = SeriesStore()
     
     # Define the Prometheus queries basecd on mode
     if mode=="cpu":
         # query = 'rate(container_cpu_usage_seconds_total{}[1m]) * 1000'
-        query = '100 * (sum(rate(container_cpu_usage_seconds_total{pod="'+pod_name_cpu_metrics+'"}['+str(round(duration))+'s])) by (pod)/ sum(kube_pod_container_resource_limits{pod="'+pod_name_cpu_metrics+'", resource="cpu"}) by (pod))'
+        query = cpu_query(pod_name_cpu_metrics, window=f"{round(duration)}s")  # One rate over the whole duration
         print('query',query)
-        metrics = fetch_cpu_metrics(prometheus_url, query, pod_name_cpu_metrics)
-        print("metrics",metrics)
-        for id, data_points in metrics.items():
-            print("id, data_points",id, data_points)
-            if id not in metrics_over_time:
-                metrics_over_time[id] = []
-            metrics_over_time[id].extend(data_points)
+        try:
+            metrics = fetch_cpu_metrics(prometheus_url, query, pod_name_cpu_metrics)
+            print("metrics",metrics)
+            writer.write(metrics)
+            store.append(metrics)
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
 
     elif mode == "energy":
-        query = 'sum(scaph_process_power_consumption_microwatts{container_scheduler="docker"} / 1000000) by (container_id)'
-        while time.time() - start_time < duration:
+        query = energy_query()
+        ticks = TickScheduler(1, duration=duration)  # Polling interval
+        while ticks.wait():
             try:
                 # Fetch both power consumption metrics
                 metrics = fetch_energy_metrics(prometheus_url, query)
                 
-                # Extract CPU usage values
-                for id, data_points in metrics.items():
-                    if id not in metrics_over_time:
-                        metrics_over_time[id] = []
-                    metrics_over_time[id].extend(data_points)
-
-                time.sleep(1)  # Adjust polling interval as needed
+                writer.write(metrics)
+                store.append(metrics)
 
             except Exception as e:
+                # The next tick is the retry: the Prometheus client already retries and backs off
                 print(f"Error collecting metrics: {e}")
-                time.sleep(5)  # Retry after some delay if error occurs
+        save_tick_report(ticks, save_file_path)
 
     elif mode == "host_energy":
-        query = 'scaph_host_power_microwatts / 1000000 > 0.001'
-        while time.time() - start_time < duration:
+        query = HOST_ENERGY_QUERY
+        ticks = TickScheduler(1, duration=duration)  # Polling interval
+        while ticks.wait():
             try:
                 # Fetch both power consumption metrics
                 metrics = fetch_host_energy_metrics(prometheus_url, query)
                 
-                # Extract CPU usage values
-                for id, data_points in metrics.items():
-                    if id not in metrics_over_time:
-                        metrics_over_time[id] = []
-                    metrics_over_time[id].extend(data_points)
-
-                time.sleep(1)  # Adjust polling interval as needed
+                writer.write(metrics)
+                store.append(metrics)
 
             except Exception as e:
+                # The next tick is the retry: the Prometheus client already retries and backs off
                 print(f"Error collecting metrics: {e}")
-                time.sleep(5)  # Retry after some delay if error occurs
+        save_tick_report(ticks, save_file_path)
     else: 
         print(f"Error collecting metrics due to invalid mode: {mode}")
+        writer.close()
         return None
 
-    # Save collected metrics to a file
-    with open(save_file_path, "w") as f:
-        json.dump(metrics_over_time, f)
+    # Save collected metrics to a file, in the {id: [entries]} format of the analysis
+    writer.close()
+    store.save_json(save_file_path)
 
 
-def collect_metrics_with_stop_event(save_file_path, prometheus_url, mode, pod_name_cpu_metrics, stop_event):
+def collect_metrics_with_stop_event(save_file_path, prometheus_url, mode, pod_name_cpu_metrics, stop_event, scaphandre_url=None,
+                                    collection="poll", step=1, targets=None, energy=None):
     """
-    Collect metrics continuously until a stop event is triggered.
+    Collect the metrics of one mode continuously until a stop event is triggered. The
+    experiment scripts use collect_all_metrics_with_stop_event, which samples several modes
+    on one clock; this collector is kept for the Scaphandre and backfill collections.
+
+    With collection="poll" an instant query is sent every second during the run. With
+    collection="backfill" nothing is sent during the run: only the start and stop times are
+    recorded, and at stop the whole window is pulled with a few query_range calls, one point
+    every `step` seconds with the Prometheus timestamps.
     
     Args:
         save_file_path (str): Path to save the collected metrics.
@@ -531,49 +255,203 @@ def collect_metrics_with_stop_event(save_file_path, prometheus_url, mode, pod_na
         mode (str): Mode of metrics collection ('cpu', 'energy', or 'host_energy').
         pod_name_cpu_metrics (str): Pod name for CPU metrics.
         stop_event (threading.Event): Event to signal stopping the collection.
+        scaphandre_url (str): Optional Scaphandre exporter URL. If set, 'energy' and 'host_energy'
+            are scraped directly from Scaphandre instead of going through Prometheus.
+        collection (str): 'poll' or 'backfill' (Prometheus only, ignored with scaphandre_url).
+        step (float): Seconds between two backfilled points, normally the Prometheus scrape interval.
+        targets (ExperimentTargets): Optional experiment pods the 'energy' mode is restricted to, so
+            only their series are downloaded. The matcher is rebuilt on every tick as pods change.
+        energy (EnergyAccumulator): Running energy totals of the 'energy' and 'host_energy' modes, whose
+            phases are marked by the caller. A single-phase one is used if not given. The totals are
+            saved next to the metrics file at stop (metrics_energy.json -> metrics_energy_summary.json).
+
+    The sampling quality of every series is saved next to the metrics file at stop
+    (metrics_energy.json -> metrics_energy_quality.json), see sampling_quality.py.
     """
-    metrics_over_time = {}
+    # Samples are streamed to an NDJSON file while collecting, see metrics_writer.py, and kept in columns
+    writer = MetricsWriter(ndjson_path(save_file_path))
+    store = SeriesStore()
+    if energy is None and mode in {"energy", "host_energy"}:
+        energy = EnergyAccumulator()
+    quality = SamplingQuality(step if collection == "backfill" else 1)
+    query = None
+    ticks = None
     
     try:
         # Define the Prometheus query based on the mode
         if mode == "cpu":
-            query = (
-                f'100 * (sum(rate(container_cpu_usage_seconds_total{{pod="{pod_name_cpu_metrics}"}}[5s])) by (pod) '
-                f'/ sum(kube_pod_container_resource_limits{{pod="{pod_name_cpu_metrics}", resource="cpu"}}) by (pod))'
-            )
+            query = cpu_query(pod_name_cpu_metrics)
         elif mode == "energy":
-            query = 'sum(scaph_process_power_consumption_microwatts{container_scheduler="docker"} / 1000000) by (container_id)'
+            query = energy_query(targets)
         elif mode == "host_energy":
-            query = 'scaph_host_power_microwatts / 1000000 > 0.001'
+            query = HOST_ENERGY_QUERY
         else:
             print(f"Invalid mode: {mode}")
             return
 
-        # Continuous collection loop
-        while not stop_event.is_set():
+        if collection == "backfill" and scaphandre_url and mode != "cpu":
+            print("Backfill needs the Prometheus history, polling Scaphandre instead")
+        elif collection == "backfill":
+            start_time = time.time()
+            stop_event.wait()
+            end_time = time.time()
+            quality.start_time, quality.stop_time = start_time, end_time  # The window that was pulled
+            if mode == "energy":
+                query = energy_query(targets)  # Every pod seen during the run
+            key_label = {"energy": "container_id", "host_energy": "node", "cpu": "pod"}[mode]
+            request_start = time.monotonic()
+            errors = []
+            metrics = fetch_range_metrics(prometheus_url, query, start_time, end_time, step, key_label,
+                                          default_key=pod_name_cpu_metrics if mode == "cpu" else None, errors=errors)
+            quality.observe_request(time.monotonic() - request_start, sum(map(len, metrics.values())), error=bool(errors))
+            quality.observe(metrics)
+            writer.write(metrics)
+            store.append(metrics)
+            if energy is not None:
+                energy.add(metrics)
+            return
+
+        # Continuous collection loop, one tick per second
+        ticks = TickScheduler(1, stop_event=stop_event)
+        while ticks.wait():
+            request_start = time.monotonic()
             try:
                 # Fetch metrics based on the mode
                 if mode == "cpu":
                     metrics = fetch_cpu_metrics(prometheus_url, query, pod_name_cpu_metrics)
+                elif mode == "energy" and scaphandre_url:
+                    metrics = fetch_energy_metrics_direct(scaphandre_url, container_ids=targets.container_ids() if targets else None)
+                elif mode == "host_energy" and scaphandre_url:
+                    metrics = fetch_host_energy_metrics_direct(scaphandre_url, urlparse(scaphandre_url).hostname)
                 elif mode in {"energy", "host_energy"}:
+                    if mode == "energy":
+                        query = energy_query(targets)
                     metrics = fetch_energy_metrics(prometheus_url, query)
+                quality.observe_request(time.monotonic() - request_start, sum(map(len, metrics.values())))
 
                 # Collect the metrics over time
-                for id, data_points in metrics.items():
-                    if id not in metrics_over_time:
-                        metrics_over_time[id] = []
-                    metrics_over_time[id].extend(data_points)
-
-                time.sleep(1)  # Polling interval
+                quality.observe(metrics)
+                writer.write(metrics)
+                store.append(metrics)
+                if energy is not None:
+                    energy.add(metrics)
             except Exception as e:
+                # The next tick is the retry: the Prometheus client already retries and backs off
+                quality.observe_request(time.monotonic() - request_start, error=True)
                 print(f"Error collecting metrics: {e}")
-                time.sleep(5)  # Retry after a delay if an error occurs
+        save_tick_report(ticks, save_file_path)
 
     finally:
-        # Save collected metrics to a file
-        with open(save_file_path, "w") as f:
-            json.dump(metrics_over_time, f)
+        quality.stop()
+        # Save collected metrics to a file, in the {id: [entries]} format of the analysis
+        writer.close()
+        store.save_json(save_file_path)
         print(f"Metrics saved to {save_file_path}")
+        if energy is not None and mode in {"energy", "host_energy"}:
+            energy.save(energy_summary_path(save_file_path))
+            print(f"Energy summary saved to {energy_summary_path(save_file_path)}")
+        if query:
+            quality.save(quality_path(save_file_path), ticks)
+        if query and (not scaphandre_url or mode == "cpu"):
+            stats = prometheus_client(prometheus_url).latency_stats().get(query)
+            if stats:
+                print(f"Prometheus query latency ({mode}): {stats['count']} queries, {stats['errors']} errors, "
+                      f"p50 {stats['p50_seconds'] * 1000:.1f} ms, p95 {stats['p95_seconds'] * 1000:.1f} ms, "
+                      f"max {stats['max_seconds'] * 1000:.1f} ms")
+
+
+def mode_path(save_file_path, mode):
+    """Metrics of one mode of an aligned collection, in the {id: [entries]} format (metrics.csv -> metrics_energy.json)."""
+    return os.path.splitext(save_file_path)[0] + f"_{mode}.json"
+
+
+def collect_all_metrics_with_stop_event(save_file_path, prometheus_url, stop_event, modes=("energy", "host_energy", "cpu"),
+                                        pod_name_cpu_metrics=None, period=1, targets=None, energy=None, traffic=None):
+    """
+    Collect several metric types on one shared clock until a stop event is triggered.
+
+    On every tick the queries of all the modes are sent concurrently and evaluated by
+    Prometheus at the same instant (the tick time), so the energy, host energy and CPU
+    series are aligned. Ticks are streamed to an NDJSON file, and at stop the aligned
+    dataset is written to save_file_path as a CSV with one row per tick and one
+    "<mode>/<id>" column per series (see load_aligned_metrics). Every mode is also saved
+    in the {id: [entries]} format of plot_metrics and the notebooks, stamped with the
+    tick time (metrics.csv -> metrics_energy.json, see mode_path).
+
+    Args:
+        save_file_path (str): Path of the aligned CSV dataset.
+        prometheus_url (str): Prometheus server URL.
+        stop_event (threading.Event): Event to signal stopping the collection.
+        modes (tuple): Metric types to collect: 'energy', 'host_energy' and/or 'cpu'.
+        pod_name_cpu_metrics (str): Pod name for CPU metrics (required with 'cpu').
+        period (float): Seconds between two ticks.
+        targets (ExperimentTargets): Optional experiment pods the 'energy' mode is restricted to.
+        energy (EnergyAccumulator): Running energy totals of the 'energy' and 'host_energy' columns, keyed
+            like the columns ("<mode>/<id>"), saved next to the dataset at stop.
+        traffic (TrafficMonitor): Optional live iperf throughput, added on every tick as one
+            "traffic/<flow>" column per flow (bits per second), next to the power columns.
+
+    The sampling quality of every column is saved next to the dataset at stop, see sampling_quality.py.
+    """
+    fetchers = {
+        "energy": lambda tick_time: fetch_energy_metrics(prometheus_url, energy_query(targets), tick_time),
+        "host_energy": lambda tick_time: fetch_host_energy_metrics(prometheus_url, HOST_ENERGY_QUERY, tick_time),
+        "cpu": lambda tick_time: fetch_cpu_metrics(prometheus_url, cpu_query(pod_name_cpu_metrics), pod_name_cpu_metrics, tick_time),
+    }
+    unknown_modes = [mode for mode in modes if mode not in fetchers]
+    if unknown_modes or ("cpu" in modes and not pod_name_cpu_metrics):
+        print(f"Invalid modes {unknown_modes} or missing pod name for the CPU metrics")
+        return
+
+    writer = MetricsWriter(ndjson_path(save_file_path))
+    stores = {mode: SeriesStore() for mode in modes}
+    if energy is None:
+        energy = EnergyAccumulator()
+    quality = SamplingQuality(period)
+
+    def timed_fetch(mode, tick_time):
+        request_start = time.monotonic()
+        try:
+            metrics = fetchers[mode](tick_time)
+        except Exception:
+            quality.observe_request(time.monotonic() - request_start, error=True)
+            raise
+        quality.observe_request(time.monotonic() - request_start, sum(map(len, metrics.values())))
+        return metrics
+
+    ticks = TickScheduler(period, stop_event=stop_event)
+    try:
+        with ThreadPoolExecutor(max_workers=len(modes)) as executor:
+            while ticks.wait():
+                tick_time = time.time()
+                futures = {mode: executor.submit(timed_fetch, mode, tick_time) for mode in modes}
+                row = {'timestamp': tick_time}
+                for mode, future in futures.items():
+                    try:
+                        metrics = future.result()
+                    except Exception as e:
+                        print(f"Error collecting {mode} metrics: {e}")
+                        continue
+                    row[mode] = {id: data_points[-1]['value'] for id, data_points in metrics.items() if data_points}
+                    stores[mode].append({id: [{**data_points[-1], 'timestamp': tick_time}]
+                                         for id, data_points in metrics.items() if data_points})
+                    columns = {f"{mode}/{id}": [{'timestamp': tick_time, 'value': value}] for id, value in row[mode].items()}
+                    quality.observe(columns)
+                    if mode in {"energy", "host_energy"}:
+                        energy.add(columns)
+                if traffic is not None:
+                    row['traffic'] = traffic.throughput()
+                writer.write(row)
+    finally:
+        quality.stop()
+        writer.close()
+        save_tick_report(ticks, save_file_path)
+        quality.save(quality_path(save_file_path), ticks)
+        load_aligned_metrics(writer.path).to_csv(save_file_path)
+        print(f"Aligned metrics saved to {save_file_path}")
+        for mode, store in stores.items():
+            store.save_json(mode_path(save_file_path, mode))
+        energy.save(energy_summary_path(save_file_path))
 
 
 def generate_experiment_dir(mb, duration, packet_length, description):
@@ -585,6 +463,28 @@ def generate_experiment_dir(mb, duration, packet_length, description):
 
 
 
+def run_in_pod(pod_name, namespace, command, container=None):
+    """
+    Run a command in a pod with its output on the terminal. Errors are printed, not raised.
+
+    Args:
+        pod_name (str): Name of the pod.
+        namespace (str): Kubernetes namespace of the pod.
+        command (list): Command and its arguments.
+        container (str): Container of the pod, the default one if None.
+
+    Returns:
+        bool: True if the command succeeded.
+    """
+    try:
+        print(f"Running in {namespace}/{pod_name}: {' '.join(command)}")
+        get_cluster().exec(pod_name, namespace, command, container=container, stdout=sys.stdout, stderr=sys.stderr, check=True)
+        return True
+    except CLUSTER_ERRORS as e:
+        print(f"Command failed: {e}")
+        return False
+
+
 def check_ping(pod_name, namespace, target_ip, max_retries=4):
     """
     Check connectivity from a pod to a target IP with retries.
@@ -601,14 +501,11 @@ def check_ping(pod_name, namespace, target_ip, max_retries=4):
     retry_count = 0
     while retry_count < max_retries:
         try:
-            ping_command = [
-                "kubectl", "exec", pod_name, "-n", namespace,
-                "--", "ping", "-c", "3", target_ip
-            ]
-            subprocess.run(ping_command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            ping_command = ["ping", "-c", "3", target_ip]
+            get_cluster().exec(pod_name, namespace, ping_command, check=True)
             print(f"Ping from {pod_name} to {target_ip} successful.")
             return True  # Ping successful
-        except subprocess.CalledProcessError as e:
+        except CLUSTER_ERRORS as e:
             retry_count += 1
             print(f"Ping attempt {retry_count} failed: {e}")
             time.sleep(1)  # Wait 1 second before retrying
@@ -639,21 +536,14 @@ def download_tcpdump(pod,namespace, download_to_dir="pcap_files"):
     container_name = "tcpdump"  # Specify the container name in the pod pod
     
     try:
-        # Run kubectl cp command to copy files
-        command = [
-            "kubectl", "cp",
-            f"{pod}:{remote_path}",  # Pod and path in the container
-            download_to_dir,  # Local destination directory
-            "-c", container_name,  # Specify the container within the pod
-            "-n", namespace # namespace of the pod
-        ]
-        print(f"Running command: {' '.join(command)}")
-        subprocess.run(command, check=True)
+        # Copy the files out of the container, like kubectl cp
+        print(f"Copying {namespace}/{pod}:{remote_path} (container {container_name}) to {download_to_dir}")
+        get_cluster().copy_from(pod, namespace, remote_path, download_to_dir, container=container_name)
         print(f"Files successfully downloaded to: {download_to_dir}")
         
         return os.path.abspath(download_to_dir)
     
-    except subprocess.CalledProcessError as e:
+    except CLUSTER_ERRORS as e:
         print(f"Error during file download: {e}")
         raise RuntimeError(f"Failed to download files from {pod}:{remote_path}")
 